@@ -0,0 +1,135 @@
+# aoi.py
+# Ingestion of uploaded AOI files (KML, GeoJSON, zipped shapefile).
+#
+# receive() streams the upload to a temporary file in chunks, hashing it as it goes and rejecting it once it
+# exceeds the size limit, so a large or hostile upload is never held in memory. read() parses the file,
+# reprojects it to EPSG:4326 and simplifies every boundary to a tolerance below the 10 m analysis pixel: vertex
+# density finer than a pixel only makes the EE payload and the reductions slower, it cannot change the result.
+# Parsed geometries are cached by content hash, so the same farm file uploaded again skips parsing entirely.
+#
+# Usage (inside an endpoint):
+#   upload = await aoi.receive(aoi_file)
+#   try:
+#       return await ee_executor.run(work, upload, ...)    # work() calls aoi.read(upload)
+#   finally:
+#       upload.discard()
+#
+# Configuration (environment):
+#   AOI_MAX_UPLOAD_MB   largest accepted upload (default 20)
+#   AOI_SIMPLIFY_M      simplification tolerance in metres, 0 disables it (default 2.5, a quarter pixel)
+#   AOI_CACHE_SIZE      parsed geometries kept in memory (default 256)
+import hashlib, os, tempfile, threading
+from collections import OrderedDict
+from fastapi import HTTPException
+import metrics
+
+MAX_UPLOAD_BYTES = int(float(os.environ.get('AOI_MAX_UPLOAD_MB', '20')) * 1024 * 1024)
+SIMPLIFY_TOLERANCE_M = float(os.environ.get('AOI_SIMPLIFY_M', '2.5'))
+CACHE_SIZE = int(os.environ.get('AOI_CACHE_SIZE', '256'))
+
+SUFFIXES = ('.kml', '.geojson', '.json', '.zip')
+_CHUNK_SIZE = 1024 * 1024
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+class Upload:
+    """An uploaded AOI file spooled to disk. `digest` is the SHA-256 of its content."""
+
+    def __init__(self, path, filename, suffix, digest, size):
+        self.path = path
+        self.filename = filename
+        self.suffix = suffix
+        self.digest = digest
+        self.size = size
+
+    def discard(self):
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+
+async def receive(upload_file, max_bytes=None):
+    """Stream a starlette UploadFile to a temporary file. Raises HTTPException 400 for an unsupported file type
+    and 413 when the file is larger than `max_bytes` (default AOI_MAX_UPLOAD_MB)."""
+    max_bytes = MAX_UPLOAD_BYTES if max_bytes is None else max_bytes
+    suffix = os.path.splitext(upload_file.filename or '')[1].lower()
+    if suffix not in SUFFIXES:
+        raise HTTPException(status_code=400, detail=f"Unsupported AOI file type '{suffix}', expected one of {SUFFIXES}")
+    h = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix='aoi-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = await upload_file.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"AOI file larger than {max_bytes // (1024 * 1024)} MB")
+                h.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    metrics.observe_upload(size)
+    return Upload(path, upload_file.filename, suffix, h.hexdigest(), size)
+
+
+def simplify(gdf, tolerance_m=None):
+    """Repair invalid rings, then simplify in the local UTM zone so the tolerance is in metres."""
+    tolerance_m = SIMPLIFY_TOLERANCE_M if tolerance_m is None else tolerance_m
+    gdf = gdf.copy()
+    invalid = ~gdf.geometry.is_valid
+    if invalid.any():
+        gdf.loc[invalid, 'geometry'] = gdf.geometry[invalid].buffer(0)
+    if tolerance_m <= 0:
+        return gdf
+    utm = gdf.estimate_utm_crs()
+    projected = gdf.to_crs(utm)
+    # preserve_topology keeps holes and never collapses a small field to nothing
+    projected['geometry'] = projected.geometry.simplify(tolerance_m, preserve_topology=True)
+    return projected.to_crs(epsg=4326)
+
+
+def _parse(path, suffix):
+    import geopandas as gpd
+    try:
+        gdf = gpd.read_file(('zip://' + path) if suffix == '.zip' else path)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not read AOI file: {e}")
+    gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
+    if gdf.empty:
+        raise HTTPException(status_code=400, detail="AOI file contains no geometries")
+    if gdf.crs is None:
+        gdf = gdf.set_crs(epsg=4326)
+    gdf = simplify(gdf.to_crs(epsg=4326)).reset_index(drop=True)
+    gdf.attrs['area_ha'] = float(gdf.to_crs(gdf.estimate_utm_crs()).area.sum() / 1e4)
+    return gdf
+
+
+def read(upload):
+    """GeoDataFrame (EPSG:4326, simplified) of an Upload, from the geometry cache when the same content was
+    read before. The returned frame is a copy and may be modified."""
+    key = (upload.digest, upload.suffix, SIMPLIFY_TOLERANCE_M)
+    with _lock:
+        gdf = _cache.get(key)
+        if gdf is not None:
+            _cache.move_to_end(key)
+    metrics.cache_outcome('aoi', gdf is not None)
+    if gdf is None:
+        if upload.path is None:
+            raise HTTPException(status_code=400, detail="AOI upload already discarded")
+        with metrics.stage('read_aoi'):
+            gdf = _parse(upload.path, upload.suffix)
+        with _lock:
+            _cache[key] = gdf
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    metrics.annotate(aoi_size=metrics.aoi_size_class(gdf.attrs['area_ha']))
+    return gdf.copy()
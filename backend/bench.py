@@ -0,0 +1,402 @@
+# bench.py
+# Offline benchmarks for the model and index hot paths, and a count of Earth Engine server calls per API request.
+#
+# Nothing here needs network access or Earth Engine credentials. Suites that touch `ee` run against FakeEE, a
+# stand-in module that builds no real graph but counts every node created (graph size) and every call that
+# would reach the EE servers (getInfo, getMapId, tile fetches, task starts, ee.data.*). An extra getInfo() added
+# to an endpoint therefore shows up as a changed `server_calls` entry in the JSON report. getInfo() answers with
+# a value for every statistic asked for, so responses are cached as real ones would be and the warm runs
+# measure the cache.
+#
+# Suites:
+#   parse       models.parse_js_variables vs. reading the model bundle, models.init_from_values
+#   graph       graph construction of calculate_CWC / CCC / LAI_GREEN and of every registered index,
+#               separately and fused through index_engine
+#   gp_local    gp_local.predict (mean, and mean + variance) on arrays of increasing size, drawn around each
+#               model's training spectra
+#   index_numpy index_engine.evaluate_numpy on arrays of the same sizes, reflectance 0-6000
+#   api         each FastAPI endpoint against FakeEE: server calls and graph nodes, cold and with a warm cache
+#
+# Usage:
+#   python bench.py                                  # all suites, JSON report on stdout
+#   python bench.py --suites parse,gp_local --out bench.json
+#   python bench.py --compare baseline.json bench.json   # exit status 1 on a regression
+import argparse, json, os, platform, statistics, sys, tempfile, time, types
+from collections import Counter
+
+_DIR = os.path.dirname(os.path.abspath(__file__))
+JS_PATH = os.path.join(_DIR, 'PUSAeCMS_code.txt')
+
+SUITES = ('parse', 'graph', 'gp_local', 'index_numpy', 'api')
+# Suites that build ee objects and so run against FakeEE
+EE_SUITES = ('parse', 'graph', 'api')
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+
+# --compare: a timing regresses when it is this much slower than the baseline
+DEFAULT_TOLERANCE = 0.25
+
+
+class _Info(dict):
+    """getInfo() result: any statistic looked up has a value, any feature collection holds the fields of the
+    current request."""
+
+    def __init__(self, fake, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._fake = fake
+
+    def get(self, key, default=None):
+        return self[key]
+
+    def __missing__(self, key):
+        if key == 'features':
+            return [{'properties': _Info(self._fake, field_id=fid)} for fid in self._fake.field_ids]
+        if key == 'date':
+            return ['2024-01-01', '2024-02-01']
+        if key == 'value':
+            return [0.42, 0.45]
+        if key == 'images':
+            return [3, 2]
+        if key.endswith('_histogram'):
+            return {'bucketMin': 0.0, 'bucketWidth': 0.1, 'histogram': [10, 40, 50, 20]}
+        if key.endswith('_count'):
+            return 120
+        return 0.42
+
+
+class FakeEE(types.ModuleType):
+    """Module object installed as `ee` by install_fake_ee(). `nodes` counts graph nodes created,
+    `server_calls` counts calls that would be sent to Earth Engine, by method name, and `field_ids` the
+    `field_id` of every ee.Feature created."""
+
+    # Methods of ee objects that make a request to the EE servers
+    SERVER_METHODS = ('getInfo', 'getMapId', 'getDownloadURL', 'getThumbURL', 'start', 'evaluate')
+
+    def __init__(self):
+        super().__init__('ee')
+        self.nodes = 0
+        self.server_calls = Counter()
+        self.field_ids = []
+        fake = self
+
+        class _Tiles:
+            def fetch_tile(self, x, y, z):
+                fake.server_calls['fetch_tile'] += 1
+                return b'\x89PNG\r\n\x1a\n'
+
+        class _Meta(type):
+            def __getattr__(cls, name):
+                if name.startswith('__'):
+                    raise AttributeError(name)
+                return fake._node
+
+        class Computed(metaclass=_Meta):
+            def __init__(self, *args, **kwargs):
+                fake.nodes += 1
+
+            def __getattr__(self, name):
+                if name.startswith('__'):
+                    raise AttributeError(name)
+                if name == 'id':
+                    return 'FAKE_TASK'
+                if name in FakeEE.SERVER_METHODS:
+                    return lambda *a, **k: fake._server_call(name)
+                return fake._node
+
+        class _Data:
+            def __getattr__(self, name):
+                if name.startswith('_'):
+                    raise AttributeError(name)
+
+                def call(*args, **kwargs):
+                    fake.server_calls['data.' + name] += 1
+                    return [{'state': 'COMPLETED', 'progress': 1.0}] if name == 'getTaskStatus' else {}
+                return call
+
+        class Feature(Computed):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                if len(args) > 1 and isinstance(args[1], dict) and 'field_id' in args[1]:
+                    fake.field_ids.append(args[1]['field_id'])
+
+        self._Tiles = _Tiles
+        self._Computed = Computed
+        for name in ('Image', 'ImageCollection', 'Array', 'List', 'String', 'Number', 'Dictionary', 'Date',
+                     'Geometry', 'FeatureCollection', 'Filter', 'Reducer', 'Kernel', 'Terrain', 'Algorithms', 'Join'):
+            setattr(self, name, type(name, (Computed,), {}))
+        self.Feature = Feature
+        self.batch = types.SimpleNamespace(Export=types.SimpleNamespace(
+            image=Computed, table=Computed, video=Computed))
+        self.data = _Data()
+        self.EEException = type('EEException', (Exception,), {})
+
+    def _node(self, *args, **kwargs):
+        return self._Computed()
+
+    def _server_call(self, name):
+        self.server_calls[name] += 1
+        if name == 'getMapId':
+            return {'mapid': 'fake', 'token': '', 'tile_fetcher': self._Tiles()}
+        if name == 'getInfo':
+            return _Info(self)
+        return None
+
+    def Initialize(self, *args, **kwargs):
+        self.server_calls['Initialize'] += 1
+
+    def Authenticate(self, *args, **kwargs):
+        pass
+
+    def reset(self):
+        self.nodes = 0
+        self.server_calls = Counter()
+        self.field_ids = []
+
+
+def install_fake_ee():
+    """Put a FakeEE in sys.modules['ee'] (replacing the real module for the rest of the process)."""
+    fake = FakeEE()
+    sys.modules['ee'] = fake
+    for name in ('models', 'indices', 'index_engine', 'timeseries', 'utils', 'main'):
+        sys.modules.pop(name, None)
+    return fake
+
+
+def _time(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return {'min': min(samples), 'median': statistics.median(samples), 'repeat': repeat}
+
+
+def bench_parse(repeat):
+    import model_bundle, models
+    bundle = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'models.npz')
+    vals = models.parse_js_variables(JS_PATH)
+    model_bundle.compile_bundle(JS_PATH, bundle, vals)
+    return {
+        'parse_js_variables': _time(lambda: models.parse_js_variables(JS_PATH), repeat),
+        'read_bundle': _time(lambda: model_bundle.read_bundle(bundle), repeat),
+        'init_from_values': _time(lambda: models.init_from_values(vals), repeat),
+    }
+
+
+def _graph(fake, fn, repeat):
+    fake.reset()
+    fn()
+    nodes = fake.nodes
+    result = _time(fn, repeat)
+    result['nodes'] = nodes
+    return result
+
+
+def bench_graph(fake, repeat):
+    import model_bundle, models, indices, index_engine
+    models.init_from_values(model_bundle.load_values(JS_PATH, write=False))
+    image = fake.Image()
+    result = {
+        'calculate_CWC': _graph(fake, lambda: models.calculate_CWC(image), repeat),
+        'calculate_CCC': _graph(fake, lambda: models.calculate_CCC(image), repeat),
+        'calculate_LAI_GREEN': _graph(fake, lambda: models.calculate_LAI_GREEN(image), repeat),
+    }
+    names = sorted(indices.INDEX_EXPRESSIONS)
+    for name in names:
+        result['indices.' + name] = _graph(fake, lambda: index_engine.evaluate_ee(image, [name]), repeat)
+    result['indices.all_separate'] = _graph(
+        fake, lambda: [index_engine.evaluate_ee(image, [n]) for n in names], repeat)
+    result['index_engine.all_fused'] = _graph(fake, lambda: index_engine.evaluate_ee(image, names), repeat)
+    return result
+
+
+def _reflectance(n, rng, vals, suffix):
+    """Sentinel-2 surface reflectance (0-10000) for one model: its training spectra with a little noise,
+    mapped back through mx/sx, so the benchmark runs on inputs inside the range the model was fitted on."""
+    import numpy as np
+    x_train = np.asarray(vals['X_train_' + suffix], dtype=np.float64)
+    mx = np.ravel(vals['mx_' + suffix])
+    sx = np.ravel(vals['sx_' + suffix])
+    x_norm = x_train[rng.integers(0, len(x_train), n)] + 0.1 * rng.standard_normal((n, x_train.shape[1]))
+    return np.clip(mx + x_norm * sx, 0.0, 10000.0)
+
+
+def bench_gp_local(sizes, repeat):
+    import numpy as np
+    import gp_local, model_bundle
+    vals = model_bundle.load_values(JS_PATH, write=False)
+    gp_local.init_from_values(vals)
+    rng = np.random.default_rng(0)
+    result = {}
+    for n in sizes:
+        for name, suffix in gp_local.MODEL_SUFFIXES.items():
+            x = _reflectance(n, rng, vals, suffix)
+            t = _time(lambda: gp_local.predict(name, x), repeat)
+            t['pixels_per_second'] = n / t['min']
+            result['%s.%d' % (name, n)] = t
+            t = _time(lambda: gp_local.predict(name, x, return_variance=True), repeat)
+            t['pixels_per_second'] = n / t['min']
+            result['%s_var.%d' % (name, n)] = t
+    return result
+
+
+def bench_index_numpy(sizes, repeat):
+    import numpy as np
+    import index_engine, indices
+    rng = np.random.default_rng(0)
+    names = sorted(indices.INDEX_EXPRESSIONS)
+    result = {}
+    for n in sizes:
+        bands = {b: rng.uniform(0.0, 6000.0, size=n) for b in index_engine.required_bands(names)}
+        t = _time(lambda: index_engine.evaluate_numpy(bands, names), repeat)
+        t['pixels_per_second'] = n / t['min']
+        result['all_fused.%d' % n] = t
+    return result
+
+
+_FIELDS = 10
+
+
+def _aoi(fields=1):
+    features = []
+    for i in range(fields):
+        x, y = 77.0 + 0.02 * i, 28.0
+        ring = [[x, y], [x + 0.01, y], [x + 0.01, y + 0.01], [x, y + 0.01], [x, y]]
+        features.append({'type': 'Feature', 'properties': {'field': 'f%d' % i},
+                         'geometry': {'type': 'Polygon', 'coordinates': [ring]}})
+    return json.dumps({'type': 'FeatureCollection', 'features': features})
+
+
+def _api_requests():
+    dates = {'start_date': '2024-01-01', 'end_date': '2024-03-01', 'cloud_cover': '20'}
+    return [
+        ('run_model.Cw', 'post', '/run-model', dict(dates, parameter='Cw'), _aoi()),
+        ('run_model.OSAVI', 'post', '/run-model', dict(dates, parameter='OSAVI'), _aoi()),
+        ('run_model_batch', 'post', '/run-model/batch',
+         dict(dates, parameters='Cw,Ccc,Lai,OSAVI,NDBI', id_field='field'), _aoi(_FIELDS)),
+        ('stats.Lai', 'post', '/stats', dict(dates, parameters='Lai'), _aoi()),
+        ('stats.per_field', 'post', '/stats', dict(dates, parameters='Lai,OSAVI', per_field='true', id_field='field'),
+         _aoi(_FIELDS)),
+        ('timeseries.month', 'post', '/timeseries', dict(dates, parameter='OSAVI', binning='month'), _aoi()),
+        ('tile.Lai', 'get', '/tiles/Lai/12/2925/1713.png?start_date=2024-01-01&end_date=2024-03-01', None, None),
+        ('readyz', 'get', '/readyz', None, None),
+        ('job.region_stats', 'post', '/jobs', dict(dates, kind='region_stats', parameter='Ccc', grid='2'), _aoi()),
+    ]
+
+
+def bench_api(fake):
+    tmp = tempfile.mkdtemp(prefix='bench-')
+    os.environ.update(RESULT_CACHE='memory', JOBS_DB_PATH=os.path.join(tmp, 'jobs.sqlite'),
+                      TILE_CACHE_DIR=os.path.join(tmp, 'tiles'), RESULT_STORE_PATH=os.path.join(tmp, 'store.sqlite'))
+    fake.reset()
+    import main
+    from fastapi.testclient import TestClient
+    result = {'import': {'server_calls': dict(fake.server_calls), 'nodes': fake.nodes}}
+    fake.reset()
+    # Entering the client runs the lifespan: Earth Engine initialisation, model loading, job resume
+    with TestClient(main.app) as client:
+        result['startup'] = {'server_calls': dict(fake.server_calls), 'nodes': fake.nodes}
+        for name, method, url, form, aoi_json in _api_requests():
+            for run in ('cold', 'warm'):
+                fake.reset()
+                start = time.perf_counter()
+                kwargs = {'data': form, 'files': {'aoi_file': ('aoi.geojson', aoi_json)}} if form else {}
+                response = getattr(client, method)(url, **kwargs)
+                body = response.json() if response.headers.get('content-type') == 'application/json' else None
+                if name.startswith('job.') and isinstance(body, dict) and 'id' in body:
+                    # Background work counts towards the request that queued it
+                    while main.job_manager.get(body['id'])['status'] in ('queued', 'running'):
+                        time.sleep(0.01)
+                result['%s.%s' % (name, run)] = {
+                    'status': response.status_code,
+                    'seconds': time.perf_counter() - start,
+                    'server_calls': dict(fake.server_calls),
+                    'nodes': fake.nodes,
+                    'response_bytes': len(response.content),
+                }
+    return result
+
+
+def run(suites=SUITES, sizes=DEFAULT_SIZES, repeat=5):
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'results': {},
+    }
+    fake = install_fake_ee() if set(EE_SUITES) & set(suites) else None
+    for suite in suites:
+        if suite == 'parse':
+            report['results'][suite] = bench_parse(repeat)
+        elif suite == 'graph':
+            report['results'][suite] = bench_graph(fake, repeat)
+        elif suite == 'gp_local':
+            report['results'][suite] = bench_gp_local(sizes, repeat)
+        elif suite == 'index_numpy':
+            report['results'][suite] = bench_index_numpy(sizes, repeat)
+        elif suite == 'api':
+            report['results'][suite] = bench_api(fake)
+        else:
+            raise ValueError('Unknown suite: %s' % suite)
+    return report
+
+
+def compare(baseline, current, tolerance=DEFAULT_TOLERANCE):
+    """List of regressions of `current` against `baseline` (two reports): timings slower by more than
+    `tolerance`, more graph nodes, more server calls or a changed status code."""
+    regressions = []
+    for suite, entries in current['results'].items():
+        for name, now in entries.items():
+            before = baseline.get('results', {}).get(suite, {}).get(name)
+            if before is None:
+                continue
+            label = '%s.%s' % (suite, name)
+            if 'min' in now and 'min' in before and now['min'] > before['min'] * (1 + tolerance):
+                regressions.append('%s: %.4gs -> %.4gs' % (label, before['min'], now['min']))
+            if now.get('nodes', 0) > before.get('nodes', 0):
+                regressions.append('%s: %d -> %d graph nodes' % (label, before.get('nodes', 0), now['nodes']))
+            for call, count in now.get('server_calls', {}).items():
+                if count > before.get('server_calls', {}).get(call, 0):
+                    regressions.append('%s: %s called %d times, was %d'
+                                       % (label, call, count, before.get('server_calls', {}).get(call, 0)))
+            if 'status' in now and now['status'] != before.get('status'):
+                regressions.append('%s: status %s -> %s' % (label, before.get('status'), now['status']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the model and index hot paths.')
+    parser.add_argument('--suites', default=','.join(SUITES), help='comma-separated subset of %s' % ', '.join(SUITES))
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help='pixel counts for gp_local and index_numpy')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--out', help='write the JSON report here instead of stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help='compare two reports and exit with status 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.tolerance)
+        for line in regressions:
+            print(line)
+        return 1 if regressions else 0
+
+    suites = [s.strip() for s in args.suites.split(',') if s.strip()]
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    report = json.dumps(run(suites, sizes, args.repeat), indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
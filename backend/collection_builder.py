@@ -0,0 +1,192 @@
+# collection_builder.py
+# Per-sensor image collections with per-pixel masking, harmonised band names and compositing options.
+#
+# A scene-level cloud filter alone keeps every cloudy pixel of the scenes it lets through, and a median over
+# them is biased during the monsoon. Here every image is masked pixel by pixel (SCL or QA60 for Sentinel-2,
+# QA_PIXEL for Landsat, state_1km for MODIS, border noise for Sentinel-1) and clipped to the bounds of the AOI
+# before compositing, so Earth Engine only composites the pixels that are used.
+#
+# Optical sensors are renamed to the Sentinel-2 band names the index formulas use (B2 blue, B3 green, B4 red,
+# B8 NIR, B11 / B12 SWIR) and scaled to Sentinel-2 SR digital numbers (reflectance x 10000); bands a sensor does
+# not have (e.g. the red edge outside Sentinel-2) are simply absent. Sentinel-1 images keep VV and VH in dB.
+#
+# Usage:
+#   import collection_builder as cb
+#   col = cb.build_collection('landsat-9', aoi, '2024-06-01', '2024-10-01', cloud_cover=60)
+#   img = cb.composite(col, 'landsat-9', method='latest')
+#   img = cb.build_composite('sentinel-2', aoi, '2024-06-01', '2024-10-01', 60, method='quality')
+import ee
+
+COMPOSITE_METHODS = ('median', 'quality', 'latest')
+
+# Sentinel-2 scene classes masked out: no data, saturated/defective, cloud shadow, cloud medium/high
+# probability, cirrus (the same classes as local_pipeline.CLOUDY_SCL)
+S2_CLOUDY_SCL = (0, 1, 3, 8, 9, 10)
+
+SENSORS = {
+    'sentinel-2': {
+        'collection': 'COPERNICUS/S2_SR_HARMONIZED',
+        'cloud_property': 'CLOUDY_PIXEL_PERCENTAGE',
+        'bands': {b: b for b in ('B1', 'B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'B8', 'B8A', 'B11', 'B12')},
+        'masks': ('scl', 'qa60', 'none'),
+        'scale': 10,
+    },
+    'landsat-8': {
+        'collection': 'LANDSAT/LC08/C02/T1_L2',
+        'cloud_property': 'CLOUD_COVER',
+        'bands': {'SR_B1': 'B1', 'SR_B2': 'B2', 'SR_B3': 'B3', 'SR_B4': 'B4', 'SR_B5': 'B8', 'SR_B6': 'B11',
+                  'SR_B7': 'B12'},
+        'masks': ('qa_pixel', 'none'),
+        'scale': 30,
+    },
+    'landsat-9': {
+        'collection': 'LANDSAT/LC09/C02/T1_L2',
+        'cloud_property': 'CLOUD_COVER',
+        'bands': {'SR_B1': 'B1', 'SR_B2': 'B2', 'SR_B3': 'B3', 'SR_B4': 'B4', 'SR_B5': 'B8', 'SR_B6': 'B11',
+                  'SR_B7': 'B12'},
+        'masks': ('qa_pixel', 'none'),
+        'scale': 30,
+    },
+    'modis': {
+        'collection': 'MODIS/061/MOD09GA',
+        'cloud_property': None,
+        'bands': {'sur_refl_b03': 'B2', 'sur_refl_b04': 'B3', 'sur_refl_b01': 'B4', 'sur_refl_b02': 'B8',
+                  'sur_refl_b06': 'B11', 'sur_refl_b07': 'B12'},
+        'masks': ('state', 'none'),
+        'scale': 500,
+    },
+    'sentinel-1': {
+        'collection': 'COPERNICUS/S1_GRD',
+        'cloud_property': None,
+        'bands': {'VV': 'VV', 'VH': 'VH'},
+        'masks': ('border', 'none'),
+        'scale': 10,
+    },
+}
+
+
+def sensor_bands(sensor):
+    """Harmonised band names available for `sensor`."""
+    return sorted(set(_spec(sensor)['bands'].values()))
+
+
+def native_scale(sensor):
+    """Pixel size of `sensor` in metres, the scale to reduce its images at."""
+    return _spec(sensor)['scale']
+
+
+def _spec(sensor):
+    if sensor not in SENSORS:
+        raise ValueError('Unknown sensor: %s (expected one of %s)' % (sensor, ', '.join(SENSORS)))
+    return SENSORS[sensor]
+
+
+def _mask_s2_scl(image):
+    scl = image.select('SCL')
+    clear = scl.neq(S2_CLOUDY_SCL[0])
+    for cls in S2_CLOUDY_SCL[1:]:
+        clear = clear.And(scl.neq(cls))
+    return image.updateMask(clear)
+
+
+def _mask_s2_qa60(image):
+    qa = image.select('QA60')
+    # Bit 10 opaque clouds, bit 11 cirrus
+    return image.updateMask(qa.bitwiseAnd(1 << 10).eq(0).And(qa.bitwiseAnd(1 << 11).eq(0)))
+
+
+def _mask_landsat(image):
+    qa = image.select('QA_PIXEL')
+    # Bits 1 dilated cloud, 2 cirrus, 3 cloud, 4 cloud shadow
+    return image.updateMask(qa.bitwiseAnd(0b11110).eq(0))
+
+
+def _mask_modis(image):
+    state = image.select('state_1km')
+    # Bits 0-1 cloud state (00 clear), bit 2 cloud shadow, bits 8-9 cirrus
+    return image.updateMask(state.bitwiseAnd(0b11).eq(0).And(state.bitwiseAnd(1 << 2).eq(0))
+                            .And(state.bitwiseAnd(0b11 << 8).eq(0)))
+
+
+def _mask_s1_border(image):
+    # Low-backscatter border noise along the swath edges of older GRD products
+    return image.updateMask(image.select('VV').gt(-30))
+
+
+_MASKS = {'scl': _mask_s2_scl, 'qa60': _mask_s2_qa60, 'qa_pixel': _mask_landsat, 'state': _mask_modis,
+          'border': _mask_s1_border}
+
+
+def _harmonise(sensor, image):
+    spec = SENSORS[sensor]
+    bands = image.select(list(spec['bands']), list(spec['bands'].values()))
+    if sensor.startswith('landsat'):
+        # Collection 2 Level-2 scaling to reflectance, then to Sentinel-2 SR digital numbers
+        bands = bands.multiply(0.0000275).add(-0.2).multiply(10000)
+    return ee.Image(bands.copyProperties(image, ['system:time_start']))
+
+
+def _clip_region(region):
+    if region is None:
+        return None
+    if isinstance(region, ee.FeatureCollection):
+        return region.geometry().bounds()
+    return ee.Geometry(region).bounds()
+
+
+def build_collection(sensor, region, start_date, end_date, cloud_cover=None, mask=None, clip=True):
+    """Masked, harmonised ImageCollection of `sensor` over `region` (ee.Geometry, ee.FeatureCollection or
+    None for no spatial filter). `cloud_cover` filters scenes on the sensor's cloud percentage property where it
+    has one; `mask` is one of the sensor's masks (default: its first, i.e. the per-pixel cloud mask)."""
+    spec = _spec(sensor)
+    mask = mask or spec['masks'][0]
+    if mask not in spec['masks']:
+        raise ValueError('Mask %s is not available for %s (expected one of %s)'
+                         % (mask, sensor, ', '.join(spec['masks'])))
+    collection = ee.ImageCollection(spec['collection'])
+    if region is not None:
+        collection = collection.filterBounds(region)
+    collection = collection.filterDate(start_date, end_date)
+    if cloud_cover is not None and spec['cloud_property']:
+        collection = collection.filter(ee.Filter.lte(spec['cloud_property'], cloud_cover))
+    if sensor == 'sentinel-1':
+        collection = (collection
+                      .filter(ee.Filter.eq('instrumentMode', 'IW'))
+                      .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
+                      .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH')))
+    bounds = _clip_region(region) if clip else None
+    mask_fn = _MASKS.get(mask)
+
+    def prepare(image):
+        image = ee.Image(image)
+        if mask_fn is not None:
+            image = mask_fn(image)
+        image = _harmonise(sensor, image)
+        # Clipping before compositing limits the composite to the pixels of the AOI bounds
+        return image.clip(bounds) if bounds is not None else image
+    return collection.map(prepare)
+
+
+def composite(collection, sensor, method='median'):
+    """Reduce a build_collection() result to one image.
+
+    median   per-pixel median of the valid observations
+    quality  per-pixel observation with the highest NDVI (optical sensors), i.e. the greenest clear pixel
+    latest   per-pixel most recent valid observation"""
+    if method == 'median':
+        return collection.median()
+    if method == 'latest':
+        # mosaic() puts the last image on top; masked pixels fall through to older observations
+        return collection.sort('system:time_start').mosaic()
+    if method == 'quality':
+        if sensor == 'sentinel-1':
+            raise ValueError('The quality composite needs optical bands, it is not available for sentinel-1')
+        bands = sensor_bands(sensor)
+        with_ndvi = collection.map(
+            lambda image: ee.Image(image).addBands(ee.Image(image).normalizedDifference(['B8', 'B4']).rename('quality')))
+        return with_ndvi.qualityMosaic('quality').select(bands)
+    raise ValueError('Unknown composite method: %s (expected one of %s)' % (method, ', '.join(COMPOSITE_METHODS)))
+
+
+def build_composite(sensor, region, start_date, end_date, cloud_cover=None, method='median', mask=None):
+    return composite(build_collection(sensor, region, start_date, end_date, cloud_cover, mask), sensor, method)
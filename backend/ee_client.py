@@ -0,0 +1,206 @@
+# ee_client.py
+# Shared Earth Engine client: initialisation from the environment, a pooled HTTP session, rate limiting and
+# retries with backoff.
+#
+# All Earth Engine round trips of the backend go through `call()`. It takes a token from a process-wide token
+# bucket, so bursts of requests are spread over the quota instead of being rejected by EE. It limits how many
+# calls are in flight at once, across the API thread pool, background jobs and tile seeding. Calls that fail
+# with a quota (429) or transient server/network error are retried with exponential backoff and full jitter.
+# Requests that are not idempotent, such as starting a batch task, go through `call_once()` instead: rate
+# limited, never retried, since a retry after a lost response would repeat them.
+# init() sets up the session that the ee library sends its requests through: the connection pool is sized for
+# the worker threads and connections are kept alive across requests.
+#
+# Usage:
+#   import ee_client
+#   ee_client.init()
+#   stats = ee_client.call('reduceRegion', image.reduceRegion(...).getInfo)
+#   task = ee_client.call_once('export_start', utils.export_to_drive, image, region=aoi)
+#
+# Configuration (environment):
+#   EE_PROJECT            Cloud project for EE calls (default iari-big-data-project)
+#   EE_SERVICE_ACCOUNT    service account e-mail; with EE_PRIVATE_KEY_FILE, used instead of the stored user
+#   EE_PRIVATE_KEY_FILE   JSON key file of the service account
+#   EE_API_URL            EE endpoint, e.g. https://earthengine-highvolume.googleapis.com (default: library default)
+#   EE_HTTP_POOL_SIZE     keep-alive connections to EE (default 2 x EE_MAX_CONCURRENCY)
+#   EE_RATE_LIMIT         sustained EE calls per second, 0 = unlimited (default 10)
+#   EE_RATE_BURST         calls allowed at once above the sustained rate (default 20)
+#   EE_MAX_IN_FLIGHT      concurrent EE calls per process (default 2 x EE_MAX_CONCURRENCY)
+#   EE_MAX_RETRIES        retries of a failed call (default 5)
+#   EE_RETRY_BASE         first backoff in seconds, doubled per retry (default 1)
+#   EE_RETRY_MAX          longest backoff in seconds (default 60)
+import os, random, re, threading, time
+import ee
+import metrics
+
+_concurrency = int(os.environ.get('EE_MAX_CONCURRENCY', '8'))
+
+PROJECT = os.environ.get('EE_PROJECT', 'iari-big-data-project')
+SERVICE_ACCOUNT = os.environ.get('EE_SERVICE_ACCOUNT')
+PRIVATE_KEY_FILE = os.environ.get('EE_PRIVATE_KEY_FILE')
+API_URL = os.environ.get('EE_API_URL')
+HTTP_POOL_SIZE = int(os.environ.get('EE_HTTP_POOL_SIZE', str(2 * _concurrency)))
+RATE_LIMIT = float(os.environ.get('EE_RATE_LIMIT', '10'))
+RATE_BURST = float(os.environ.get('EE_RATE_BURST', '20'))
+MAX_IN_FLIGHT = int(os.environ.get('EE_MAX_IN_FLIGHT', str(2 * _concurrency)))
+MAX_RETRIES = int(os.environ.get('EE_MAX_RETRIES', '5'))
+RETRY_BASE = float(os.environ.get('EE_RETRY_BASE', '1'))
+RETRY_MAX = float(os.environ.get('EE_RETRY_MAX', '60'))
+
+# Substrings of EE error messages worth retrying: quota / rate limits and transient server errors.
+# "User memory limit exceeded" or "Computation timed out" fail the same way again and are not retried.
+_RETRYABLE = re.compile(
+    r'too many requests|too many concurrent|quota exceeded|rate limit|internal error|service unavailable|'
+    r'backend error|bad gateway|gateway timeout|deadline exceeded|\b(429|500|502|503|504)\b',
+    re.IGNORECASE,
+)
+
+_init_lock = threading.Lock()
+_initialized = False
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average and up to `burst` at once."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available. Returns the seconds waited."""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+_bucket = TokenBucket(RATE_LIMIT, RATE_BURST)
+_in_flight = threading.BoundedSemaphore(MAX_IN_FLIGHT) if MAX_IN_FLIGHT > 0 else None
+_counts = {'calls': 0, 'retries': 0, 'failed': 0, 'throttled_seconds': 0.0}
+_counts_lock = threading.Lock()
+
+
+def _count(name, delta=1):
+    with _counts_lock:
+        _counts[name] += delta
+
+
+def _session():
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def init(ask_auth=False):
+    """Initialise Earth Engine once per process from the EE_* environment variables.
+
+    With `ask_auth`, a missing or expired user login starts the interactive `ee.Authenticate()` flow
+    instead of failing."""
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        # ee sends every request through this session, so its pool decides how many connections stay open
+        get_state = getattr(ee.data, '_get_state', None)
+        if get_state is not None:
+            state = get_state()
+            if getattr(state, 'requests_session', None) is None:
+                state.requests_session = _session()
+        if SERVICE_ACCOUNT and PRIVATE_KEY_FILE:
+            credentials = ee.ServiceAccountCredentials(SERVICE_ACCOUNT, PRIVATE_KEY_FILE)
+        else:
+            credentials = 'persistent'
+        kwargs = {'credentials': credentials, 'project': PROJECT}
+        if API_URL:
+            kwargs['url'] = API_URL
+        try:
+            _with_retries('Initialize', ee.Initialize, **kwargs)
+        except ee.EEException:
+            if not ask_auth or credentials != 'persistent':
+                raise
+            print("Attempting to authenticate to Earth Engine...")
+            ee.Authenticate()
+            ee.Initialize(**kwargs)
+        _initialized = True
+
+
+def is_retryable(error):
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, ee.EEException):
+        return _RETRYABLE.search(str(error)) is not None
+    # requests / urllib3 / http.client failures below the ee library
+    return type(error).__module__.split('.')[0] in ('requests', 'urllib3', 'http')
+
+
+def backoff(attempt):
+    """Seconds to wait before retry `attempt` (1-based): exponential with full jitter, capped at EE_RETRY_MAX."""
+    return random.uniform(0, min(RETRY_MAX, RETRY_BASE * 2 ** (attempt - 1)))
+
+
+def _with_retries(name, fn, *args, **kwargs):
+    attempt = 0
+    while True:
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            attempt += 1
+            if attempt > MAX_RETRIES or not is_retryable(e):
+                _count('failed')
+                raise
+            _count('retries')
+            metrics.EE_RETRIES.inc(call=name)
+            time.sleep(backoff(attempt))
+
+
+def _limited(name, fn, args, kwargs):
+    waited = _bucket.acquire()
+    if waited:
+        _count('throttled_seconds', waited)
+        m = metrics.current()
+        if m is not None:
+            m.add_stage('ee_throttle', waited)
+    if _in_flight is None:
+        return metrics.ee_call(name, fn, *args, **kwargs)
+    with _in_flight:
+        return metrics.ee_call(name, fn, *args, **kwargs)
+
+
+def call(name, fn, *args, **kwargs):
+    """Make one Earth Engine round trip `fn(*args, **kwargs)`, e.g. `image.reduceRegion(...).getInfo`,
+    rate limited and retried on quota and transient errors. `name` labels it in the metrics."""
+    _count('calls')
+    return _with_retries(name, _limited, name, fn, args, kwargs)
+
+
+def call_once(name, fn, *args, **kwargs):
+    """Like call(), but never retried: for requests with a side effect on the server (e.g. task.start()).
+    A 5xx or connection reset may come after the server acted on the request, and a retry would act twice."""
+    _count('calls')
+    try:
+        return _limited(name, fn, args, kwargs)
+    except Exception:
+        _count('failed')
+        raise
+
+
+def stats():
+    with _counts_lock:
+        return {'rate_limit': RATE_LIMIT, 'burst': RATE_BURST, 'max_in_flight': MAX_IN_FLIGHT, **_counts}
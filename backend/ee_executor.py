@@ -0,0 +1,87 @@
+# ee_executor.py
+# Runs blocking Earth Engine / GeoPandas work off the asyncio event loop.
+#
+# getInfo(), reduceRegion and gpd.read_file block for seconds. Called directly from an `async def` endpoint they
+# stall the event loop, so health checks and every other client on the worker wait as well. `run` hands the
+# work to a bounded thread pool instead and awaits it with a timeout, giving up early when the client
+# disconnects.
+#
+# Configuration (environment):
+#   EE_MAX_CONCURRENCY    worker threads, i.e. concurrent EE calls per process (default 8)
+#   EE_REQUEST_TIMEOUT    seconds to wait for one call before answering 504 (default 120)
+import asyncio, contextvars, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+import metrics
+
+MAX_CONCURRENCY = int(os.environ.get('EE_MAX_CONCURRENCY', '8'))
+REQUEST_TIMEOUT = float(os.environ.get('EE_REQUEST_TIMEOUT', '120'))
+
+# How often a waiting request checks whether its client is still connected
+_DISCONNECT_POLL = 0.5
+
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix='ee-worker')
+_lock = threading.Lock()
+_counts = {'queued': 0, 'running': 0, 'completed': 0, 'failed': 0, 'timed_out': 0, 'cancelled': 0}
+
+
+def _count(name, delta=1):
+    with _lock:
+        _counts[name] += delta
+
+
+def _tracked(fn, args, kwargs, submitted):
+    _count('queued', -1)
+    _count('running')
+    # Time spent waiting for a free worker; grows when EE_MAX_CONCURRENCY is too small for the load
+    m = metrics.current()
+    if m is not None:
+        m.add_stage('queue_wait', time.perf_counter() - submitted)
+    try:
+        result = fn(*args, **kwargs)
+    except BaseException:
+        _count('failed')
+        raise
+    else:
+        _count('completed')
+        return result
+    finally:
+        _count('running', -1)
+
+
+async def run(fn, *args, request=None, timeout=None, **kwargs):
+    """Run `fn(*args, **kwargs)` on the EE thread pool and return its result.
+
+    Raises HTTPException 504 after `timeout` seconds (default EE_REQUEST_TIMEOUT) and 499 when `request`
+    (a starlette Request) disconnects first. Work that has not started yet is dropped from the queue; a call
+    already running in a thread cannot be interrupted and finishes in the background."""
+    timeout = REQUEST_TIMEOUT if timeout is None else timeout
+    loop = asyncio.get_running_loop()
+    _count('queued')
+    # Run in a copy of the caller's context so the worker records into the request's metrics
+    context = contextvars.copy_context()
+    work = _executor.submit(context.run, _tracked, fn, args, kwargs, time.perf_counter())
+    future = asyncio.wrap_future(work)
+    deadline = loop.time() + timeout
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                _count('timed_out')
+                raise HTTPException(status_code=504, detail="Earth Engine request timed out")
+            wait = remaining if request is None else min(remaining, _DISCONNECT_POLL)
+            done, _ = await asyncio.wait({future}, timeout=wait)
+            if done:
+                return future.result()
+            if request is not None and await request.is_disconnected():
+                _count('cancelled')
+                raise HTTPException(status_code=499, detail="Client disconnected")
+    finally:
+        if work.cancel():
+            # Dropped before a worker picked it up, so _tracked never ran
+            _count('queued', -1)
+
+
+def stats():
+    with _lock:
+        return {'max_concurrency': MAX_CONCURRENCY, **_counts}
@@ -2,21 +2,16 @@
 # Earth Engine initialization helpers
 
 import ee
+import ee_client
 
 def init(ask_auth=False):
     """
-    Initialize Earth Engine.
-    If running locally and not authenticated, run `earthengine authenticate` in terminal first.
+    Initialize Earth Engine (once per process; project and credentials from the EE_* environment variables,
+    see ee_client.py).
+    If running locally and not authenticated, run `earthengine authenticate` in terminal first,
+    or pass ask_auth=True.
     """
-    try:
-        ee.Initialize()
-    except Exception as e:
-        if ask_auth:
-            print("Attempting to authenticate to Earth Engine...")
-            ee.Authenticate()
-            ee.Initialize()
-        else:
-            raise e
+    ee_client.init(ask_auth=ask_auth)
 
 def get_sample_image():
     """
@@ -0,0 +1,185 @@
+# gp_local.py
+# Local NumPy engine for the CWC / CCC / LAI Gaussian-process models.
+#
+# models.calculate_CWC / calculate_CCC / calculate_LAI_GREEN build server-side ee.Image matrix graphs, so
+# every prediction is an Earth Engine round trip. This module evaluates the same kernels on a local
+# (pixels x bands) reflectance array, using the values parsed from the original JS file.
+#
+# With return_variance=True the GP predictive variance is returned as well,
+#   var(x) = hyp_sig + hyp_sign - k*(x)' (K + hyp_sign I)^-1 k*(x),
+# where K is the kernel matrix of the training samples. Its inverse Cholesky factor is computed once at init,
+# so per pixel the variance is one more matrix multiply on the k* block the mean already needs.
+#
+# Usage:
+#   import gp_local
+#   gp_local.init_from_js('/path/to/PUSAeCMS_code.txt')
+#   cwc = gp_local.predict('CWC', reflectance)   # reflectance: (..., 10) in models.MODEL_BANDS order
+#   lai, lai_var = gp_local.predict('LAI', reflectance, return_variance=True)
+import numpy as np
+import models
+
+# Output band name -> suffix of the JS variables holding that model's coefficients
+MODEL_SUFFIXES = {'CWC': 'Cw', 'CCC': 'CCC', 'LAI': 'GREEN'}
+
+# How each JS calculate_* function finishes the prediction: CWC and CCC add the model mean and clamp negative
+# values to 1e-5; calculate_LAI_GREEN has the mean step commented out and masks pixels <= 0 (NaN here).
+_FINISH = {
+    'CWC': {'add_mean': True, 'mask_nonpositive': False},
+    'CCC': {'add_mean': True, 'mask_nonpositive': False},
+    'LAI': {'add_mean': False, 'mask_nonpositive': True},
+}
+
+# Pixels evaluated per batch. k_star is (chunk x n_train) float64, so 16384 pixels of the largest model
+# (190 training samples) needs ~25 MB regardless of the size of the input array.
+DEFAULT_CHUNK_SIZE = 16384
+
+_MODELS = {}
+
+
+def _as_vector(value):
+    return None if value is None else np.asarray(value, dtype=np.float64).reshape(-1)
+
+
+def _training_factor(X_train, hyp_ell, hyp_sig, noise):
+    """Inverse Cholesky factor of K + noise I, transposed, so that k*' (K + noise I)^-1 k* = |k* @ result|^2
+    for a (pixels x n_train) block k*."""
+    weighted = X_train * hyp_ell
+    half_xdx = 0.5 * np.einsum('ij,ij->i', weighted, X_train)
+    K = hyp_sig * np.exp(weighted @ X_train.T - half_xdx[:, None] - half_xdx[None, :])
+    identity = np.eye(len(K))
+    jitter = 0.0
+    while True:
+        try:
+            L = np.linalg.cholesky(K + (noise + jitter) * identity)
+            break
+        except np.linalg.LinAlgError:
+            # Near-duplicate training samples: add the smallest jitter that makes the matrix positive definite
+            jitter = max(jitter * 10, 1e-10 * hyp_sig)
+    return np.ascontiguousarray(np.linalg.inv(L).T)
+
+
+def _prepare_model(vals, name, suffix):
+    """Turn the parsed JS values of one model into the arrays used by _predict_chunk."""
+    def get(var):
+        v = vals.get(var + '_' + suffix)
+        return None if isinstance(v, dict) else v
+
+    X_train = get('X_train')
+    if X_train is None:
+        return None
+    X_train = np.asarray(X_train, dtype=np.float64)
+    mx = _as_vector(get('mx'))
+    sx = _as_vector(get('sx'))
+    hyp_ell = _as_vector(get('hyp_ell'))
+    hyp_sig = get('hyp_sig')
+    hyp_sign = _as_vector(get('hyp_sign'))
+    # The JS spells the LAI model mean mean_model_Green
+    mean_model = get('mean_model')
+    if mean_model is None:
+        mean_model = vals.get('mean_model_' + suffix.capitalize())
+    if mx is None or sx is None or hyp_ell is None or hyp_sig is None:
+        raise ValueError('Model %s is missing coefficients; rebuild the model bundle' % name)
+    hyp_sig = float(hyp_sig)
+    noise = float(hyp_sign[0]) if hyp_sign is not None else 0.0
+    return {
+        'mx': mx,
+        'sx': sx,
+        'hyp_ell': hyp_ell,
+        'hyp_sig': hyp_sig,
+        'noise': noise,
+        # (bands x n_train) so k_star for a whole chunk is one matrix multiply
+        'weights_T': np.ascontiguousarray((X_train * hyp_ell).T),
+        'half_XDX': 0.5 * _as_vector(get('XDX_pre_calc')),
+        'alpha': _as_vector(get('alpha_coefficients')),
+        'mean_model': float(mean_model) if mean_model is not None else 0.0,
+        'factor': _training_factor(X_train, hyp_ell, hyp_sig, noise),
+        **_FINISH[name],
+    }
+
+
+def init_from_values(vals):
+    """Build the local models from a dict of parsed JS values (see models.parse_js_variables)."""
+    _MODELS.clear()
+    for name, suffix in MODEL_SUFFIXES.items():
+        model = _prepare_model(vals, name, suffix)
+        if model is not None:
+            _MODELS[name] = model
+    return _MODELS
+
+
+def init_from_js(js_path=models._JS_FILE_PATH):
+    return init_from_values(models.parse_js_variables(js_path))
+
+
+def _predict_chunk(model, x, with_variance):
+    x_norm = (x - model['mx']) / model['sx']
+    k_star = x_norm @ model['weights_T']
+    k_star -= model['half_XDX']
+    np.exp(k_star, out=k_star)
+    # arg1 = hyp_sig * exp(-0.5 * x_norm' diag(hyp_ell) x_norm); the full kernel vector is arg1 * k_star
+    arg1 = model['hyp_sig'] * np.exp(-0.5 * np.einsum('ij,ij->i', x_norm * model['hyp_ell'], x_norm))
+    mean_pred = (k_star @ model['alpha']) * arg1
+    if model['add_mean']:
+        mean_pred += model['mean_model']
+    if model['mask_nonpositive']:
+        invalid = mean_pred <= 0
+        mean_pred[invalid] = np.nan
+    else:
+        invalid = None
+        mean_pred[mean_pred < 0] = 0.00001
+    if not with_variance:
+        return mean_pred, None
+    projected = k_star @ model['factor']
+    explained = arg1 ** 2 * np.einsum('ij,ij->i', projected, projected)
+    # Clipped at zero: next to a training sample rounding can make the explained part exceed hyp_sig slightly
+    variance = np.maximum(model['hyp_sig'] - explained, 0.0) + model['noise']
+    if invalid is not None:
+        variance[invalid] = np.nan
+    return mean_pred, variance
+
+
+def predict(name, reflectance, chunk_size=DEFAULT_CHUNK_SIZE, return_variance=False):
+    """Predict CWC, CCC or LAI for every pixel of `reflectance`, finished the way the JS functions do it.
+
+    `reflectance` is an array of shape (..., 10) with bands in models.MODEL_BANDS order and the same
+    scaling as the Sentinel-2 SR product (0-10000). Returns an array with the leading shape of the input,
+    NaN where the JS masks the output (LAI <= 0). With `return_variance` returns (mean, variance), the GP
+    predictive variance in squared output units. Pixels are processed `chunk_size` at a time so memory stays
+    bounded for a full tile."""
+    model = _MODELS.get(name)
+    if model is None:
+        raise RuntimeError('Local model %r not initialized. Call init_from_js(path) first.' % name)
+    x = np.asarray(reflectance, dtype=np.float64)
+    if x.shape[-1] != len(models.MODEL_BANDS):
+        raise ValueError('Expected %d bands in the last axis, got %d' % (len(models.MODEL_BANDS), x.shape[-1]))
+    lead_shape = x.shape[:-1]
+    x = x.reshape(-1, x.shape[-1])
+    out = np.empty(x.shape[0], dtype=np.float64)
+    variance = np.empty(x.shape[0], dtype=np.float64) if return_variance else None
+    for start in range(0, x.shape[0], chunk_size):
+        stop = start + chunk_size
+        mean_chunk, var_chunk = _predict_chunk(model, x[start:stop], return_variance)
+        out[start:stop] = mean_chunk
+        if return_variance:
+            variance[start:stop] = var_chunk
+    if return_variance:
+        return out.reshape(lead_shape), variance.reshape(lead_shape)
+    return out.reshape(lead_shape)
+
+
+def compare_with_ee(name, image, region, scale=10, num_pixels=500):
+    """Sample `image` with Earth Engine and return the max relative difference between the EE model output
+    and the local prediction for the same pixels. Used to check the two engines stay in agreement."""
+    import ee
+    ee_func = {'CWC': models.calculate_CWC, 'CCC': models.calculate_CCC, 'LAI': models.calculate_LAI_GREEN}[name]
+    image = ee.Image(image).select(models.MODEL_BANDS).toDouble()
+    samples = image.addBands(ee_func(image)).sample(
+        region=region, scale=scale, numPixels=num_pixels, geometries=False).getInfo()
+    rows = [f['properties'] for f in samples['features']]
+    rows = [r for r in rows if all(b in r for b in models.MODEL_BANDS + [name])]
+    if not rows:
+        return 0.0
+    x = np.array([[r[b] for b in models.MODEL_BANDS] for r in rows])
+    expected = np.array([r[name] for r in rows])
+    local = predict(name, x)
+    return float(np.nanmax(np.abs(local - expected) / np.maximum(np.abs(expected), 1e-12)))
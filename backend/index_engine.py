@@ -0,0 +1,173 @@
+# index_engine.py
+# Fused evaluation of the spectral indices registered in indices.INDEX_EXPRESSIONS.
+#
+# Evaluating indices one at a time means 20 separate graphs and 20 reductions for 20 indices (the indices.py
+# functions are such single-index wrappers over this module). Here every requested formula is parsed into a
+# canonical expression tree (variables replaced by band names, constants folded, operands of + and * sorted),
+# and identical subtrees are evaluated only once.
+# The result is one multi-band image, so a single reduceRegion returns statistics for all of them. The same
+# trees run on local NumPy arrays.
+#
+# Usage:
+#   import index_engine
+#   img = index_engine.evaluate_ee(image, ['NormG', 'NormNIR', 'NormR', 'OSAVI'])     # one ee.Image, 4 bands
+#   out = index_engine.evaluate_numpy({'B3': g, 'B4': r, 'B8': n}, ['NormG', 'OSAVI'])  # {'NormG': array, ...}
+import ast, operator
+import numpy as np
+import indices
+
+_COPY_PROPERTIES = ["system:time_start", "satelite", "sensor", "tile"]
+
+_BINOPS = {ast.Add: 'add', ast.Sub: 'sub', ast.Mult: 'mul', ast.Div: 'div', ast.Pow: 'pow'}
+_PY_OPS = {'add': operator.add, 'sub': operator.sub, 'mul': operator.mul, 'div': operator.truediv, 'pow': operator.pow}
+# Operators whose operand chains are flattened and sorted so N + R and R + N share one node
+_COMMUTATIVE = ('add', 'mul')
+
+
+def _operands(op, node):
+    return node[1] if node[0] == op else (node,)
+
+
+def _make(op, a, b):
+    if a[0] == 'const' and b[0] == 'const':
+        return ('const', _PY_OPS[op](a[1], b[1]))
+    if op in _COMMUTATIVE:
+        return (op, tuple(sorted(_operands(op, a) + _operands(op, b), key=repr)))
+    return (op, a, b)
+
+
+def _to_node(tree, variables, params):
+    if isinstance(tree, ast.Expression):
+        return _to_node(tree.body, variables, params)
+    if isinstance(tree, ast.Name):
+        if tree.id in variables:
+            return ('band', variables[tree.id])
+        if tree.id in params:
+            return ('const', float(params[tree.id]))
+        raise ValueError('Unbound variable in index expression: %s' % tree.id)
+    if isinstance(tree, ast.Constant) and isinstance(tree.value, (int, float)):
+        return ('const', float(tree.value))
+    if isinstance(tree, ast.BinOp) and type(tree.op) in _BINOPS:
+        return _make(_BINOPS[type(tree.op)], _to_node(tree.left, variables, params),
+                     _to_node(tree.right, variables, params))
+    if isinstance(tree, ast.UnaryOp) and isinstance(tree.op, (ast.USub, ast.UAdd)):
+        operand = _to_node(tree.operand, variables, params)
+        if isinstance(tree.op, ast.UAdd):
+            return operand
+        return ('const', -operand[1]) if operand[0] == 'const' else ('neg', operand)
+    raise ValueError('Unsupported syntax in index expression: %s' % ast.dump(tree))
+
+
+def compile_index(name, params=None):
+    """Canonical expression tree of one registered index. `params` overrides its default parameters."""
+    if name not in indices.INDEX_EXPRESSIONS:
+        raise KeyError('Unknown index: %s' % name)
+    expression, variables, defaults = indices.INDEX_EXPRESSIONS[name]
+    merged = dict(defaults)
+    merged.update({k: v for k, v in (params or {}).items() if k in defaults})
+    return _to_node(ast.parse(expression, mode='eval'), variables, merged)
+
+
+def required_bands(names):
+    bands = set()
+    for name in names:
+        bands.update(indices.INDEX_EXPRESSIONS[name][1].values())
+    return sorted(bands)
+
+
+def _evaluate(node, backend, memo):
+    value = memo.get(node)
+    if value is not None:
+        return value
+    kind = node[0]
+    if kind == 'band':
+        value = backend.band(node[1])
+    elif kind == 'const':
+        value = node[1]
+    elif kind == 'neg':
+        value = backend.op('mul', _evaluate(node[1], backend, memo), -1.0)
+    elif kind in _COMMUTATIVE:
+        operands = [_evaluate(n, backend, memo) for n in node[1]]
+        value = operands[0]
+        for i, other in enumerate(operands[1:], start=2):
+            # Partial chains are memoised too, so sums or products with a common sorted prefix share it
+            key = (kind, node[1][:i])
+            cached = memo.get(key)
+            value = cached if cached is not None else backend.op(kind, value, other)
+            memo[key] = value
+    else:
+        value = backend.op(kind, _evaluate(node[1], backend, memo), _evaluate(node[2], backend, memo))
+    memo[node] = value
+    return value
+
+
+def _evaluate_all(names, backend, params):
+    memo = {}
+    return {name: _evaluate(compile_index(name, params), backend, memo) for name in names}
+
+
+class _EEBackend:
+    def __init__(self, image):
+        self.image = image
+
+    def band(self, name):
+        # Cast once so integer reflectance bands never hit integer division
+        return self.image.select(name).toFloat()
+
+    def op(self, kind, a, b):
+        import ee
+        if isinstance(a, float):
+            a = ee.Image.constant(a)
+        method = {'add': 'add', 'sub': 'subtract', 'mul': 'multiply', 'div': 'divide', 'pow': 'pow'}[kind]
+        return getattr(a, method)(b)
+
+
+class _NumpyBackend:
+    def __init__(self, bands):
+        self.bands = bands
+
+    def band(self, name):
+        return np.asarray(self.bands[name], dtype=np.float64)
+
+    def op(self, kind, a, b):
+        if kind == 'div':
+            # Earth Engine's divide returns 0 where the divisor is 0
+            a, b = np.broadcast_arrays(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64))
+            return np.divide(a, b, out=np.zeros(a.shape), where=b != 0)
+        with np.errstate(invalid='ignore', over='ignore'):
+            return _PY_OPS[kind](a, b)
+
+
+def evaluate_ee(image, names, params=None):
+    """One ee.Image with a float band per index in `names` (bands named after the indices)."""
+    import ee
+    values = _evaluate_all(names, _EEBackend(image), params)
+    bands = [(ee.Image.constant(v) if isinstance(v, float) else v).rename(name) for name, v in values.items()]
+    return ee.Image(ee.Image.cat(*bands).toFloat().copyProperties(image, _COPY_PROPERTIES))
+
+
+def evaluate_numpy(bands, names, params=None):
+    """Evaluate indices on local arrays. `bands` maps Sentinel-2 band names (B2, B8, ...) to arrays of
+    reflectance; returns {index name: float64 array}."""
+    values = _evaluate_all(names, _NumpyBackend(bands), params)
+    shape = np.broadcast(*[np.asarray(bands[b]) for b in required_bands(names)]).shape
+    return {name: np.broadcast_to(np.asarray(v, dtype=np.float64), shape) for name, v in values.items()}
+
+
+def shared_subexpressions(names, params=None):
+    """Number of nodes evaluated for `names` fused vs. separately; useful to see what fusing saves."""
+    def count(nodes):
+        seen = set()
+
+        def walk(node):
+            if node in seen or node[0] in ('band', 'const'):
+                return
+            seen.add(node)
+            for child in (node[1] if node[0] in _COMMUTATIVE else node[1:]):
+                if isinstance(child, tuple):
+                    walk(child)
+        for n in nodes:
+            walk(n)
+        return len(seen)
+    trees = [compile_index(n, params) for n in names]
+    return {'fused': count(trees), 'separate': sum(count([t]) for t in trees)}
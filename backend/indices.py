@@ -1,123 +1,87 @@
 # indices.py
 # Vegetation / spectral indices translated from the original JS implementation to Earth Engine Python API.
-import ee
+#
+# INDEX_EXPRESSIONS is the only definition of each formula. The functions below are kept for callers that want
+# one index as an ee.Image; each returns a float band named after the index, built by index_engine.
+import index_engine
 
 def NDBI(image):
-    ndbi = image.expression('(S1 - N) / (S1 + N)', {
-        'N': image.select('B8'),
-        'S1': image.select('B11')
-    })
-    return ndbi.rename('NDBI').float().copyProperties(image, ["system:time_start", "satelite", "sensor", "tile"])
+    return index_engine.evaluate_ee(image, ['NDBI'])
 
 def NDSoil(image):
-    ndsoil = image.expression('(S2 - G)/(S2 + G)', {
-        'G': image.select('B3'),
-        'S2': image.select('B12')
-    })
-    return ndsoil.rename('NDSoil').float().copyProperties(image, ["system:time_start", "satelite", "sensor", "tile"])
+    return index_engine.evaluate_ee(image, ['NDSoil'])
 
 def NHFD(image):
-    nhfd = image.expression('(RE1 - A) / (RE1 + A)', {
-        'A': image.select('B1'),
-        'RE1': image.select('B5')
-    })
-    return nhfd.rename('NDFD').float().copyProperties(image, ["system:time_start", "satelite", "sensor", "tile"])
+    return index_engine.evaluate_ee(image, ['NHFD'])
 
 def NSDS(image):
-    nsds = image.expression('(S1 - S2)/(S1 + S2)', {
-        'S1': image.select('B11'),
-        'S2': image.select('B12')
-    })
-    return nsds.rename('NSDS').float().copyProperties(image, ["system:time_start", "satelite", "sensor", "tile"])
+    return index_engine.evaluate_ee(image, ['NSDS'])
 
 def PISI(image):
-    pisi = image.expression('0.8192 * B - 0.5735 * N + 0.0750', {
-        'B': image.select('B2'),
-        'N': image.select('B8')
-    })
-    return pisi.rename('PISI').float().copyProperties(image, ["system:time_start", "satelite", "sensor", "tile"])
+    return index_engine.evaluate_ee(image, ['PISI'])
 
 def UI(image):
-    u1 = image.expression('(S2 - N)/(S2 + N)', {
-        'N': image.select('B8'),
-        'S1': image.select('B11')
-    })
-    return u1.rename('UI').float().copyProperties(image, ["system:time_start", "satelite", "sensor", "tile"])
+    return index_engine.evaluate_ee(image, ['UI'])
 
 def VIBI(image):
-    vibi = image.expression('((N-R)/(N+R))/(((N-R)/(N+R)) + ((S1-N)/(S1+N)))', {
-        'R': image.select('B4'),
-        'N': image.select('B8'),
-        'S1': image.select('B11')
-    })
-    return vibi.rename('VIBI').float().copyProperties(image, ["system:time_start", "satelite", "sensor", "tile"])
+    return index_engine.evaluate_ee(image, ['VIBI'])
 
 def VGNIRBI(image):
-    vgnirbi = image.expression('(G - N)/(G + N)', {
-        'G': image.select('B3'),
-        'N': image.select('B8')
-    })
-    return vgnirbi.rename('VGNIRBI').float().copyProperties(image, ["system:time_start", "satelite", "sensor", "tile"])
+    return index_engine.evaluate_ee(image, ['VGNIRBI'])
 
 def VRNIRBI(image):
-    vrnirbi = image.expression('(R - N)/(R + N)', {
-        'R': image.select('B4'),
-        'N': image.select('B8')
-    })
-    return vrnirbi.rename('VRNIRBI').float().copyProperties(image, ["system:time_start", "satelite", "sensor", "tile"])
+    return index_engine.evaluate_ee(image, ['VRNIRBI'])
 
 # Additional indices translated later in the file (examples)
 def NRFIr(image):
-    nrfir = image.expression('(R - S2) / (R + S2)', {
-        'R': image.select('B4'),
-        'S2': image.select('B12')
-    })
-    return nrfir.rename('NRFIr').float().copyProperties(image, ["system:time_start", "satelite", "sensor", "tile"])
+    return index_engine.evaluate_ee(image, ['NRFIr'])
 
 def NormG(image):
-    normg = image.expression('G/(N + G + R)', {
-        'G': image.select('B3'),
-        'R': image.select('B4'),
-        'N': image.select('B8')
-    })
-    return normg.rename('NormG').float().copyProperties(image, ["system:time_start", "satelite", "sensor", "tile"])
+    return index_engine.evaluate_ee(image, ['NormG'])
 
 def NormNIR(image):
-    normnir = image.expression('N/(N + G + R)', {
-        'G': image.select('B3'),
-        'R': image.select('B4'),
-        'N': image.select('B8')
-    })
-    return normnir.rename('NormNIR').float().copyProperties(image, ["system:time_start", "satelite", "sensor", "tile"])
+    return index_engine.evaluate_ee(image, ['NormNIR'])
 
 def NormR(image):
-    normr = image.expression('R/(N + G + R)', {
-        'G': image.select('B3'),
-        'R': image.select('B4'),
-        'N': image.select('B8')
-    })
-    return normr.rename('NormR').float().copyProperties(image, ["system:time_start", "satelite", "sensor", "tile"])
+    return index_engine.evaluate_ee(image, ['NormR'])
 
 def OCVI(image, cexp=1.16):
-    ocvi = image.expression('(N / G) * (R / G) ** cexp', {
-        'G': image.select('B3'),
-        'R': image.select('B4'),
-        'N': image.select('B8'),
-        'cexp': cexp
-    })
-    return ocvi.rename('OCVI').float().copyProperties(image, ["system:time_start", "satelite", "sensor", "tile"])
+    return index_engine.evaluate_ee(image, ['OCVI'], {'cexp': cexp})
 
 def OSAVI(image):
-    osavi = image.expression('(N - R) / (N + R + 0.16)', {
-        'R': image.select('B4'),
-        'N': image.select('B8')
-    })
-    return osavi.rename('OSAVI').float().copyProperties(image, ["system:time_start", "satelite", "sensor", "tile"])
+    return index_engine.evaluate_ee(image, ['OSAVI'])
 
 def PSRI(image):
-    psri = image.expression('(R - B)/RE2', {
-        'B': image.select('B2'),
-        'R': image.select('B4'),
-        'RE2': image.select('B6')
-    })
-    return psri.rename('PSRI').float().copyProperties(image, ["system:time_start", "satelite", "sensor", "tile"])
+    return index_engine.evaluate_ee(image, ['PSRI'])
+
+# Registry of index formulas: name -> (expression, {variable: band}, {parameter: default}).
+# index_engine.py evaluates any subset of these as one fused multi-band image (Earth Engine) or on local
+# NumPy arrays, computing sub-expressions shared between indices (e.g. N + R, N + G + R) once.
+INDEX_EXPRESSIONS = {
+    'NDBI': ('(S1 - N) / (S1 + N)', {'N': 'B8', 'S1': 'B11'}, {}),
+    'NDSoil': ('(S2 - G)/(S2 + G)', {'G': 'B3', 'S2': 'B12'}, {}),
+    'NHFD': ('(RE1 - A) / (RE1 + A)', {'A': 'B1', 'RE1': 'B5'}, {}),
+    'NSDS': ('(S1 - S2)/(S1 + S2)', {'S1': 'B11', 'S2': 'B12'}, {}),
+    'PISI': ('0.8192 * B - 0.5735 * N + 0.0750', {'B': 'B2', 'N': 'B8'}, {}),
+    'UI': ('(S2 - N)/(S2 + N)', {'N': 'B8', 'S2': 'B12'}, {}),
+    'VIBI': ('((N-R)/(N+R))/(((N-R)/(N+R)) + ((S1-N)/(S1+N)))', {'R': 'B4', 'N': 'B8', 'S1': 'B11'}, {}),
+    'VGNIRBI': ('(G - N)/(G + N)', {'G': 'B3', 'N': 'B8'}, {}),
+    'VRNIRBI': ('(R - N)/(R + N)', {'R': 'B4', 'N': 'B8'}, {}),
+    'NRFIr': ('(R - S2) / (R + S2)', {'R': 'B4', 'S2': 'B12'}, {}),
+    'NormG': ('G/(N + G + R)', {'G': 'B3', 'R': 'B4', 'N': 'B8'}, {}),
+    'NormNIR': ('N/(N + G + R)', {'G': 'B3', 'R': 'B4', 'N': 'B8'}, {}),
+    'NormR': ('R/(N + G + R)', {'G': 'B3', 'R': 'B4', 'N': 'B8'}, {}),
+    'OCVI': ('(N / G) * (R / G) ** cexp', {'G': 'B3', 'R': 'B4', 'N': 'B8'}, {'cexp': 1.16}),
+    'OSAVI': ('(N - R) / (N + R + 0.16)', {'R': 'B4', 'N': 'B8'}, {}),
+    'PSRI': ('(R - B)/RE2', {'B': 'B2', 'R': 'B4', 'RE2': 'B6'}, {}),
+    'DPDD': ('(VV + VH)/2.0 ** 0.5', {'VV': 'VV', 'VH': 'VH'}, {}),
+    'DpRVIVV': ('(4.0 * VH)/(VV + VH)', {'VV': 'VV', 'VH': 'VH'}, {}),
+    'NDPoII': ('(VV - VH)/(VV + VH)', {'VV': 'VV', 'VH': 'VH'}, {}),
+    'VDDPI': ('(VV + VH)/VV', {'VV': 'VV', 'VH': 'VH'}, {}),
+    'VHVVDifference': ('VH-VV', {'VV': 'VV', 'VH': 'VH'}, {}),
+    'VHVVProduct': ('VH*VV', {'VV': 'VV', 'VH': 'VH'}, {}),
+    'VHVVRatio': ('VH/VV', {'VV': 'VV', 'VH': 'VH'}, {}),
+    'VVVHRatio': ('VV/VH', {'VV': 'VV', 'VH': 'VH'}, {}),
+    'VVVHDifference': ('VV-VH', {'VV': 'VV', 'VH': 'VH'}, {}),
+    'VVVHSum': ('VV+VH', {'VV': 'VV', 'VH': 'VH'}, {}),
+}
@@ -0,0 +1,190 @@
+# jobs.py
+# Persistent background jobs for analyses too large for a synchronous request.
+#
+# submit() stores a job in a local SQLite file and returns its id straight away; a thread pool runs the
+# registered handler for the job's kind and records status, progress and the result as it goes. Because the
+# store is on disk, jobs survive a restart (resume() re-queues unfinished ones) and identical submissions are
+# deduplicated by a hash of kind + parameters.
+#
+# Handlers are registered per kind:
+#
+#   @jobs.handler('region_stats')
+#   def run_region_stats(params, ctx):
+#       ctx.progress(0.5, 'half way')      # 0..1
+#       ctx.save_state(task_id='...')      # persisted, visible to the handler again after a restart
+#       return {...}                       # JSON-serialisable result
+#
+# Configuration (environment):
+#   JOBS_DB_PATH     SQLite file (default: jobs.sqlite next to this file)
+#   JOBS_WORKERS     concurrent jobs per process (default 2)
+#   JOBS_STALE_AFTER seconds without a heartbeat after which a running job is considered abandoned by a dead
+#                    worker and may be picked up again (default 900). While a handler runs, its worker
+#                    refreshes the job every third of that, so a single long EE call does not make it stale.
+import hashlib, json, os, sqlite3, threading, time, traceback, uuid
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = 'queued', 'running', 'succeeded', 'failed'
+
+_HANDLERS = {}
+
+
+def handler(kind):
+    def register(fn):
+        _HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def params_hash(kind, params):
+    return hashlib.sha256(json.dumps([kind, params], sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class JobContext:
+    """Passed to handlers so they can report progress and persist state."""
+
+    def __init__(self, manager, job):
+        self._manager = manager
+        self.job_id = job['id']
+        self.state = job['state']
+
+    def progress(self, fraction, message=None):
+        self._manager._update(self.job_id, progress=max(0.0, min(1.0, float(fraction))), message=message)
+
+    def save_state(self, **state):
+        self.state.update(state)
+        self._manager._update(self.job_id, state=json.dumps(self.state))
+
+
+class JobManager:
+    def __init__(self, db_path, workers=2, stale_after=900):
+        self.db_path = db_path
+        self.stale_after = stale_after
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job-worker')
+        self._submit_lock = threading.Lock()
+        self._execute('PRAGMA journal_mode=WAL')
+        self._execute('''CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY, kind TEXT NOT NULL, params TEXT NOT NULL, params_hash TEXT NOT NULL,
+            status TEXT NOT NULL, progress REAL NOT NULL DEFAULT 0, message TEXT,
+            state TEXT NOT NULL DEFAULT '{}', result TEXT, error TEXT,
+            created REAL NOT NULL, updated REAL NOT NULL)''')
+        self._execute('CREATE INDEX IF NOT EXISTS jobs_params_hash ON jobs (params_hash)')
+
+    def _execute(self, sql, params=()):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                return [dict(r) for r in conn.execute(sql, params).fetchall()]
+        finally:
+            conn.close()
+
+    def _update(self, job_id, **fields):
+        fields['updated'] = time.time()
+        cols = ', '.join('%s = ?' % k for k in fields)
+        self._execute('UPDATE jobs SET %s WHERE id = ?' % cols, tuple(fields.values()) + (job_id,))
+
+    @staticmethod
+    def _decode(row):
+        if row is None:
+            return None
+        job = dict(row)
+        for k in ('params', 'state', 'result'):
+            job[k] = json.loads(job[k]) if job[k] is not None else None
+        return job
+
+    def get(self, job_id):
+        rows = self._execute('SELECT * FROM jobs WHERE id = ?', (job_id,))
+        return self._decode(rows[0]) if rows else None
+
+    def list(self, status=None, limit=100):
+        if status:
+            rows = self._execute('SELECT * FROM jobs WHERE status = ? ORDER BY created DESC LIMIT ?', (status, limit))
+        else:
+            rows = self._execute('SELECT * FROM jobs ORDER BY created DESC LIMIT ?', (limit,))
+        return [self._decode(r) for r in rows]
+
+    def submit(self, kind, params):
+        """Queue a job and return it. An identical job that has not failed is returned instead of a new one."""
+        if kind not in _HANDLERS:
+            raise ValueError('Unknown job kind: %s' % kind)
+        h = params_hash(kind, params)
+        with self._submit_lock:
+            rows = self._execute(
+                'SELECT * FROM jobs WHERE params_hash = ? AND status != ? ORDER BY created DESC LIMIT 1', (h, FAILED))
+            if rows:
+                return self._decode(rows[0])
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            self._execute(
+                'INSERT INTO jobs (id, kind, params, params_hash, status, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job_id, kind, json.dumps(params), h, QUEUED, now, now))
+        self._executor.submit(self._run, job_id)
+        return self.get(job_id)
+
+    def resume(self):
+        """Re-queue queued jobs and running jobs abandoned by a dead process. Returns the number re-queued."""
+        rows = self._execute(
+            'SELECT id FROM jobs WHERE status = ? OR (status = ? AND updated < ?) ORDER BY created',
+            (QUEUED, RUNNING, time.time() - self.stale_after))
+        for row in rows:
+            self._executor.submit(self._run, row['id'])
+        return len(rows)
+
+    def start_sweeper(self, interval=60):
+        """Call resume() every `interval` seconds from a daemon thread."""
+        def sweep():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.resume()
+                except Exception as e:
+                    print("Job sweeper failed: %s" % e)
+        threading.Thread(target=sweep, name='job-sweeper', daemon=True).start()
+
+    def _claim(self, job_id):
+        # Atomic, so a job is only run by one worker thread across all processes sharing the file
+        now = time.time()
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                cur = conn.execute(
+                    'UPDATE jobs SET status = ?, updated = ? WHERE id = ? AND (status = ? OR (status = ? AND updated < ?))',
+                    (RUNNING, now, job_id, QUEUED, RUNNING, now - self.stale_after))
+                return cur.rowcount == 1
+        finally:
+            conn.close()
+
+    def _heartbeat(self, job_id, done):
+        # A handler can block in one EE call for longer than stale_after; without this the job would look
+        # abandoned and be claimed by a second worker while it is still running
+        while not done.wait(self.stale_after / 3):
+            try:
+                self._execute('UPDATE jobs SET updated = ? WHERE id = ? AND status = ?', (time.time(), job_id, RUNNING))
+            except Exception as e:
+                print("Job heartbeat failed: %s" % e)
+
+    def _run(self, job_id):
+        if not self._claim(job_id):
+            return
+        job = self.get(job_id)
+        done = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job_id, done), name='job-heartbeat', daemon=True).start()
+        try:
+            result = _HANDLERS[job['kind']](job['params'], JobContext(self, job))
+        except Exception as e:
+            traceback.print_exc()
+            self._update(job_id, status=FAILED, error=str(e))
+        else:
+            self._update(job_id, status=SUCCEEDED, progress=1.0, result=json.dumps(result))
+        finally:
+            done.set()
+
+    def stats(self):
+        rows = self._execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status')
+        return {r['status']: r['n'] for r in rows}
+
+
+def from_env():
+    path = os.environ.get('JOBS_DB_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.sqlite')
+    return JobManager(path, workers=int(os.environ.get('JOBS_WORKERS', '2')),
+                      stale_after=float(os.environ.get('JOBS_STALE_AFTER', '900')))
@@ -0,0 +1,117 @@
+# lifecycle.py
+# Start-up of an API process: model coefficients, Earth Engine, and the state the /healthz and /readyz probes
+# report.
+#
+# Nothing here runs at import. load_models() reads the coefficient values from the model bundle once per process
+# and touches no Earth Engine object. main.py calls it at import when APP_PRELOAD is set, i.e. in the master
+# process of `gunicorn --preload`, so the forked workers share the values copy-on-write instead of each loading
+# them. build_models() turns the values into the ee.Array / ee.Image objects models.py computes with, which the
+# ee library only allows once it is initialised. startup() runs in every worker after the fork (from the FastAPI
+# lifespan), because the HTTP session and credentials of the ee library must not be shared between processes.
+# It fails fast on a missing or unreadable model file. When Earth Engine cannot be initialised, it keeps
+# retrying in the background and the worker reports not ready until it succeeds and the models are built. Work
+# that needs Earth Engine, such as resuming background jobs, is passed as `on_ready` and only runs then.
+#
+# Usage:
+#   lifecycle.load_models()     # idempotent, returns the model version; no Earth Engine needed
+#   lifecycle.build_models()    # idempotent, after Earth Engine is initialised
+#   lifecycle.startup(on_ready=job_manager.resume)    # models + Earth Engine, then on_ready()
+#   lifecycle.status()          # {'ready': False, 'models': {...}, 'earth_engine': {...}, 'uptime': 1.2}
+#
+# Configuration (environment):
+#   MODEL_JS_PATH      PUSAeCMS_code.txt with the model coefficients (default: the copy next to models.py)
+#   MODEL_BUNDLE_PATH  precompiled bundle, see model_bundle.py (default: PUSAeCMS_models.npz next to the JS file)
+#   APP_PRELOAD        1 = load the model values when main.py is imported, before the workers fork (default 0)
+#   EE_INIT_RETRY      seconds between Earth Engine initialisation attempts after a failure (default 30)
+import os, threading, time
+import ee_client, model_bundle, models
+
+MODEL_JS_PATH = models._JS_FILE_PATH
+MODEL_BUNDLE_PATH = os.environ.get('MODEL_BUNDLE_PATH') or None
+PRELOAD = os.environ.get('APP_PRELOAD', '0') == '1'
+EE_INIT_RETRY = float(os.environ.get('EE_INIT_RETRY', '30'))
+
+_lock = threading.Lock()
+_state = {'model_version': None, 'model_values': None, 'models_built': False, 'ee_ready': False,
+          'ee_error': None, 'started': time.time(), 'pid': os.getpid()}
+
+
+def load_models():
+    """Read the model coefficient values once per process and return their version. Builds no ee object, so it
+    can run before Earth Engine is initialised."""
+    with _lock:
+        if _state['model_version'] is None:
+            if not os.path.exists(MODEL_JS_PATH) and not os.path.exists(
+                    MODEL_BUNDLE_PATH or model_bundle.default_bundle_path(MODEL_JS_PATH)):
+                raise RuntimeError('Model file not found: %s (set MODEL_JS_PATH or MODEL_BUNDLE_PATH)' % MODEL_JS_PATH)
+            _state['model_values'] = model_bundle.load_values(MODEL_JS_PATH, MODEL_BUNDLE_PATH)
+            _state['model_version'] = model_bundle.current_version(MODEL_JS_PATH, MODEL_BUNDLE_PATH)
+        return _state['model_version']
+
+
+def build_models():
+    """Set up the ee objects of models.py from the loaded values, once per process. Earth Engine must be
+    initialised."""
+    version = load_models()
+    with _lock:
+        if not _state['models_built']:
+            models.init_from_values(_state['model_values'])
+            _state['models_built'] = True
+    return version
+
+
+def model_version():
+    """Version of the loaded coefficients, part of every cache key that depends on them."""
+    return _state['model_version'] or load_models()
+
+
+def init_ee():
+    """Initialise Earth Engine; returns False (and records the error) instead of raising."""
+    try:
+        ee_client.init()
+    except Exception as e:
+        _state['ee_error'] = '%s: %s' % (type(e).__name__, e)
+        return False
+    _state['ee_ready'], _state['ee_error'] = True, None
+    return True
+
+
+def _retry_ee(on_ready):
+    while True:
+        print("Earth Engine initialisation failed, retrying in %gs: %s" % (EE_INIT_RETRY, _state['ee_error']))
+        time.sleep(EE_INIT_RETRY)
+        if init_ee():
+            break
+    _ready(on_ready)
+
+
+def _ready(on_ready):
+    build_models()
+    if on_ready is not None:
+        on_ready()
+
+
+def startup(on_ready=None):
+    """Per-process start-up: model values (raises when they cannot be loaded), then Earth Engine, then the ee
+    objects of the models. `on_ready()` is called once all are ready: right away, or from the background retry
+    when Earth Engine is late."""
+    # A worker forked from a preloading master inherits its state; the uptime starts with the worker
+    if _state['pid'] != os.getpid():
+        _state['pid'], _state['started'] = os.getpid(), time.time()
+    load_models()
+    if not _state['ee_ready'] and not init_ee():
+        threading.Thread(target=_retry_ee, args=(on_ready,), name='ee-init', daemon=True).start()
+    else:
+        _ready(on_ready)
+
+
+def status():
+    """Readiness of this process; makes no Earth Engine call."""
+    return {
+        'ready': _state['models_built'] and _state['ee_ready'],
+        'models': {'loaded': _state['model_version'] is not None, 'built': _state['models_built'],
+                   'version': _state['model_version'], 'path': MODEL_JS_PATH, 'preloaded': PRELOAD},
+        'earth_engine': {'initialized': _state['ee_ready'], 'error': _state['ee_error']},
+        'pid': os.getpid(),
+        'uptime': round(time.time() - _state['started'], 3),
+    }
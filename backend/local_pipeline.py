@@ -0,0 +1,195 @@
+# local_pipeline.py
+# Tiled, memory-bounded processing of downloaded Sentinel-2 scenes (GeoTIFF / COG), without Earth Engine.
+#
+# The scene is cut into square windows on the grid of a 10 m band. Each window is read from every band file
+# (20 m bands and SCL are resampled to 10 m on read), cloud-masked with the SCL band, run through the
+# index_engine formulas and the gp_local models, and written to one band per output of a tiled GeoTIFF.
+# Windows are processed by a process pool with a bounded number in flight, so peak memory depends on the
+# block size and worker count only, not on the scene size.
+#
+# A model output with the _VAR suffix (CWC_VAR, CCC_VAR, LAI_VAR) is the GP predictive variance of that model,
+# computed in the same pass as its mean, so unreliable pixels can be filtered before field statistics.
+#
+# Requires rasterio (pip install rasterio).
+#
+# Usage:
+#   python local_pipeline.py out.tif --band B2=T43_B02_10m.tif --band B3=... --scl T43_SCL_20m.tif \
+#       --outputs CWC,CCC,CCC_VAR,OSAVI --workers 4
+#
+#   import local_pipeline
+#   local_pipeline.process_scene({'B2': ..., 'B8': ..., 'SCL': ...}, 'out.tif', ['OSAVI', 'CWC'])
+import argparse, os
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy as np
+import gp_local, index_engine, indices, model_bundle, models
+
+# SCL classes masked out: no data, saturated/defective, cloud shadow, cloud medium/high probability, cirrus
+CLOUDY_SCL = (0, 1, 3, 8, 9, 10)
+NODATA = -9999.0
+DEFAULT_BLOCK_SIZE = 512
+# Suffix of the model outputs holding the GP predictive variance, e.g. LAI_VAR
+VARIANCE_SUFFIX = '_VAR'
+
+_DEFAULT_JS_PATH = models._JS_FILE_PATH
+
+# Per-worker state, set up once by _init_worker
+_worker = {}
+
+
+def _require_rasterio():
+    try:
+        import rasterio
+    except ImportError:
+        raise ImportError("The local pipeline needs rasterio: pip install rasterio")
+    return rasterio
+
+
+def model_of(output):
+    """Model name (CWC, CCC, LAI) an output is computed by, or None for an index."""
+    name = output[:-len(VARIANCE_SUFFIX)] if output.endswith(VARIANCE_SUFFIX) else output
+    return name if name in gp_local.MODEL_SUFFIXES else None
+
+
+def required_bands(outputs):
+    """Sentinel-2 bands needed to compute `outputs` (index names and/or CWC, CCC, LAI and their _VAR)."""
+    bands = set(index_engine.required_bands([o for o in outputs if o in indices.INDEX_EXPRESSIONS]))
+    if any(model_of(o) for o in outputs):
+        bands.update(models.MODEL_BANDS)
+    return sorted(bands)
+
+
+def _init_worker(band_paths, js_path, needs_models):
+    rasterio = _require_rasterio()
+    _worker['datasets'] = {name: rasterio.open(path) for name, path in band_paths.items()}
+    if needs_models:
+        gp_local.init_from_values(model_bundle.load_values(js_path, write=False))
+
+
+def _read_window(name, bounds, shape):
+    from rasterio.enums import Resampling
+    from rasterio.windows import from_bounds
+    src = _worker['datasets'][name]
+    window = from_bounds(*bounds, transform=src.transform)
+    # Nearest-neighbour resampling to the 10 m grid, as Earth Engine does by default
+    return src.read(1, window=window, out_shape=shape, resampling=Resampling.nearest, boundless=True, fill_value=0)
+
+
+def _process_block(task):
+    window_key, bounds, shape, outputs, dn_offset, cloudy_scl = task
+    bands = {}
+    valid = np.ones(shape, dtype=bool)
+    for name in _worker['datasets']:
+        if name == 'SCL':
+            continue
+        raw = _read_window(name, bounds, shape)
+        valid &= raw != 0
+        bands[name] = raw.astype(np.float64) + dn_offset
+    if 'SCL' in _worker['datasets']:
+        valid &= ~np.isin(_read_window('SCL', bounds, shape), cloudy_scl)
+
+    result = np.full((len(outputs),) + shape, NODATA, dtype=np.float32)
+    if valid.any():
+        index_names = [o for o in outputs if o in indices.INDEX_EXPRESSIONS]
+        computed = index_engine.evaluate_numpy({b: v[valid] for b, v in bands.items()}, index_names) if index_names else {}
+        model_names = sorted({model_of(o) for o in outputs} - {None})
+        if model_names:
+            reflectance = np.stack([bands[b][valid] for b in models.MODEL_BANDS], axis=-1)
+            for name in model_names:
+                if name + VARIANCE_SUFFIX in outputs:
+                    computed[name], computed[name + VARIANCE_SUFFIX] = gp_local.predict(
+                        name, reflectance, return_variance=True)
+                else:
+                    computed[name] = gp_local.predict(name, reflectance)
+        for i, o in enumerate(outputs):
+            # Pixels the model masks (LAI <= 0) are NaN
+            result[i][valid] = np.where(np.isnan(computed[o]), NODATA, computed[o])
+    return window_key, result
+
+
+def _windows(width, height, block_size):
+    from rasterio.windows import Window
+    for row in range(0, height, block_size):
+        for col in range(0, width, block_size):
+            yield Window(col, row, min(block_size, width - col), min(block_size, height - row))
+
+
+def process_scene(band_paths, out_path, outputs, block_size=DEFAULT_BLOCK_SIZE, workers=None,
+                  dn_offset=0.0, cloudy_scl=CLOUDY_SCL, js_path=_DEFAULT_JS_PATH):
+    """Compute `outputs` for a scene and write them to a tiled, compressed float32 GeoTIFF.
+
+    `band_paths` maps band names (B2 ... B12, optional SCL) to raster files; the output grid is that of B2 (or
+    the first 10 m band given). `dn_offset` is added to the raw digital numbers, e.g. -1000 for processing
+    baseline 04.00+ products to match COPERNICUS/S2_SR_HARMONIZED. Returns the output path."""
+    rasterio = _require_rasterio()
+    from rasterio.windows import bounds as window_bounds
+    if block_size % 16:
+        raise ValueError('block_size must be a multiple of 16 for a tiled GeoTIFF')
+    unknown = [o for o in outputs if o not in indices.INDEX_EXPRESSIONS and model_of(o) is None]
+    if unknown:
+        raise ValueError('Unknown outputs: %s' % ', '.join(unknown))
+    needed = required_bands(outputs)
+    missing = [b for b in needed if b not in band_paths]
+    if missing:
+        raise ValueError('Missing input bands: %s' % ', '.join(missing))
+    band_paths = {b: band_paths[b] for b in needed + (['SCL'] if 'SCL' in band_paths else [])}
+    ref_band = next(b for b in ('B2', 'B3', 'B4', 'B8') + tuple(needed) if b in band_paths)
+
+    with rasterio.open(band_paths[ref_band]) as ref:
+        profile = ref.profile.copy()
+        width, height, transform = ref.width, ref.height, ref.transform
+    profile.update(
+        driver='GTiff', dtype='float32', count=len(outputs), nodata=NODATA, tiled=True,
+        blockxsize=block_size, blockysize=block_size, compress='deflate', predictor=3, BIGTIFF='IF_SAFER',
+    )
+
+    workers = workers or os.cpu_count() or 1
+    needs_models = any(model_of(o) for o in outputs)
+    with rasterio.open(out_path, 'w', **profile) as dst, ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(band_paths, js_path, needs_models)) as pool:
+        for i, o in enumerate(outputs, start=1):
+            dst.set_band_description(i, o)
+        windows = {}
+        pending = set()
+        # Keep at most two blocks per worker in flight so memory does not grow with the scene
+        max_in_flight = 2 * workers
+        for key, window in enumerate(_windows(width, height, block_size)):
+            windows[key] = window
+            task = (key, window_bounds(window, transform), (int(window.height), int(window.width)),
+                    list(outputs), dn_offset, cloudy_scl)
+            pending.add(pool.submit(_process_block, task))
+            if len(pending) >= max_in_flight:
+                pending = _drain(pending, windows, dst, wait_all=False)
+        _drain(pending, windows, dst, wait_all=True)
+    return out_path
+
+
+def _drain(pending, windows, dst, wait_all):
+    done, pending = wait(pending, return_when=ALL_COMPLETED if wait_all else FIRST_COMPLETED)
+    for future in done:
+        key, data = future.result()
+        dst.write(data, window=windows.pop(key))
+    return pending
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compute indices / GP models for a local Sentinel-2 scene.')
+    parser.add_argument('out_path')
+    parser.add_argument('--band', action='append', default=[], metavar='NAME=PATH',
+                        help='input band file, e.g. B8=T43RFM_B08_10m.tif (repeat per band)')
+    parser.add_argument('--scl', help='scene classification (SCL) file used for cloud masking')
+    parser.add_argument('--outputs', required=True, help='comma-separated index names and/or CWC, CCC, LAI (append _VAR for the variance)')
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--dn-offset', type=float, default=0.0)
+    parser.add_argument('--model-js', default=_DEFAULT_JS_PATH)
+    args = parser.parse_args(argv)
+    band_paths = dict(b.split('=', 1) for b in args.band)
+    if args.scl:
+        band_paths['SCL'] = args.scl
+    outputs = [o.strip() for o in args.outputs.split(',') if o.strip()]
+    print(process_scene(band_paths, args.out_path, outputs, args.block_size, args.workers,
+                        args.dn_offset, js_path=args.model_js))
+
+
+if __name__ == '__main__':
+    main()
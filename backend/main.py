@@ -1,10 +1,30 @@
-from fastapi import FastAPI, UploadFile, Form, File
+from fastapi import FastAPI, UploadFile, Form, File, HTTPException, Request, Response
+from starlette.routing import Match
 from fastapi.middleware.cors import CORSMiddleware
-import ee, models
-import geopandas as gpd
-import tempfile
+import ee, aoi, collection_builder, ee_client, lifecycle, metrics, models, indices, index_engine, result_cache, result_store, ee_executor, jobs, utils, timeseries, tiles, zonal_stats
+from shapely.geometry import box, mapping, shape
+from collections import Counter
+from contextlib import asynccontextmanager
+import datetime
+import os
+import time
 
-app = FastAPI()
+
+def _start_jobs():
+    # Pick up jobs left unfinished by a previous process, and jobs abandoned by dead workers later on
+    job_manager.resume()
+    job_manager.start_sweeper()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Runs in each worker process, after the fork when the app is preloaded (see lifecycle.py). Jobs call Earth
+    # Engine, so they are only resumed once it is initialised; before that they would fail for good.
+    lifecycle.startup(on_ready=_start_jobs)
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow requests from your React frontend
 app.add_middleware(
@@ -15,51 +35,930 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize Earth Engine
-ee.Initialize(project="iari-big-data-project")
 
-# Load your PUSAeCMS model file
-models.init_from_js(r"C:\Users\BDL\Documents\GitHub\earth-agri-guide\backend\PUSAeCMS_code.txt")  # adjust path
+
+def _route_template(request):
+    """Path template of the route serving `request` (e.g. /tiles/{layer}/{z}/{x}/{y}.png), used as a metric label."""
+    for route in app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    """Per-request timings, EE call counts and cache outcomes (see metrics.py)."""
+    token = metrics.begin(_route_template(request))
+    response = None
+    try:
+        response = await call_next(request)
+        if metrics.SERVER_TIMING:
+            m = metrics.current()
+            response.headers["Server-Timing"] = m.server_timing()
+            response.headers["X-EE-Calls"] = str(m.ee_calls)
+        return response
+    finally:
+        length = response.headers.get("content-length") if response is not None else None
+        metrics.end(token, request.method, response.status_code if response is not None else 500,
+                    int(length) if length else None)
+
+
+# Earth Engine and the model coefficients are set up by the lifespan above. With APP_PRELOAD=1 the coefficient
+# values are read here already, so a `gunicorn --preload` master reads them once for all its workers; the ee
+# objects are built per worker once Earth Engine is initialised.
+if lifecycle.PRELOAD:
+    lifecycle.load_models()
+
+# Region statistics cache, configured through RESULT_CACHE* environment variables (see result_cache.py)
+cache = result_cache.from_env()
+
+# Background jobs for large AOIs / long date ranges, configured through JOBS_* environment variables
+job_manager = jobs.from_env()
+
+# Rendered map tiles, configured through TILE_CACHE_* environment variables (see tiles.py)
+tile_cache = tiles.cache_from_env()
+tile_renderer = tiles.TileRenderer()
+
+# Per-field series kept across runs for season monitoring, configured through RESULT_STORE_* environment variables
+store = result_store.from_env()
+
+# Biophysical models by the parameter names the frontend sends; any name in indices.INDEX_EXPRESSIONS
+# is accepted as well.
+MODEL_FUNCTIONS = models.MODEL_FUNCTIONS
+
+# getInfo() on a FeatureCollection is limited to 5000 elements per call
+_FEATURES_PER_CALL = 5000
+
+
+# Imagery used when a request does not name a sensor or composite method
+DEFAULT_SENSOR = "sentinel-2"
+DEFAULT_COMPOSITE = "median"
+
+
+def _collection(region, start_date, end_date, cloud_cover, sensor=DEFAULT_SENSOR):
+    """Cloud-masked images of `sensor` in the date window, clipped to the bounds of `region` (see
+    collection_builder.py); `region` None means no spatial filter (map layers)."""
+    return collection_builder.build_collection(sensor, region, start_date, end_date, cloud_cover)
+
+
+def _composite(region, start_date, end_date, cloud_cover, sensor=DEFAULT_SENSOR, method=DEFAULT_COMPOSITE):
+    return collection_builder.composite(_collection(region, start_date, end_date, cloud_cover, sensor), sensor, method)
+
+
+def _cached(key):
+    """Result cache lookup, recorded in the request metrics."""
+    value = cache.get(key)
+    metrics.cache_outcome("result", value is not None)
+    return value
+
+
+def _cache_result(key, result, end_date, has_values):
+    """Cache `result` of a date window ending at `end_date`. A result without any value (no clear pixel yet) is
+    not cached, and one of a recent window expires soon (see result_cache.py): scenes are still being ingested."""
+    if has_values:
+        cache.set(key, result, end_date)
+
+
+def _check_parameter(parameter, sensor=DEFAULT_SENSOR):
+    if parameter not in MODEL_FUNCTIONS and parameter not in indices.INDEX_EXPRESSIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown parameter: {parameter}")
+    needed = models.MODEL_BANDS if parameter in MODEL_FUNCTIONS else index_engine.required_bands([parameter])
+    missing = sorted(set(needed) - set(collection_builder.sensor_bands(sensor)))
+    if missing:
+        raise HTTPException(
+            status_code=400, detail=f"{parameter} needs bands {', '.join(missing)}, which {sensor} does not have",
+        )
+
+
+def _scale(scale, sensor):
+    """Requested reduction scale in metres, or the native resolution of `sensor` (10 m Sentinel-2, 30 m Landsat,
+    500 m MODIS): finer than that only repeats pixels and multiplies the work."""
+    if scale is None:
+        return collection_builder.native_scale(sensor)
+    if scale <= 0:
+        raise HTTPException(status_code=400, detail="scale must be positive")
+    return scale
+
+
+def _check_imagery(sensor, composite):
+    if sensor not in collection_builder.SENSORS:
+        raise HTTPException(status_code=400, detail=f"sensor must be one of {tuple(collection_builder.SENSORS)}")
+    if composite not in collection_builder.COMPOSITE_METHODS:
+        raise HTTPException(status_code=400, detail=f"composite must be one of {collection_builder.COMPOSITE_METHODS}")
+    if composite == "quality" and sensor == "sentinel-1":
+        raise HTTPException(status_code=400, detail="The quality composite is not available for sentinel-1")
+
+
+def _parameters_image(composite, parameters, sensor=DEFAULT_SENSOR):
+    """Multi-band image with one band per parameter (model or index name), in the order given.
+    All requested indices are evaluated as one fused graph (see index_engine.py)."""
+    for p in parameters:
+        _check_parameter(p, sensor)
+    with metrics.stage("build_graph"):
+        bands = {}
+        index_names = [p for p in parameters if p in indices.INDEX_EXPRESSIONS]
+        if index_names:
+            fused = index_engine.evaluate_ee(composite, index_names)
+            bands.update({p: fused.select(p) for p in index_names})
+        for p in parameters:
+            if p in MODEL_FUNCTIONS:
+                bands[p] = ee.Image(MODEL_FUNCTIONS[p](composite.select(models.MODEL_BANDS))).rename(p)
+        return ee.Image.cat(*[bands[p] for p in parameters])
+
+
+def _parameter_image(composite, parameter, sensor=DEFAULT_SENSOR):
+    """Single-band image of `parameter` (a model or index name), with the band named after it."""
+    return _parameters_image(composite, [parameter], sensor)
+
+
+async def _run_with_upload(request, aoi_file, fn, *args):
+    """Stream `aoi_file` to disk (see aoi.py) and run `fn(upload, *args)` on the EE thread pool.
+    The temporary file is removed whatever happens."""
+    with metrics.stage("upload"):
+        upload = await aoi.receive(aoi_file)
+    try:
+        return await ee_executor.run(fn, upload, *args, request=request)
+    finally:
+        upload.discard()
+
+
+def _run_model_sync(upload, parameter, start_date, end_date, cloud_cover, sensor, method, scale):
+    # Convert to Earth Engine geometry
+    gdf = aoi.read(upload)
+    geom = gdf.geometry.unary_union
+    key = result_cache.make_key(
+        geom, start_date=start_date, end_date=end_date, cloud_cover=cloud_cover, sensor=sensor, composite=method,
+        parameter=parameter, model_version=lifecycle.model_version(), scale=scale,
+    )
+    cached = _cached(key)
+    if cached is not None:
+        return cached
+    # From GeoJSON, so every part of a multipolygon and every hole is kept
+    region = ee.Geometry(mapping(geom))
+
+    # Masked composite of the sensor and select model
+    img = _parameter_image(_composite(region, start_date, end_date, cloud_cover, sensor, method), parameter, sensor)
+
+    stats = ee_client.call("reduceRegion", img.reduceRegion(
+        ee.Reducer.mean(), geometry=region, scale=scale, maxPixels=1e13
+    ).getInfo)
+
+    result = {
+        "parameter": parameter,
+        "mean": stats.get(parameter)
+    }
+    _cache_result(key, result, end_date, result["mean"] is not None)
+    return result
+
 
 @app.post("/run-model")
 async def run_model(
+    request: Request,
     parameter: str = Form(...),
     start_date: str = Form(...),
     end_date: str = Form(...),
     cloud_cover: float = Form(...),
     aoi_file: UploadFile = File(...),
+    sensor: str = Form(DEFAULT_SENSOR),
+    composite: str = Form(DEFAULT_COMPOSITE),
+    scale: float = Form(None),
 ):
-    # Save KML temporarily
-    tmp = tempfile.NamedTemporaryFile(delete=False)
-    tmp.write(await aoi_file.read())
-    tmp.flush()
+    _check_imagery(sensor, composite)
+    _check_parameter(parameter, sensor)
+    scale = _scale(scale, sensor)
+    metrics.annotate(parameter=parameter)
+    return await _run_with_upload(
+        request, aoi_file, _run_model_sync, parameter, start_date, end_date, cloud_cover, sensor, composite, scale,
+    )
 
-    # Convert to Earth Engine geometry
-    gdf = gpd.read_file(tmp.name)
-    aoi = ee.Geometry.Polygon(gdf.geometry[0].__geo_interface__["coordinates"])
-
-    # Filter Sentinel-2
-    coll = (
-        ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED")
-        .filterBounds(aoi)
-        .filterDate(start_date, end_date)
-        .filter(ee.Filter.lte("CLOUDY_PIXEL_PERCENTAGE", cloud_cover))
-        .median()
+
+def _field_ids(gdf, id_field):
+    """Field id of every feature: the `id_field` column, or the feature index. Results are keyed by field id,
+    so ids must be unique."""
+    if id_field and id_field not in gdf.columns:
+        raise HTTPException(status_code=400, detail=f"Unknown id_field: {id_field}")
+    field_ids = [str(v) for v in (gdf[id_field] if id_field else range(len(gdf)))]
+    repeated = sorted(fid for fid, n in Counter(field_ids).items() if n > 1)
+    if repeated:
+        raise HTTPException(
+            status_code=400, detail=f"{id_field} must be unique per feature, repeated: {', '.join(repeated[:10])}",
+        )
+    return field_ids
+
+
+def _run_model_batch_sync(upload, params, start_date, end_date, cloud_cover, id_field, scale, sensor, method):
+    gdf = aoi.read(upload)
+    field_ids = _field_ids(gdf, id_field)
+
+    # Fields whose statistics are already cached are not sent to Earth Engine again
+    results = {}
+    keys = {}
+    features = []
+    for fid, geom in zip(field_ids, gdf.geometry):
+        keys[fid] = result_cache.make_key(
+            geom, start_date=start_date, end_date=end_date, cloud_cover=cloud_cover, sensor=sensor, composite=method,
+            parameters=params, model_version=lifecycle.model_version(), scale=scale,
+        )
+        cached = _cached(keys[fid])
+        if cached is not None:
+            results[fid] = cached
+        else:
+            features.append(ee.Feature(ee.Geometry(mapping(geom)), {"field_id": fid}))
+
+    if features:
+        composite = _composite(ee.FeatureCollection(features), start_date, end_date, cloud_cover, sensor, method)
+        stacked = _parameters_image(composite, params, sensor)
+        for start in range(0, len(features), _FEATURES_PER_CALL):
+            chunk = ee.FeatureCollection(features[start:start + _FEATURES_PER_CALL])
+            # forEach names the outputs after the parameters, also when there is only one
+            reduced = stacked.reduceRegions(collection=chunk, reducer=ee.Reducer.mean().forEach(params), scale=scale)
+            # Drop geometries so only the statistics travel back
+            reduced = ee_client.call("reduceRegions", reduced.select(["field_id"] + params, None, False).getInfo)
+            for f in reduced["features"]:
+                props = f["properties"]
+                fid = props.get("field_id")
+                results[fid] = {p: props.get(p) for p in params}
+                _cache_result(keys[fid], results[fid], end_date, any(v is not None for v in results[fid].values()))
+
+    return {
+        "parameters": params,
+        "fields": [{"field_id": fid, **results.get(fid, {})} for fid in field_ids],
+    }
+
+
+@app.post("/run-model/batch")
+async def run_model_batch(
+    request: Request,
+    parameters: str = Form(...),
+    start_date: str = Form(...),
+    end_date: str = Form(...),
+    cloud_cover: float = Form(...),
+    aoi_file: UploadFile = File(...),
+    id_field: str = Form(None),
+    scale: float = Form(None),
+    sensor: str = Form(DEFAULT_SENSOR),
+    composite: str = Form(DEFAULT_COMPOSITE),
+):
+    """Mean of every parameter over every field of a multi-feature AOI file.
+
+    `parameters` is a comma-separated list of model (Cw, Ccc, Lai) and index names. All parameters are stacked
+    into one image and reduced over a single FeatureCollection with reduceRegions, so the whole batch costs one
+    Earth Engine call per 5000 fields instead of one per field and parameter."""
+    params = [p.strip() for p in parameters.split(",") if p.strip()]
+    if not params:
+        raise HTTPException(status_code=400, detail="No parameters given")
+    _check_imagery(sensor, composite)
+    for p in params:
+        _check_parameter(p, sensor)
+    scale = _scale(scale, sensor)
+    metrics.annotate(parameter=params[0] if len(params) == 1 else "multiple")
+    return await _run_with_upload(
+        request, aoi_file, _run_model_batch_sync, params, start_date, end_date, cloud_cover,
+        id_field, scale, sensor, composite,
     )
 
-    # Select model
-    if parameter == "Cw":
-        img = models.calculate_CWC(coll)
-    elif parameter == "Ccc":
-        img = models.calculate_CCC(coll)
-    else:
-        img = models.calculate_LAI_GREEN(coll)
 
-    stats = img.reduceRegion(
-        ee.Reducer.mean(), geometry=aoi, scale=10, maxPixels=1e13
-    ).getInfo()
+def _timeseries_sync(upload, parameter, start_date, end_date, cloud_cover, binning, scale, sensor):
+    gdf = aoi.read(upload)
+    geom = gdf.geometry.unary_union
+    key = result_cache.make_key(
+        geom, kind="timeseries", start_date=start_date, end_date=end_date, cloud_cover=cloud_cover, sensor=sensor,
+        parameter=parameter, binning=binning, model_version=lifecycle.model_version(), scale=scale,
+    )
+    cached = _cached(key)
+    if cached is not None:
+        return cached
+    region = ee.Geometry(mapping(geom))
+    series = timeseries.extract(
+        _collection(region, start_date, end_date, cloud_cover, sensor), region,
+        lambda img: _parameter_image(img, parameter, sensor), parameter,
+        scale=scale, binning=binning, start_date=start_date, end_date=end_date,
+    )
+    result = {"parameter": parameter, "binning": binning, **series}
+    _cache_result(key, result, end_date, bool(series["date"]))
+    return result
+
+
+@app.post("/timeseries")
+async def get_timeseries(
+    request: Request,
+    parameter: str = Form(...),
+    start_date: str = Form(...),
+    end_date: str = Form(...),
+    cloud_cover: float = Form(...),
+    aoi_file: UploadFile = File(...),
+    binning: str = Form(None),
+    scale: float = Form(None),
+    sensor: str = Form(DEFAULT_SENSOR),
+):
+    """Mean of `parameter` over the AOI for every cloud-masked image of `sensor`, or per `binning` (day, week,
+    month) median composite. Returned as columns: {"date": [...], "value": [...], "images": [...]}."""
+    _check_imagery(sensor, DEFAULT_COMPOSITE)
+    _check_parameter(parameter, sensor)
+    if binning not in timeseries.BINNINGS:
+        raise HTTPException(status_code=400, detail=f"binning must be one of {timeseries.BINNINGS[1:]}")
+    scale = _scale(scale, sensor)
+    metrics.annotate(parameter=parameter)
+    return await _run_with_upload(
+        request, aoi_file, _timeseries_sync, parameter, start_date, end_date, cloud_cover, binning, scale, sensor,
+    )
+
+
+# Pixel limit of a best-effort reduction; above it Earth Engine coarsens the scale instead of failing
+_BEST_EFFORT_MAX_PIXELS = 1e8
+
+
+def _stats_sync(upload, params, start_date, end_date, cloud_cover, sensor, method, spec, scale, per_field, id_field,
+                best_effort, tile_scale):
+    gdf = aoi.read(upload)
+    settings = dict(
+        start_date=start_date, end_date=end_date, cloud_cover=cloud_cover, sensor=sensor, composite=method,
+        parameters=params, spec=spec, model_version=lifecycle.model_version(), scale=scale,
+    )
+
+    if not per_field:
+        geom = gdf.geometry.unary_union
+        key = result_cache.make_key(geom, kind="stats", best_effort=best_effort, **settings)
+        cached = _cached(key)
+        if cached is not None:
+            return cached
+        region = ee.Geometry(mapping(geom))
+        img = _parameters_image(_composite(region, start_date, end_date, cloud_cover, sensor, method), params, sensor)
+        kwargs = {"maxPixels": 1e13}
+        if best_effort:
+            kwargs = {"maxPixels": _BEST_EFFORT_MAX_PIXELS, "bestEffort": True}
+        props = ee_client.call("reduceRegion", img.reduceRegion(
+            zonal_stats.reducer(spec, params), geometry=region, scale=scale, tileScale=tile_scale, **kwargs,
+        ).getInfo)
+        result = {"parameters": params, "statistics": {p: zonal_stats.unpack(props, p, spec, params) for p in params}}
+        _cache_result(key, result, end_date, any(s["count"] for s in result["statistics"].values()))
+        return result
+
+    field_ids = _field_ids(gdf, id_field)
+    results, keys, features = {}, {}, []
+    for fid, geom in zip(field_ids, gdf.geometry):
+        keys[fid] = result_cache.make_key(geom, kind="stats", **settings)
+        cached = _cached(keys[fid])
+        if cached is not None:
+            results[fid] = cached
+        else:
+            features.append(ee.Feature(ee.Geometry(mapping(geom)), {"field_id": fid}))
+    if features:
+        composite = _composite(ee.FeatureCollection(features), start_date, end_date, cloud_cover, sensor, method)
+        stacked = _parameters_image(composite, params, sensor)
+        reducer = zonal_stats.reducer(spec, params)
+        names = zonal_stats.output_names(spec, params)
+        for start in range(0, len(features), _FEATURES_PER_CALL):
+            chunk = ee.FeatureCollection(features[start:start + _FEATURES_PER_CALL])
+            reduced = stacked.reduceRegions(collection=chunk, reducer=reducer, scale=scale, tileScale=tile_scale)
+            reduced = ee_client.call("reduceRegions", reduced.select(["field_id"] + names, None, False).getInfo)
+            for f in reduced["features"]:
+                props = f["properties"]
+                fid = props.get("field_id")
+                results[fid] = {p: zonal_stats.unpack(props, p, spec, params) for p in params}
+                _cache_result(keys[fid], results[fid], end_date, any(s["count"] for s in results[fid].values()))
+    return {
+        "parameters": params,
+        "fields": [{"field_id": fid, "statistics": results.get(fid)} for fid in field_ids],
+    }
+
+
+def _parse_numbers(text, name):
+    try:
+        return [float(v) for v in text.split(",") if v.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be a comma-separated list of numbers")
+
+
+@app.post("/stats")
+async def region_statistics(
+    request: Request,
+    parameters: str = Form(...),
+    start_date: str = Form(...),
+    end_date: str = Form(...),
+    cloud_cover: float = Form(...),
+    aoi_file: UploadFile = File(...),
+    statistics: str = Form(",".join(zonal_stats.DEFAULT_STATISTICS)),
+    percentiles: str = Form(",".join(str(p) for p in zonal_stats.DEFAULT_PERCENTILES)),
+    bins: int = Form(zonal_stats.DEFAULT_BINS),
+    hist_min: float = Form(None),
+    hist_max: float = Form(None),
+    scale: float = Form(None),
+    sensor: str = Form(DEFAULT_SENSOR),
+    composite: str = Form(DEFAULT_COMPOSITE),
+    per_field: bool = Form(False),
+    id_field: str = Form(None),
+    best_effort: bool = Form(False),
+    tile_scale: float = Form(1),
+):
+    """Distribution of every parameter over the AOI: any of mean, std, min, max, sum, median, mode,
+    percentiles, histogram and count, from a single reduceRegion pass over one composite.
+
+    With `per_field` the statistics are computed for every feature of the AOI file with reduceRegions (one call
+    per 5000 fields). `tile_scale` (1-16) splits the reduction into smaller tiles for very large AOIs;
+    `best_effort` lets Earth Engine coarsen the scale instead of failing when the AOI has too many pixels
+    (AOI-wide statistics only)."""
+    params = [p.strip() for p in parameters.split(",") if p.strip()]
+    if not params:
+        raise HTTPException(status_code=400, detail="No parameters given")
+    _check_imagery(sensor, composite)
+    for p in params:
+        _check_parameter(p, sensor)
+    scale = _scale(scale, sensor)
+    if not 0 < tile_scale <= 16:
+        raise HTTPException(status_code=400, detail="tile_scale must be between 0 and 16")
+    if (hist_min is None) != (hist_max is None):
+        raise HTTPException(status_code=400, detail="Give both hist_min and hist_max, or neither")
+    try:
+        spec = zonal_stats.spec(
+            [s.strip() for s in statistics.split(",") if s.strip()], _parse_numbers(percentiles, "percentiles"),
+            bins, None if hist_min is None else (hist_min, hist_max),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    metrics.annotate(parameter=params[0] if len(params) == 1 else "multiple")
+    return await _run_with_upload(
+        request, aoi_file, _stats_sync, params, start_date, end_date, cloud_cover, sensor, composite, spec, scale,
+        per_field, id_field, best_effort, tile_scale,
+    )
+
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process serves requests. Makes no Earth Engine or database call."""
+    return {"status": "ok", "pid": os.getpid(), "uptime": lifecycle.status()["uptime"]}
+
+
+@app.get("/readyz")
+def readyz(response: Response):
+    """Readiness: 503 until the models are loaded and Earth Engine is initialised, or while the jobs database
+    cannot be read. Makes no Earth Engine call, so it is cheap enough to poll."""
+    status = lifecycle.status()
+    try:
+        job_manager.stats()
+        status["jobs"] = {"ok": True}
+    except Exception as e:
+        status["jobs"] = {"ok": False, "error": str(e)}
+        status["ready"] = False
+    if not status["ready"]:
+        response.status_code = 503
+    return status
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return cache.stats()
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text exposition of the request, EE call and cache metrics."""
+    executor = ee_executor.stats()
+    extra = [
+        ("pusa_ee_executor_queued", "Calls waiting for an EE worker thread.", executor["queued"]),
+        ("pusa_ee_executor_running", "Calls running on EE worker threads.", executor["running"]),
+        ("pusa_ee_executor_max_concurrency", "EE worker threads.", executor["max_concurrency"]),
+        ("pusa_tile_cache_bytes", "Size of the tile cache on disk.", tile_cache.stats()["bytes"]),
+    ]
+    # Every status is exported, also at 0, so a series does not vanish when its last job moves on
+    job_counts = {status: 0 for status in (jobs.QUEUED, jobs.RUNNING, jobs.SUCCEEDED, jobs.FAILED)}
+    job_counts.update(job_manager.stats())
+    extra.append(("pusa_jobs", "Background jobs by status.", job_counts, "status"))
+    return Response(content=metrics.render(extra), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/executor/stats")
+def executor_stats():
+    return {**ee_executor.stats(), "ee_client": ee_client.stats()}
+
+
+# Deepest zoom served; Sentinel-2 pixels are ~10 m, finer tiles only repeat them
+_MAX_TILE_ZOOM = 18
+# Upper bound on tiles queued by a single seeding job
+_MAX_SEED_TILES = 50000
+
+
+def _tile_layer(layer, start_date, end_date, cloud_cover, sensor=DEFAULT_SENSOR, method=DEFAULT_COMPOSITE):
+    """Cache key, image builder and visualisation parameters of a map layer."""
+    _check_parameter(layer, sensor)
+    vis = tiles.layer_vis(layer)
+    key = tiles.layer_key(
+        layer, start_date=start_date, end_date=end_date, cloud_cover=cloud_cover, vis=vis,
+        sensor=sensor, composite=method, model_version=lifecycle.model_version() if layer in MODEL_FUNCTIONS else None,
+    )
+    return key, lambda: _parameter_image(
+        _composite(None, start_date, end_date, cloud_cover, sensor, method), layer, sensor,
+    ), vis
+
+
+def _tile_sync(layer, z, x, y, start_date, end_date, cloud_cover, sensor, method):
+    key, image_fn, vis = _tile_layer(layer, start_date, end_date, cloud_cover, sensor, method)
+    data = tile_cache.get(key, z, x, y)
+    metrics.cache_outcome("tile", data is not None)
+    if data is None:
+        data = tile_renderer.render(key, image_fn, vis, z, x, y)
+        tile_cache.put(key, z, x, y, data)
+    return data
+
+
+@app.get("/tiles/{layer}/{z}/{x}/{y}.png")
+async def get_tile(
+    request: Request,
+    layer: str,
+    z: int,
+    x: int,
+    y: int,
+    start_date: str,
+    end_date: str,
+    cloud_cover: float = 20,
+    sensor: str = DEFAULT_SENSOR,
+    composite: str = DEFAULT_COMPOSITE,
+):
+    """XYZ map tile of a model (Cw, Ccc, Lai) or index layer for a date window, served from the tile cache
+    when it has been rendered before."""
+    _check_imagery(sensor, composite)
+    _check_parameter(layer, sensor)
+    if not 0 <= z <= _MAX_TILE_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=404, detail="Tile out of range")
+    metrics.annotate(parameter=layer)
+    data = await ee_executor.run(
+        _tile_sync, layer, z, x, y, start_date, end_date, cloud_cover, sensor, composite, request=request,
+    )
+    return Response(content=data, media_type="image/png", headers={"Cache-Control": "public, max-age=86400"})
+
+
+@app.get("/tiles/stats")
+def tile_stats():
+    return tile_cache.stats()
+
+
+def _seed_tiles(geom, zooms):
+    """(z, x, y) of every tile at `zooms` that intersects `geom`."""
+    parts = list(getattr(geom, "geoms", [geom]))
+    found = []
+    for z in zooms:
+        seen = set()
+        # Per part, so scattered fields do not pull in every tile of their joint bounding box
+        for part in parts:
+            for x, y in tiles.tiles_for_bounds(part.bounds, z):
+                tile = box(*tiles.tile_bounds(z, x, y))
+                # Tiles that only share an edge with the field would render nothing of it
+                if (x, y) not in seen and tile.intersects(part) and not tile.touches(part):
+                    seen.add((x, y))
+                    found.append((z, x, y))
+    return found
+
+
+@jobs.handler("seed_tiles")
+def _seed_tiles_job(params, ctx):
+    """Render and cache every tile of a layer over the AOI at the requested zoom levels.
+    Tiles already in the cache are skipped, so a resumed job continues where it stopped."""
+    layer = params["layer"]
+    key, image_fn, vis = _tile_layer(
+        layer, params["start_date"], params["end_date"], params["cloud_cover"],
+        params.get("sensor", DEFAULT_SENSOR), params.get("composite", DEFAULT_COMPOSITE),
+    )
+    todo = _seed_tiles(shape(params["geometry"]), params["zooms"])
+    rendered = 0
+    for i, (z, x, y) in enumerate(todo):
+        if not tile_cache.contains(key, z, x, y):
+            tile_cache.put(key, z, x, y, tile_renderer.render(key, image_fn, vis, z, x, y))
+            rendered += 1
+        if (i + 1) % 25 == 0:
+            ctx.progress((i + 1) / len(todo), f"{i + 1}/{len(todo)} tiles")
+    return {"layer": layer, "zooms": params["zooms"], "tiles": len(todo), "rendered": rendered}
+
+
+def _parse_zooms(zooms):
+    """'12,13' or '10-14' -> sorted list of zoom levels."""
+    levels = set()
+    try:
+        for part in zooms.split(","):
+            part = part.strip()
+            if "-" in part:
+                lo, hi = part.split("-", 1)
+                levels.update(range(int(lo), int(hi) + 1))
+            elif part:
+                levels.add(int(part))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid zooms: {zooms}")
+    if not levels or min(levels) < 0 or max(levels) > _MAX_TILE_ZOOM:
+        raise HTTPException(status_code=400, detail=f"zooms must be between 0 and {_MAX_TILE_ZOOM}")
+    return sorted(levels)
+
+
+def _submit_seed_sync(upload, params):
+    gdf = aoi.read(upload)
+    geom = gdf.geometry.unary_union
+    count = len(_seed_tiles(geom, params["zooms"]))
+    if count > _MAX_SEED_TILES:
+        raise HTTPException(status_code=400, detail=f"{count} tiles requested, at most {_MAX_SEED_TILES} per job")
+    params["geometry"] = mapping(geom)
+    return _job_summary(job_manager.submit("seed_tiles", params))
+
 
+@app.post("/tiles/seed")
+async def seed_tiles(
+    request: Request,
+    layer: str = Form(...),
+    start_date: str = Form(...),
+    end_date: str = Form(...),
+    cloud_cover: float = Form(20),
+    zooms: str = Form("12-16"),
+    aoi_file: UploadFile = File(...),
+    sensor: str = Form(DEFAULT_SENSOR),
+    composite: str = Form(DEFAULT_COMPOSITE),
+):
+    """Queue a background job that pre-renders the tiles of `layer` covering the farm boundaries in `aoi_file`
+    at `zooms` (e.g. "12-16" or "13,15"). Poll it with GET /jobs/{id}."""
+    _check_imagery(sensor, composite)
+    _check_parameter(layer, sensor)
+    params = {
+        "layer": layer, "start_date": start_date, "end_date": end_date,
+        "cloud_cover": cloud_cover, "sensor": sensor, "composite": composite, "zooms": _parse_zooms(zooms),
+    }
+    return await _run_with_upload(request, aoi_file, _submit_seed_sync, params)
+
+
+def _grid_cells(geom, n):
+    """Split `geom` into up to n x n pieces along a regular grid over its bounds."""
+    minx, miny, maxx, maxy = geom.bounds
+    dx, dy = (maxx - minx) / n, (maxy - miny) / n
+    cells = []
+    for i in range(n):
+        for j in range(n):
+            cell = geom.intersection(box(minx + i * dx, miny + j * dy, minx + (i + 1) * dx, miny + (j + 1) * dy))
+            if not cell.is_empty:
+                cells.append(cell)
+    return cells
+
+
+@jobs.handler("region_stats")
+def _region_stats_job(params, ctx):
+    """Mean of a parameter over a large AOI, reduced one grid cell at a time so no single call times out.
+    Per-cell means and pixel counts are saved as the job runs; a resumed job skips the finished cells."""
+    parameter = params["parameter"]
+    geom = shape(params["geometry"])
+    cells = _grid_cells(geom, params.get("grid", 4))
+    sensor = params.get("sensor", DEFAULT_SENSOR)
+    img = _parameter_image(
+        _composite(
+            ee.Geometry(mapping(geom)), params["start_date"], params["end_date"], params["cloud_cover"],
+            sensor, params.get("composite", DEFAULT_COMPOSITE),
+        ),
+        parameter, sensor,
+    )
+    reducer = ee.Reducer.mean().combine(ee.Reducer.count(), sharedInputs=True)
+    partials = ctx.state.get("partials", [])
+    for i in range(len(partials), len(cells)):
+        stats = ee_client.call("reduceRegion", img.reduceRegion(
+            reducer, geometry=ee.Geometry(mapping(cells[i])), scale=params.get("scale", 10),
+            maxPixels=1e13, tileScale=4,
+        ).getInfo)
+        partials.append([stats.get(parameter + "_mean"), stats.get(parameter + "_count") or 0])
+        ctx.save_state(partials=partials)
+        ctx.progress((i + 1) / len(cells), f"{i + 1}/{len(cells)} cells reduced")
+    valid = [(m, c) for m, c in partials if m is not None and c]
+    count = sum(c for _, c in valid)
     return {
         "parameter": parameter,
-        "mean": stats.get(img.bandNames().getInfo()[0])
+        "mean": sum(m * c for m, c in valid) / count if count else None,
+        "pixel_count": count,
     }
+
+
+# Seconds between Earth Engine task status checks
+_EXPORT_POLL_INTERVAL = 15
+
+
+@jobs.handler("export")
+def _export_job(params, ctx):
+    """Export a parameter map to Google Drive with an EE batch task and wait for it to finish.
+    The task id is saved, so a resumed job keeps polling the same task instead of starting a new one."""
+    task_id = ctx.state.get("task_id")
+    if task_id is None:
+        region = ee.Geometry(params["geometry"])
+        sensor = params.get("sensor", DEFAULT_SENSOR)
+        img = _parameter_image(
+            _composite(
+                region, params["start_date"], params["end_date"], params["cloud_cover"],
+                sensor, params.get("composite", DEFAULT_COMPOSITE),
+            ),
+            params["parameter"], sensor,
+        )
+        # Not retried: starting a task is not idempotent, and a retry after a lost response would start a
+        # second export. A failure fails the job, and resubmitting it starts a new one.
+        task = ee_client.call_once(
+            "export_start", utils.export_to_drive,
+            img.clip(region), description=params.get("description") or f"pusa_{params['parameter']}",
+            folder=params.get("folder") or "EarthEngineImages", scale=params.get("scale", 10), region=region,
+        )
+        task_id = task.id
+        ctx.save_state(task_id=task_id)
+    while True:
+        status = ee_client.call("getTaskStatus", ee.data.getTaskStatus, task_id)[0]
+        state = status.get("state")
+        if state == "COMPLETED":
+            return {"task_id": task_id, "state": state, "destination_uris": status.get("destination_uris", [])}
+        if state in ("FAILED", "CANCELLED", "CANCEL_REQUESTED"):
+            raise RuntimeError(f"Earth Engine task {task_id} {state}: {status.get('error_message', '')}")
+        ctx.progress(status.get("progress", 0.0), state)
+        time.sleep(_EXPORT_POLL_INTERVAL)
+
+
+def _job_summary(job):
+    return {k: job[k] for k in ("id", "kind", "status", "progress", "message", "error", "created", "updated")}
+
+
+def _submit_job_sync(upload, kind, params):
+    gdf = aoi.read(upload)
+    params["geometry"] = mapping(gdf.geometry.unary_union)
+    return _job_summary(job_manager.submit(kind, params))
+
+
+@app.post("/jobs")
+async def submit_job(
+    request: Request,
+    kind: str = Form(...),
+    parameter: str = Form(...),
+    start_date: str = Form(...),
+    end_date: str = Form(...),
+    cloud_cover: float = Form(...),
+    aoi_file: UploadFile = File(...),
+    scale: float = Form(None),
+    grid: int = Form(4),
+    folder: str = Form(None),
+    description: str = Form(None),
+    sensor: str = Form(DEFAULT_SENSOR),
+    composite: str = Form(DEFAULT_COMPOSITE),
+):
+    """Queue a `region_stats` (gridded reduceRegion) or `export` (EE batch export) job and return its id.
+    Submitting the same job again returns the existing one unless it failed."""
+    if kind not in ("region_stats", "export"):
+        raise HTTPException(status_code=400, detail=f"Unknown job kind: {kind}")
+    _check_imagery(sensor, composite)
+    _check_parameter(parameter, sensor)
+    scale = _scale(scale, sensor)
+    params = {
+        "parameter": parameter, "start_date": start_date, "end_date": end_date,
+        "cloud_cover": cloud_cover, "sensor": sensor, "composite": composite, "scale": scale,
+    }
+    if kind == "region_stats":
+        params["grid"] = grid
+    else:
+        params.update(folder=folder, description=description)
+    return await _run_with_upload(request, aoi_file, _submit_job_sync, kind, params)
+
+
+@app.get("/jobs")
+def list_jobs(status: str = None, limit: int = 100):
+    return [_job_summary(j) for j in job_manager.list(status, limit)]
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_summary(job)
+
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != jobs.SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    return job["result"]
+
+
+# Fields reduced per Earth Engine call by store updates; every image of the window adds a row per field
+_STORE_FIELDS_PER_CALL = 500
+
+
+def _store_settings(parameter, params):
+    """Settings digest of stored values: a change means the field's series is fetched again from the start."""
+    return result_store.settings_key(
+        cloud_cover=params["cloud_cover"], scale=params["scale"],
+        model_version=lifecycle.model_version() if parameter in MODEL_FUNCTIONS else None,
+    )
+
+
+@jobs.handler("store_update")
+def _store_update_job(params, ctx):
+    """Bring the stored series of every field up to `end_date`, asking Earth Engine only for the dates after
+    what is already stored. Fields are grouped by that date and each group is reduced over every image of its
+    window with one call per _STORE_FIELDS_PER_CALL fields. The store is written after every call, so a
+    resumed job skips the fields already done."""
+    parameters, sensor, end_date = params["parameters"], params["sensor"], params["end_date"]
+    settings = {p: _store_settings(p, params) for p in parameters}
+    geoms = store.geometries(params["field_ids"])
+    since = {}
+    for p in parameters:
+        for fid, until in store.checked_until(list(geoms), p, sensor, settings[p]).items():
+            start = max(until or params["start_date"], params["start_date"])
+            since[fid] = min(since.get(fid, start), start)
+    groups = {}
+    for fid, start in since.items():
+        if start < end_date:
+            groups.setdefault(start, []).append(fid)
+    checked = store.resume_date(end_date)
+    todo = sum(len(fids) for fids in groups.values())
+    done = observations = 0
+    for start, fids in sorted(groups.items()):
+        for i in range(0, len(fids), _STORE_FIELDS_PER_CALL):
+            chunk = fids[i:i + _STORE_FIELDS_PER_CALL]
+            fc = ee.FeatureCollection([ee.Feature(ee.Geometry(mapping(geoms[f])), {"field_id": f}) for f in chunk])
+            columns = timeseries.extract_fields(
+                _collection(fc, start, end_date, params["cloud_cover"], sensor), fc,
+                lambda img: _parameters_image(img, parameters, sensor), parameters, scale=params["scale"],
+            )
+            for p in parameters:
+                # Images of the same day (adjacent tiles) are averaged into one value per field and date
+                values = {f: {} for f in chunk}
+                for fid, date, value in zip(columns["field_id"], columns["date"], columns[p]):
+                    # None where this parameter had no valid pixel (LAI <= 0 is masked) but others had one
+                    if value is not None:
+                        values[fid].setdefault(date, []).append(value)
+                store.append(p, sensor, settings[p], {
+                    fid: [(date, sum(v) / len(v), len(v)) for date, v in sorted(dates.items())]
+                    for fid, dates in values.items()
+                }, checked)
+                observations += sum(len(dates) for dates in values.values())
+            done += len(chunk)
+            ctx.progress(done / todo, f"{done}/{todo} fields updated")
+    return {
+        "fields": len(geoms), "fields_updated": todo, "observations": observations, "checked_until": checked,
+    }
+
+
+def _submit_store_update_sync(upload, params, id_field):
+    if upload is not None:
+        gdf = aoi.read(upload)
+        field_ids = _field_ids(gdf, id_field)
+        for fid, geom in zip(field_ids, gdf.geometry):
+            store.put_field(fid, geom)
+    else:
+        field_ids = store.field_ids()
+    if not field_ids:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    params["field_ids"] = field_ids
+    return _job_summary(job_manager.submit("store_update", params))
+
+
+@app.post("/store/update")
+async def update_store(
+    request: Request,
+    parameters: str = Form(...),
+    start_date: str = Form(...),
+    end_date: str = Form(None),
+    cloud_cover: float = Form(20),
+    aoi_file: UploadFile = File(None),
+    id_field: str = Form(None),
+    scale: float = Form(None),
+    sensor: str = Form(DEFAULT_SENSOR),
+):
+    """Queue a job that appends the acquisitions since the last stored date (from `start_date`, the season
+    start, for new fields) up to `end_date` (default today) to the result store. The fields of `aoi_file` are
+    registered first, identified by `id_field`; without a file every registered field is updated."""
+    params_list = [p.strip() for p in parameters.split(",") if p.strip()]
+    if not params_list:
+        raise HTTPException(status_code=400, detail="No parameters given")
+    _check_imagery(sensor, DEFAULT_COMPOSITE)
+    for p in params_list:
+        _check_parameter(p, sensor)
+    scale = _scale(scale, sensor)
+    params = {
+        "parameters": params_list, "start_date": start_date,
+        "end_date": end_date or datetime.date.today().isoformat(),
+        "cloud_cover": cloud_cover, "scale": scale, "sensor": sensor,
+    }
+    if aoi_file is None:
+        return await ee_executor.run(_submit_store_update_sync, None, params, id_field)
+    return await _run_with_upload(request, aoi_file, _submit_store_update_sync, params, id_field)
+
+
+@app.get("/store/fields")
+def store_fields(limit: int = 1000, offset: int = 0):
+    return store.fields(limit, offset)
+
+
+@app.get("/store/series")
+def store_series(field_id: str, parameter: str, sensor: str = DEFAULT_SENSOR, start_date: str = None,
+                 end_date: str = None):
+    """Stored values of one field, as columns {"date": [...], "value": [...], "images": [...]}."""
+    return {"field_id": field_id, "parameter": parameter, "sensor": sensor,
+            **store.series(field_id, parameter, sensor, start_date, end_date)}
+
+
+@app.get("/store/latest")
+def store_latest(parameter: str, sensor: str = DEFAULT_SENSOR):
+    """Most recent stored value of `parameter` for every field."""
+    return {"parameter": parameter, "sensor": sensor, "fields": store.latest(parameter, sensor)}
+
+
+@app.get("/store/stats")
+def store_stats():
+    return store.stats()
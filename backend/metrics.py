@@ -0,0 +1,249 @@
+# metrics.py
+# Per-request instrumentation and a Prometheus /metrics exposition.
+#
+# The HTTP middleware in main.py opens a RequestMetrics for every request and keeps it in a context variable;
+# ee_executor copies the context into its worker threads, so work done on the EE thread pool records into the
+# same request. Code marks its phases with `stage()` and sends Earth Engine round trips through `ee_call()`,
+# which counts them, times them and measures the size of what came back. Cache lookups report through
+# `cache_outcome()`. When the request finishes its numbers go into process-wide counters and histograms,
+# rendered in the Prometheus text format by `render()`, and optionally into a Server-Timing response header.
+#
+# Usage:
+#   with metrics.stage('build_graph'):
+#       img = ...
+#   stats = metrics.ee_call('reduceRegion', img.reduceRegion(...).getInfo)
+#
+# Configuration (environment):
+#   METRICS_SERVER_TIMING   1 to add Server-Timing / X-EE-Calls headers to every response (default 0)
+import contextvars, json, os, threading, time
+from contextlib import contextmanager
+
+SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', '0').lower() in ('1', 'true', 'yes')
+
+# Seconds; EE calls range from tens of milliseconds to minutes for large AOIs
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Bytes
+SIZE_BUCKETS = (1e2, 1e3, 1e4, 1e5, 1e6, 1e7)
+# AOI area classes (upper bound in hectares, label) used as a request label, to relate latency to field size
+AOI_SIZE_CLASSES = ((10, 'lt10ha'), (100, 'lt100ha'), (1000, 'lt1000ha'), (10000, 'lt10000ha'))
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (n, _escape(v)) for n, v in zip(names, values))
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append('%s%s %r' % (self.name, _label_text(self.labels, key), float(value)))
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, tuple(labels), tuple(buckets)
+        # label values -> [per-bucket counts, sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labels)
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        le = self.labels + ('le',)
+        with self._lock:
+            for key, (counts, total, n) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append('%s_bucket%s %d' % (self.name, _label_text(le, key + (repr(float(bound)),)), count))
+                lines.append('%s_bucket%s %d' % (self.name, _label_text(le, key + ('+Inf',)), n))
+                lines.append('%s_sum%s %r' % (self.name, _label_text(self.labels, key), total))
+                lines.append('%s_count%s %d' % (self.name, _label_text(self.labels, key), n))
+        return lines
+
+
+REQUESTS = Counter('pusa_requests_total', 'HTTP requests.', ('route', 'method', 'status'))
+REQUEST_SECONDS = Histogram('pusa_request_seconds', 'HTTP request latency.', ('route', 'parameter', 'aoi_size'))
+STAGE_SECONDS = Histogram('pusa_stage_seconds', 'Time spent per request stage.', ('route', 'stage'))
+EE_CALLS = Counter('pusa_ee_calls_total', 'Earth Engine round trips.', ('route', 'call', 'outcome'))
+EE_CALL_SECONDS = Histogram('pusa_ee_call_seconds', 'Earth Engine round trip latency.', ('call',))
+EE_CALLS_PER_REQUEST = Histogram('pusa_ee_calls_per_request', 'Earth Engine round trips per HTTP request.',
+                                 ('route',), buckets=(0, 1, 2, 3, 5, 10, 25, 100))
+EE_PAYLOAD_BYTES = Histogram('pusa_ee_payload_bytes', 'Size of Earth Engine responses.', ('call',), SIZE_BUCKETS)
+UPLOAD_BYTES = Histogram('pusa_upload_bytes', 'Size of uploaded AOI files.', ('route',), SIZE_BUCKETS)
+RESPONSE_BYTES = Histogram('pusa_response_bytes', 'Size of HTTP response bodies.', ('route',), SIZE_BUCKETS)
+EE_RETRIES = Counter('pusa_ee_retries_total', 'Earth Engine calls retried after a quota or transient error.', ('call',))
+CACHE_LOOKUPS = Counter('pusa_cache_lookups_total', 'Cache lookups by cache and outcome.', ('route', 'cache', 'outcome'))
+
+REGISTRY = [REQUESTS, REQUEST_SECONDS, STAGE_SECONDS, EE_CALLS, EE_CALL_SECONDS, EE_CALLS_PER_REQUEST,
+            EE_PAYLOAD_BYTES, EE_RETRIES, UPLOAD_BYTES, RESPONSE_BYTES, CACHE_LOOKUPS]
+
+
+class RequestMetrics:
+    """Everything recorded while serving one request. Updated from the event loop and from EE worker threads."""
+
+    def __init__(self, route=''):
+        self.route = route
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.ee_calls = 0
+        self.labels = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self):
+        """Value of a Server-Timing header: one entry per stage plus the total, in milliseconds."""
+        with self._lock:
+            entries = ['%s;dur=%.1f' % (name.replace('.', '-'), 1000 * s) for name, s in self.stages.items()]
+        entries.append('total;dur=%.1f' % (1000 * (time.perf_counter() - self.started)))
+        return ', '.join(entries)
+
+
+def current():
+    """RequestMetrics of the request being served, or None (background jobs, scripts)."""
+    return _current.get()
+
+
+def begin(route=''):
+    """Start recording a request for `route` (the path template, not the raw path, to bound label values).
+    Returns the token for end()."""
+    return _current.set(RequestMetrics(route))
+
+
+def end(token, method, status, response_bytes=None):
+    """Finish the request opened by begin() and fold its numbers into the process-wide metrics.
+    Returns its RequestMetrics."""
+    m = _current.get()
+    _current.reset(token)
+    if m is None:
+        return None
+    route = m.route
+    elapsed = time.perf_counter() - m.started
+    REQUESTS.inc(route=route, method=method, status=status)
+    REQUEST_SECONDS.observe(elapsed, route=route, parameter=m.labels.get('parameter', ''),
+                            aoi_size=m.labels.get('aoi_size', ''))
+    EE_CALLS_PER_REQUEST.observe(m.ee_calls, route=route)
+    for name, seconds in m.stages.items():
+        STAGE_SECONDS.observe(seconds, route=route, stage=name)
+    if response_bytes is not None:
+        RESPONSE_BYTES.observe(response_bytes, route=route)
+    return m
+
+
+def _route():
+    m = _current.get()
+    return m.route if m is not None else 'background'
+
+
+def annotate(**labels):
+    """Attach request labels (parameter, aoi_size) used by pusa_request_seconds."""
+    m = _current.get()
+    if m is not None:
+        m.labels.update({k: str(v) for k, v in labels.items()})
+
+
+def aoi_size_class(hectares):
+    for bound, label in AOI_SIZE_CLASSES:
+        if hectares < bound:
+            return label
+    return 'ge10000ha'
+
+
+@contextmanager
+def stage(name):
+    """Time a block of work as stage `name` of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        m = _current.get()
+        if m is not None:
+            m.add_stage(name, elapsed)
+        else:
+            STAGE_SECONDS.observe(elapsed, route='background', stage=name)
+
+
+def _payload_size(result):
+    if isinstance(result, (bytes, bytearray)):
+        return len(result)
+    try:
+        return len(json.dumps(result, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+def ee_call(name, fn, *args, **kwargs):
+    """Make one Earth Engine round trip, `fn(*args, **kwargs)` (e.g. `image.reduceRegion(...).getInfo`),
+    recording it as call `name`: count, latency and response size."""
+    m = _current.get()
+    route = m.route if m is not None else 'background'
+    start = time.perf_counter()
+    try:
+        result = fn(*args, **kwargs)
+    except Exception:
+        EE_CALLS.inc(route=route, call=name, outcome='error')
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        EE_CALL_SECONDS.observe(elapsed, call=name)
+        if m is not None:
+            m.add_stage('ee.' + name, elapsed)
+            with m._lock:
+                m.ee_calls += 1
+    EE_CALLS.inc(route=route, call=name, outcome='ok')
+    EE_PAYLOAD_BYTES.observe(_payload_size(result), call=name)
+    return result
+
+
+def cache_outcome(cache, hit):
+    CACHE_LOOKUPS.inc(route=_route(), cache=cache, outcome='hit' if hit else 'miss')
+
+
+def observe_upload(size):
+    UPLOAD_BYTES.observe(size, route=_route())
+
+
+def render(extra=()):
+    """All metrics in the Prometheus text exposition format. `extra` is an iterable of gauges computed at scrape
+    time: (name, help, value), or (name, help, {label value: value}, label name) for a labelled gauge."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for name, help, value, *label in extra:
+        lines.extend(['# HELP %s %s' % (name, help), '# TYPE %s gauge' % name])
+        if label:
+            lines.extend('%s%s %r' % (name, _label_text(label, (str(k),)), float(v)) for k, v in sorted(value.items()))
+        else:
+            lines.append('%s %r' % (name, float(value)))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,113 @@
+# model_bundle.py
+# Precompiled binary bundle of the model coefficients parsed from PUSAeCMS_code.txt.
+#
+# models.parse_js_variables regex-searches the 345 KB JS file once per target variable and literal_evals
+# large nested arrays, on every process start. compile_bundle does that once and writes the values to a
+# versioned .npz file that also records a SHA-256 of the JS source; load_values reads the bundle back in
+# milliseconds and only falls back to the JS parse when the bundle is missing, stale or unreadable.
+#
+# Usage:
+#   python model_bundle.py [PUSAeCMS_code.txt] [PUSAeCMS_models.npz]     # one-time compile
+#
+#   import models, model_bundle
+#   models.init_from_values(model_bundle.load_values('/path/to/PUSAeCMS_code.txt'))
+import hashlib, os, sys, tempfile
+import numpy as np
+import models
+
+# Bump when the parser or the bundle layout changes so existing bundles are rebuilt.
+BUNDLE_VERSION = 2
+
+_META_VERSION = '__bundle_version__'
+_META_SOURCE = '__source_sha256__'
+
+
+def default_bundle_path(js_path):
+    return os.path.join(os.path.dirname(os.path.abspath(js_path)), 'PUSAeCMS_models.npz')
+
+
+def source_checksum(js_path):
+    with open(js_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def compile_bundle(js_path=models._JS_FILE_PATH, bundle_path=None, vals=None):
+    """Parse the JS file (unless `vals` is given) and write all model variables to `bundle_path`.
+    The file is written to a temporary name and renamed, so concurrent workers never see a partial bundle."""
+    bundle_path = bundle_path or default_bundle_path(js_path)
+    if vals is None:
+        vals = models.parse_js_variables(js_path)
+    arrays = {k: np.asarray(v, dtype=np.float64) for k, v in vals.items() if not isinstance(v, dict)}
+    arrays[_META_VERSION] = np.asarray(BUNDLE_VERSION)
+    arrays[_META_SOURCE] = np.asarray(source_checksum(js_path))
+    fd, tmp_path = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(os.path.abspath(bundle_path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        # mkstemp creates the file 0600; workers running as another user must still be able to read the bundle
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, bundle_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return bundle_path
+
+
+def read_bundle(bundle_path):
+    """Return (metadata, values) from a bundle. Values use the same python list/float layout as
+    models.parse_js_variables, so they can be passed straight to models.init_from_values."""
+    with np.load(bundle_path, allow_pickle=False) as data:
+        meta = {'version': int(data[_META_VERSION]), 'source_sha256': str(data[_META_SOURCE])}
+        vals = {}
+        for k in data.files:
+            if k in (_META_VERSION, _META_SOURCE):
+                continue
+            arr = data[k]
+            vals[k] = float(arr) if arr.ndim == 0 else arr.tolist()
+    return meta, vals
+
+
+def bundle_version(bundle_path):
+    """Identifier of the model coefficients in a bundle, e.g. for cache keys."""
+    meta, _ = read_bundle(bundle_path)
+    return '%d:%s' % (meta['version'], meta['source_sha256'][:16])
+
+
+def current_version(js_path=models._JS_FILE_PATH, bundle_path=None):
+    """Identifier of the coefficients load_values returns for these paths (same format as bundle_version)."""
+    if os.path.exists(js_path):
+        return '%d:%s' % (BUNDLE_VERSION, source_checksum(js_path)[:16])
+    return bundle_version(bundle_path or default_bundle_path(js_path))
+
+
+def load_values(js_path=models._JS_FILE_PATH, bundle_path=None, write=True):
+    """Load model values from the bundle, falling back to parsing the JS file.
+
+    The bundle is used when its version matches BUNDLE_VERSION and, if the JS file is present, its checksum
+    matches the source. Otherwise the JS file is parsed and (with `write=True`) the bundle is rebuilt."""
+    bundle_path = bundle_path or default_bundle_path(js_path)
+    have_source = os.path.exists(js_path)
+    if os.path.exists(bundle_path):
+        try:
+            meta, vals = read_bundle(bundle_path)
+        except Exception as e:
+            print("Ignoring unreadable model bundle %s: %s" % (bundle_path, e))
+        else:
+            if meta['version'] == BUNDLE_VERSION and (
+                    not have_source or meta['source_sha256'] == source_checksum(js_path)):
+                return vals
+            print("Model bundle %s is stale, re-parsing %s" % (bundle_path, js_path))
+    vals = models.parse_js_variables(js_path)
+    if write:
+        try:
+            compile_bundle(js_path, bundle_path, vals=vals)
+        except OSError as e:
+            print("Could not write model bundle %s: %s" % (bundle_path, e))
+    return vals
+
+
+if __name__ == '__main__':
+    js = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'PUSAeCMS_code.txt')
+    out = compile_bundle(js, sys.argv[2] if len(sys.argv) > 2 else None)
+    print("Wrote %s (version %s)" % (out, bundle_version(out)))
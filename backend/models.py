@@ -9,10 +9,15 @@
 # Usage:
 #   import ee, models
 #   models.init_from_js('/path/to/PUSAeCMS_code.txt')
+#   (or models.init_from_values(model_bundle.load_values(...)) to skip the parse, see model_bundle.py)
 #   Then call models.calculate_CWC(image), calculate_CCC(image), calculate_LAI_GREEN(image) as needed.
+#
+# Configuration (environment):
+#   MODEL_JS_PATH   default JS file of the functions below (default: PUSAeCMS_code.txt next to this file)
 import re, os, ee, ast
 
-_JS_FILE_PATH = os.path.join('/mnt/data', 'PUSAeCMS_code.txt')
+_JS_FILE_PATH = os.environ.get('MODEL_JS_PATH') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'PUSAeCMS_code.txt')
 
 # Regular expressions to capture JS var declarations for arrays/numbers used in models
 _VAR_RE = re.compile(r'var\s+(?P<name>\w+)\s*=\s*(?P<value>ee\.Array\(|ee\.Image\(|\[|[-]?[0-9]+\.?[0-9]*(?:[eE][-+]?[0-9]+)?)[\s\S]*?;')
@@ -20,8 +25,12 @@ _VAR_RE = re.compile(r'var\s+(?P<name>\w+)\s*=\s*(?P<value>ee\.Array\(|ee\.Image
 _TARGET_VARS = [
     'X_train_Cw','mx_Cw','sx_Cw','mean_model_Cw','hyp_ell_Cw','hyp_sign_Cw','hyp_sig_Cw','XDX_pre_calc_Cw','alpha_coefficients_Cw',
     'X_train_CCC','mx_CCC','sx_CCC','mean_model_CCC','hyp_ell_CCC','hyp_sign_CCC','hyp_sig_CCC','XDX_pre_calc_CCC','alpha_coefficients_CCC',
-    'X_train_GREEN','mean_model_GREEN','alpha_coefficients_GREEN','XDX_pre_calc_GREEN'
+    'X_train_GREEN','mx_GREEN','sx_GREEN','mean_model_Green','hyp_ell_GREEN','hyp_sign_GREEN','hyp_sig_GREEN','XDX_pre_calc_GREEN','alpha_coefficients_GREEN'
 ]
+# Sentinel-2 bands (in order) the GP models were trained on; images must be selected to these before prediction.
+MODEL_BANDS = ['B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'B8', 'B8A', 'B11', 'B12']
+# Display range of each model output by its API parameter name: the *_min_th / *_max_th values of the JS app.
+DISPLAY_RANGES = {'Cw': (0, 0.55), 'Ccc': (0, 600), 'Lai': (0, 7)}
 
 def _js_array_to_python(text):
     """Convert a JavaScript numeric array (possibly nested) into a Python list using ast.literal_eval after minor cleanup."""
@@ -54,14 +63,17 @@ def parse_js_variables(js_path=_JS_FILE_PATH, targets=_TARGET_VARS):
     """Parse the JS file and return a dict of variable name -> python list/number for the target variables."""
     with open(js_path, 'r', encoding='utf-8') as f:
         txt = f.read()
+    # Drop line comments first: a commented-out step such as `])//.multiply(1.0e+1)` must not be applied
+    txt = re.sub(r'//[^\n]*', '', txt)
     results = {}
     for var in targets:
-        # simple pattern: var <varname> = <value>;
-        pattern = re.compile(r'var\s+' + re.escape(var) + r'\s*=\s*([\s\S]*?);', flags=re.MULTILINE)
+        # simple pattern: var <varname> = <value>; -- or up to the next declaration when the `;` is missing
+        end = r'(?:;|(?=\n\s*var\s))'
+        pattern = re.compile(r'var\s+' + re.escape(var) + r'\s*=\s*([\s\S]*?)' + end, flags=re.MULTILINE)
         m = pattern.search(txt)
         if not m:
             # try without 'var' (some values may be assigned without var)
-            pattern2 = re.compile(re.escape(var) + r'\s*=\s*([\s\S]*?);', flags=re.MULTILINE)
+            pattern2 = re.compile(re.escape(var) + r'\s*=\s*([\s\S]*?)' + end, flags=re.MULTILINE)
             m = pattern2.search(txt)
         if not m:
             continue
@@ -93,7 +105,10 @@ def parse_js_variables(js_path=_JS_FILE_PATH, targets=_TARGET_VARS):
 
 # Initialize EE Python objects for the model variables
 def init_from_js(js_path=_JS_FILE_PATH):
-    vals = parse_js_variables(js_path)
+    return init_from_values(parse_js_variables(js_path))
+
+def init_from_values(vals):
+    """Convert parsed model values (from parse_js_variables or model_bundle.load_values) into EE objects."""
     globals_dict = {}
     # Convert lists into ee.Array or ee.Image as appropriate
     for k, v in vals.items():
@@ -174,24 +189,31 @@ def calculate_CCC(image_orig):
     return image_orig.select('CCC')
 
 def calculate_LAI_GREEN(image_orig):
-    # LAI uses X_train_GREEN etc.
+    """Calculate LAI as the JS calculate_LAI_GREEN does: the full ARD kernel with the GREEN normalisation,
+    without adding the model mean (commented out in the JS) and with pixels <= 0 masked."""
     X_train = globals().get('X_train_GREEN')
-    mx = globals().get('mx_GREEN') or globals().get('mx_Cw')  # fallback
-    sx = globals().get('sx_GREEN') or globals().get('sx_Cw')
-    alpha = globals().get('alpha_coefficients_GREEN')
+    mx = globals().get('mx_GREEN')
+    sx = globals().get('sx_GREEN')
+    hyp_ell = globals().get('hyp_ell_GREEN')
+    hyp_sig = globals().get('hyp_sig_GREEN')
     XDX_pre_calc = globals().get('XDX_pre_calc_GREEN')
-    mean_model = globals().get('mean_model_GREEN')
-    if X_train is None:
+    alpha = globals().get('alpha_coefficients_GREEN')
+    if X_train is None or mx is None:
         raise RuntimeError('Model variables not initialized. Call init_from_js(path) first.')
     XTrain_dim = X_train.length().get([0])
     band_sequence = ee.List.sequence(1, XTrain_dim).map(lambda e: ee.String('B').cat(ee.String(e)).replace('[.]+[0-9]*$',''))
-    # Simple linear model placeholder similar to CCC/CWC; original uses same kernel approach.
+    im_norm_ell2D_hypell = image_orig.subtract(ee.Image(mx)).divide(ee.Image(sx)).multiply(ee.Image(hyp_ell)).toArray().toArray(1)
     im_norm_ell2D = image_orig.subtract(ee.Image(mx)).divide(ee.Image(sx)).toArray().toArray(1)
-    PtTDX = ee.Image(X_train).matrixMultiply(im_norm_ell2D).arrayProject([0]).arrayFlatten([band_sequence])
+    PtTDX = ee.Image(X_train).matrixMultiply(im_norm_ell2D_hypell).arrayProject([0]).arrayFlatten([band_sequence])
+    PtTPt = im_norm_ell2D_hypell.matrixTranspose().matrixMultiply(im_norm_ell2D).arrayProject([0]).multiply(-0.5)
+    arg1 = PtTPt.exp().multiply(hyp_sig)
     k_star = PtTDX.subtract(ee.Image(XDX_pre_calc).multiply(0.5)).exp().toArray()
-    mean_pred = k_star.arrayDotProduct(ee.Image(alpha).toArray())
-    mean_pred = ee.Image(mean_pred).add(ee.Image(mean_model))
+    mean_pred = k_star.arrayDotProduct(ee.Image(alpha).toArray()).multiply(arg1)
     mean_pred = mean_pred.toArray(1).arrayProject([0]).arrayFlatten([['LAI']])
-    mean_pred = mean_pred.where(mean_pred.lt(0), ee.Image(0.00001))
+    mean_pred = mean_pred.updateMask(mean_pred.gt(0))
     image_orig = image_orig.addBands(mean_pred)
     return image_orig.select('LAI')
+
+
+# Model functions by the API parameter names (the keys of DISPLAY_RANGES)
+MODEL_FUNCTIONS = {'Cw': calculate_CWC, 'Ccc': calculate_CCC, 'Lai': calculate_LAI_GREEN}
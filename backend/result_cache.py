@@ -0,0 +1,230 @@
+# result_cache.py
+# Content-addressed cache for region statistics.
+#
+# A result is keyed on a SHA-256 of the AOI geometry (normalised WKB) and every other input that changes the
+# answer: dates, cloud cover, parameter, model version and scale. Archival imagery does not change, so a repeat
+# request can be answered without rebuilding the composite or running reduceRegion again.
+#
+# A date window that ends within the last RESULT_CACHE_INGEST_LAG days (or in the future) can still gain scenes
+# as Earth Engine ingests them, so its results are only kept for RESULT_CACHE_RECENT_TTL seconds.
+#
+# Backends:
+#   MemoryBackend  - in-process LRU with a TTL
+#   SQLiteBackend  - on-disk store shared by every worker on the host; expired rows are deleted when read and
+#                    by a purge every RESULT_CACHE_PURGE_INTERVAL seconds, which also drops the oldest written
+#                    rows beyond RESULT_CACHE_DB_ROWS
+# ResultCache checks its backends in order and back-fills the faster ones on a hit.
+#
+# Configuration (environment):
+#   RESULT_CACHE          memory | sqlite | memory+sqlite (default) | none
+#   RESULT_CACHE_PATH     SQLite file (default: result_cache.sqlite next to this file)
+#   RESULT_CACHE_TTL      seconds, 0 = never expire (default 0)
+#   RESULT_CACHE_RECENT_TTL  seconds results of recent windows are kept, 0 = not cached (default 3600)
+#   RESULT_CACHE_INGEST_LAG  days before today after which a window counts as recent (default 3)
+#   RESULT_CACHE_SIZE     max entries of the in-process LRU (default 2048)
+#   RESULT_CACHE_DB_ROWS  max rows of the SQLite file (default 100000)
+#   RESULT_CACHE_PURGE_INTERVAL  seconds between purges of the SQLite file (default 300)
+import datetime, hashlib, json, os, sqlite3, threading, time
+from collections import OrderedDict
+
+
+def _expires(ttl):
+    return time.time() + ttl if ttl else 0
+
+
+def make_key(geometry, **parts):
+    """Canonical cache key for a shapely `geometry` plus keyword `parts` (must be JSON serialisable)."""
+    h = hashlib.sha256()
+    if geometry is not None:
+        h.update(geometry.normalize().wkb)
+    h.update(json.dumps(parts, sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+
+class MemoryBackend:
+    name = 'memory'
+
+    def __init__(self, maxsize=2048, ttl=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """(value, expiry timestamp or 0) for `key`, or None."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires and expires < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value, expires
+
+    def set(self, key, value, expires=None):
+        """Store `value` until the `expires` timestamp (0 = never; default: the backend TTL from now)."""
+        with self._lock:
+            self._data[key] = (_expires(self.ttl) if expires is None else expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteBackend:
+    """Values are stored as JSON. A new connection is opened per call, so the backend is safe to share between
+    threads and, through the file, between worker processes."""
+    name = 'sqlite'
+
+    def __init__(self, path, ttl=0, maxrows=100000, purge_interval=300):
+        self.path = path
+        self.ttl = ttl
+        self.maxrows = maxrows
+        self.purge_interval = purge_interval
+        self._last_purge = time.time()
+        self._lock = threading.Lock()
+        self._execute('PRAGMA journal_mode=WAL')
+        self._execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)')
+
+    def _execute(self, sql, params=()):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def get(self, key):
+        rows = self._execute('SELECT value, expires FROM results WHERE key = ?', (key,))
+        if not rows:
+            return None
+        if rows[0][1] and rows[0][1] < time.time():
+            self._execute('DELETE FROM results WHERE key = ? AND expires = ?', (key, rows[0][1]))
+            return None
+        return json.loads(rows[0][0]), rows[0][1]
+
+    def set(self, key, value, expires=None):
+        expires = _expires(self.ttl) if expires is None else expires
+        self._execute('INSERT OR REPLACE INTO results (key, value, expires) VALUES (?, ?, ?)',
+                      (key, json.dumps(value), expires))
+        with self._lock:
+            due = time.time() - self._last_purge >= self.purge_interval
+            if due:
+                self._last_purge = time.time()
+        if due:
+            self.purge()
+
+    def purge(self):
+        """Delete expired rows, then the oldest written rows beyond `maxrows`. Returns the number deleted."""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                deleted = conn.execute('DELETE FROM results WHERE expires != 0 AND expires < ?',
+                                       (time.time(),)).rowcount
+                # INSERT OR REPLACE gives a rewritten key a new rowid, so the lowest rowids were written longest ago
+                excess = conn.execute('SELECT COUNT(*) FROM results').fetchone()[0] - self.maxrows
+                if self.maxrows and excess > 0:
+                    deleted += conn.execute('DELETE FROM results WHERE rowid IN '
+                                            '(SELECT rowid FROM results ORDER BY rowid LIMIT ?)', (excess,)).rowcount
+            return deleted
+        finally:
+            conn.close()
+
+    def __len__(self):
+        return self._execute('SELECT COUNT(*) FROM results')[0][0]
+
+
+class ResultCache:
+    def __init__(self, backends=(), recent_ttl=3600, ingest_lag_days=3):
+        self.backends = list(backends)
+        self.recent_ttl = recent_ttl
+        self.ingest_lag_days = ingest_lag_days
+        self._lock = threading.Lock()
+        self.hits = {b.name: 0 for b in self.backends}
+        self.misses = 0
+        self.errors = 0
+
+    def get(self, key):
+        """Cached value for `key` or None."""
+        for i, backend in enumerate(self.backends):
+            try:
+                item = backend.get(key)
+            except Exception as e:
+                self._count_error(backend, e)
+                continue
+            if item is not None:
+                value, expires = item
+                with self._lock:
+                    self.hits[backend.name] += 1
+                # Back-filled with the same expiry, so a short-lived result stays short-lived
+                for faster in self.backends[:i]:
+                    faster.set(key, value, expires)
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def is_recent(self, end_date):
+        """True when scenes up to `end_date` may not all be ingested yet."""
+        end = datetime.date.fromisoformat(str(end_date)[:10])
+        return end > datetime.date.today() - datetime.timedelta(days=self.ingest_lag_days)
+
+    def set(self, key, value, end_date=None):
+        """Store `value`. With the `end_date` of its date window, a recent window is only kept for
+        recent_ttl seconds (or not at all when that is 0)."""
+        expires = None
+        if end_date is not None and self.is_recent(end_date):
+            if not self.recent_ttl:
+                return
+            expires = _expires(self.recent_ttl)
+        for backend in self.backends:
+            try:
+                backend.set(key, value, expires)
+            except Exception as e:
+                self._count_error(backend, e)
+
+    def get_or_compute(self, key, compute, end_date=None):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value, end_date)
+        return value
+
+    def _count_error(self, backend, e):
+        with self._lock:
+            self.errors += 1
+        print("Result cache backend %s failed: %s" % (backend.name, e))
+
+    def stats(self):
+        hits = sum(self.hits.values())
+        total = hits + self.misses
+        return {
+            'backends': [b.name for b in self.backends],
+            'hits': dict(self.hits),
+            'misses': self.misses,
+            'errors': self.errors,
+            'hit_ratio': hits / total if total else 0.0,
+            'entries': {b.name: len(b) for b in self.backends},
+        }
+
+
+def from_env():
+    kind = os.environ.get('RESULT_CACHE', 'memory+sqlite').lower()
+    ttl = float(os.environ.get('RESULT_CACHE_TTL', '0'))
+    recent_ttl = float(os.environ.get('RESULT_CACHE_RECENT_TTL', '3600'))
+    ingest_lag_days = int(os.environ.get('RESULT_CACHE_INGEST_LAG', '3'))
+    backends = []
+    if kind == 'none':
+        return ResultCache(backends, recent_ttl, ingest_lag_days)
+    if 'memory' in kind:
+        backends.append(MemoryBackend(int(os.environ.get('RESULT_CACHE_SIZE', '2048')), ttl))
+    if 'sqlite' in kind:
+        path = os.environ.get('RESULT_CACHE_PATH') or os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'result_cache.sqlite')
+        backends.append(SQLiteBackend(path, ttl, int(os.environ.get('RESULT_CACHE_DB_ROWS', '100000')),
+                                      float(os.environ.get('RESULT_CACHE_PURGE_INTERVAL', '300'))))
+    return ResultCache(backends, recent_ttl, ingest_lag_days)
@@ -0,0 +1,210 @@
+# result_store.py
+# Persistent per-field results for season-long monitoring.
+#
+# Values are stored in a local SQLite file, one row per field, parameter, sensor and acquisition date. For every
+# field and parameter the store also remembers up to which date it has been checked against Earth Engine, so a
+# monitoring run only asks for the acquisitions after that date and appends them. Dashboards read series and
+# latest values straight from the store, without any Earth Engine call.
+#
+# A field is registered with its geometry. When a field comes back with a different boundary, its stored values
+# are dropped. They are also refetched from the start of the season when the settings that produced them
+# (cloud cover, scale, model version) change.
+#
+# Usage:
+#   store = result_store.from_env()
+#   store.put_field('F-17', polygon)
+#   since = store.checked_until(['F-17'], 'Lai', 'sentinel-2', settings)    # {'F-17': None}: nothing stored yet
+#   store.append('Lai', 'sentinel-2', settings, {'F-17': [('2024-07-03', 2.41, 1)]}, checked_until='2024-07-20')
+#   store.series('F-17', 'Lai', 'sentinel-2')    # {'date': [...], 'value': [...], 'images': [...]}
+#
+# Configuration (environment):
+#   RESULT_STORE_PATH        SQLite file (default: result_store.sqlite next to this file)
+#   RESULT_STORE_INGEST_LAG  days before the end of a run that are checked again by the next run, because
+#                            Earth Engine ingests new acquisitions with a delay (default 3)
+import datetime, hashlib, json, os, sqlite3, time
+from shapely.geometry import mapping, shape
+
+
+def settings_key(**settings):
+    """Short digest of the settings that change stored values (cloud cover, scale, model version)."""
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def _geometry_digest(geometry):
+    return hashlib.sha256(geometry.normalize().wkb).hexdigest()
+
+
+class ResultStore:
+    """A new connection is opened per call, so the store is safe to share between threads and, through the
+    file, between worker processes."""
+
+    def __init__(self, path, ingest_lag_days=3):
+        self.path = path
+        self.ingest_lag_days = ingest_lag_days
+        self._execute('PRAGMA journal_mode=WAL')
+        self._executescript('''
+            CREATE TABLE IF NOT EXISTS fields (
+                field_id TEXT PRIMARY KEY, geometry TEXT NOT NULL, digest TEXT NOT NULL, updated REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS coverage (
+                field_id TEXT NOT NULL, parameter TEXT NOT NULL, sensor TEXT NOT NULL, settings TEXT NOT NULL,
+                checked_until TEXT NOT NULL, updated REAL NOT NULL,
+                PRIMARY KEY (field_id, parameter, sensor));
+            CREATE TABLE IF NOT EXISTS observations (
+                field_id TEXT NOT NULL, parameter TEXT NOT NULL, sensor TEXT NOT NULL, date TEXT NOT NULL,
+                value REAL, images INTEGER NOT NULL DEFAULT 1,
+                PRIMARY KEY (field_id, parameter, sensor, date));
+            CREATE INDEX IF NOT EXISTS observations_parameter_date ON observations (parameter, sensor, date);
+        ''')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _execute(self, sql, params=()):
+        conn = self._connect()
+        try:
+            with conn:
+                return [dict(r) for r in conn.execute(sql, params).fetchall()]
+        finally:
+            conn.close()
+
+    def _executescript(self, script):
+        conn = self._connect()
+        try:
+            conn.executescript(script)
+        finally:
+            conn.close()
+
+    def put_field(self, field_id, geometry):
+        """Register or update a field (shapely geometry, EPSG:4326). Returns True when its boundary changed,
+        in which case everything stored for it is dropped."""
+        digest = _geometry_digest(geometry)
+        conn = self._connect()
+        try:
+            with conn:
+                row = conn.execute('SELECT digest FROM fields WHERE field_id = ?', (field_id,)).fetchone()
+                if row is not None and row['digest'] == digest:
+                    return False
+                if row is not None:
+                    conn.execute('DELETE FROM observations WHERE field_id = ?', (field_id,))
+                    conn.execute('DELETE FROM coverage WHERE field_id = ?', (field_id,))
+                conn.execute('INSERT OR REPLACE INTO fields (field_id, geometry, digest, updated) VALUES (?, ?, ?, ?)',
+                             (field_id, json.dumps(mapping(geometry)), digest, time.time()))
+                return row is not None
+        finally:
+            conn.close()
+
+    def geometries(self, field_ids):
+        """{field_id: shapely geometry} of the registered fields among `field_ids`."""
+        found = {}
+        for start in range(0, len(field_ids), 500):
+            chunk = list(field_ids[start:start + 500])
+            rows = self._execute('SELECT field_id, geometry FROM fields WHERE field_id IN (%s)'
+                                 % ','.join('?' * len(chunk)), chunk)
+            found.update({r['field_id']: shape(json.loads(r['geometry'])) for r in rows})
+        return found
+
+    def field_ids(self):
+        return [r['field_id'] for r in self._execute('SELECT field_id FROM fields ORDER BY field_id')]
+
+    def checked_until(self, field_ids, parameter, sensor, settings):
+        """{field_id: first date not yet checked} for `field_ids`; None for a field with nothing usable stored
+        (never fetched, or fetched with other settings)."""
+        found = dict.fromkeys(field_ids)
+        for start in range(0, len(field_ids), 500):
+            chunk = list(field_ids[start:start + 500])
+            rows = self._execute(
+                'SELECT field_id, checked_until FROM coverage WHERE parameter = ? AND sensor = ? AND settings = ? '
+                'AND field_id IN (%s)' % ','.join('?' * len(chunk)), [parameter, sensor, settings] + chunk)
+            found.update({r['field_id']: r['checked_until'] for r in rows})
+        return found
+
+    def append(self, parameter, sensor, settings, results, checked_until):
+        """Store `results`, {field_id: [(date, value, images), ...]}, and record that every field in it has been
+        checked up to `checked_until` (exclusive), in one transaction. Rows of dates already stored replace
+        them; values a field has stored with other settings are dropped first."""
+        field_ids = list(results)
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                for start in range(0, len(field_ids), 500):
+                    chunk = field_ids[start:start + 500]
+                    conn.execute(
+                        'DELETE FROM observations WHERE parameter = ? AND sensor = ? AND field_id IN ('
+                        ' SELECT field_id FROM coverage WHERE parameter = ? AND sensor = ? AND settings != ?'
+                        ' AND field_id IN (%s))' % ','.join('?' * len(chunk)),
+                        [parameter, sensor, parameter, sensor, settings] + chunk)
+                conn.executemany(
+                    'INSERT OR REPLACE INTO observations (field_id, parameter, sensor, date, value, images) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [(fid, parameter, sensor, date, value, images)
+                     for fid, rows in results.items() for date, value, images in rows])
+                conn.executemany(
+                    'INSERT OR REPLACE INTO coverage (field_id, parameter, sensor, settings, checked_until, updated) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [(fid, parameter, sensor, settings, checked_until, now) for fid in field_ids])
+        finally:
+            conn.close()
+
+    def resume_date(self, end_date):
+        """Date up to which a run ending at `end_date` counts as checked: the last RESULT_STORE_INGEST_LAG days
+        are asked for again next time, since acquisitions reach Earth Engine with a delay."""
+        end = datetime.date.fromisoformat(str(end_date)[:10])
+        lagged = datetime.date.today() - datetime.timedelta(days=self.ingest_lag_days)
+        return min(end, lagged).isoformat()
+
+    def series(self, field_id, parameter, sensor, start_date=None, end_date=None):
+        """Stored values of a field as columns {'date': [...], 'value': [...], 'images': [...]}, by date."""
+        sql = 'SELECT date, value, images FROM observations WHERE field_id = ? AND parameter = ? AND sensor = ?'
+        params = [field_id, parameter, sensor]
+        if start_date:
+            sql += ' AND date >= ?'
+            params.append(start_date)
+        if end_date:
+            sql += ' AND date < ?'
+            params.append(end_date)
+        rows = self._execute(sql + ' ORDER BY date', params)
+        return {k: [r[k] for r in rows] for k in ('date', 'value', 'images')}
+
+    def latest(self, parameter, sensor, field_ids=None):
+        """Most recent stored value of `parameter` per field: [{'field_id', 'date', 'value'}, ...]."""
+        sql = ('SELECT o.field_id, o.date, o.value FROM observations o JOIN ('
+               ' SELECT field_id, MAX(date) AS date FROM observations WHERE parameter = ? AND sensor = ?'
+               ' GROUP BY field_id) m ON o.field_id = m.field_id AND o.date = m.date'
+               ' WHERE o.parameter = ? AND o.sensor = ?')
+        rows = self._execute(sql + ' ORDER BY o.field_id', (parameter, sensor, parameter, sensor))
+        if field_ids is not None:
+            wanted = set(field_ids)
+            rows = [r for r in rows if r['field_id'] in wanted]
+        return rows
+
+    def fields(self, limit=1000, offset=0):
+        """Registered fields with what is stored for each: [{'field_id', 'coverage': [...]}, ...]."""
+        ids = [r['field_id'] for r in self._execute(
+            'SELECT field_id FROM fields ORDER BY field_id LIMIT ? OFFSET ?', (limit, offset))]
+        if not ids:
+            return []
+        rows = self._execute(
+            'SELECT c.field_id, c.parameter, c.sensor, c.checked_until, COUNT(o.date) AS observations '
+            'FROM coverage c LEFT JOIN observations o ON o.field_id = c.field_id AND o.parameter = c.parameter '
+            'AND o.sensor = c.sensor WHERE c.field_id IN (%s) GROUP BY c.field_id, c.parameter, c.sensor'
+            % ','.join('?' * len(ids)), ids)
+        coverage = {}
+        for r in rows:
+            coverage.setdefault(r.pop('field_id'), []).append(r)
+        return [{'field_id': fid, 'coverage': coverage.get(fid, [])} for fid in ids]
+
+    def stats(self):
+        return {
+            'fields': self._execute('SELECT COUNT(*) AS n FROM fields')[0]['n'],
+            'observations': self._execute('SELECT COUNT(*) AS n FROM observations')[0]['n'],
+            'series': self._execute('SELECT COUNT(*) AS n FROM coverage')[0]['n'],
+        }
+
+
+def from_env():
+    path = os.environ.get('RESULT_STORE_PATH') or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'result_store.sqlite')
+    return ResultStore(path, ingest_lag_days=int(os.environ.get('RESULT_STORE_INGEST_LAG', '3')))
@@ -0,0 +1,90 @@
+# Offline checks of the local GP engine against a direct NumPy evaluation of the JS model formula.
+import numpy as np
+import pytest
+import gp_local, model_bundle, models
+
+
+@pytest.fixture(scope='module')
+def vals():
+    vals = model_bundle.load_values(models._JS_FILE_PATH, write=False)
+    gp_local.init_from_values(vals)
+    return vals
+
+
+def _coefficients(vals, suffix):
+    get = lambda var: np.asarray(vals[var + '_' + suffix], dtype=np.float64)
+    return {
+        'X_train': get('X_train'), 'mx': get('mx').ravel(), 'sx': get('sx').ravel(),
+        'hyp_ell': get('hyp_ell').ravel(), 'hyp_sig': float(vals['hyp_sig_' + suffix]),
+        'alpha': get('alpha_coefficients').ravel(),
+    }
+
+
+def js_mean(c, x):
+    """The calculate_* formula of the JS: kernel vector (k_star * arg1) times alpha, written out as the squared
+    distance to every training sample instead of the pre-computed XDX terms."""
+    x_norm = (x - c['mx']) / c['sx']
+    diff = x_norm[:, None, :] - c['X_train'][None, :, :]
+    kernel = c['hyp_sig'] * np.exp(-0.5 * np.einsum('pij,j,pij->pi', diff, c['hyp_ell'], diff))
+    return kernel @ c['alpha']
+
+
+def training_reflectance(c):
+    """The training samples in reflectance units, i.e. inputs the models are known to cover."""
+    return c['X_train'] * c['sx'] + c['mx']
+
+
+@pytest.mark.parametrize('name', ['CWC', 'CCC'])
+def test_predict_matches_js_formula(vals, name):
+    c = _coefficients(vals, gp_local.MODEL_SUFFIXES[name])
+    x = training_reflectance(c)
+    expected = js_mean(c, x) + float(vals['mean_model_' + gp_local.MODEL_SUFFIXES[name]])
+    expected[expected < 0] = 0.00001
+    np.testing.assert_allclose(gp_local.predict(name, x), expected, rtol=1e-9, atol=1e-12)
+
+
+def test_predict_keeps_leading_shape_and_chunks(vals):
+    c = _coefficients(vals, 'Cw')
+    x = training_reflectance(c)[:12]
+    whole = gp_local.predict('CWC', x)
+    np.testing.assert_allclose(gp_local.predict('CWC', x.reshape(3, 4, -1), chunk_size=5), whole.reshape(3, 4), rtol=1e-12)
+
+
+def test_predict_rejects_wrong_band_count(vals):
+    with pytest.raises(ValueError):
+        gp_local.predict('CWC', np.zeros((4, len(models.MODEL_BANDS) - 1)))
+
+
+def test_lai_leaves_out_the_mean_and_masks_nonpositive(vals):
+    # calculate_LAI_GREEN has the mean step commented out and masks pixels <= 0
+    c = _coefficients(vals, 'GREEN')
+    x = training_reflectance(c)
+    expected = js_mean(c, x)
+    expected[expected <= 0] = np.nan
+    lai = gp_local.predict('LAI', x)
+    assert np.isnan(lai).any() and not np.isnan(lai).all()
+    # Small LAI values are differences of terms ~1e3 (hyp_sig), hence the absolute tolerance
+    np.testing.assert_allclose(lai, expected, rtol=1e-9, atol=1e-8)
+
+
+@pytest.mark.parametrize('name', ['CWC', 'CCC', 'LAI'])
+def test_variance_is_about_noise_at_training_inputs(vals, name):
+    c = _coefficients(vals, gp_local.MODEL_SUFFIXES[name])
+    x = training_reflectance(c)
+    mean, variance = gp_local.predict(name, x, return_variance=True)
+    np.testing.assert_array_equal(mean, gp_local.predict(name, x))
+    noise = gp_local._MODELS[name]['noise']
+    valid = ~np.isnan(mean)
+    assert np.array_equal(np.isnan(variance), ~valid)
+    # noise <= var <= 2 noise at a training sample: the data explain all of the prior but the noise
+    assert np.all(variance[valid] >= noise * (1 - 1e-6))
+    assert np.all(variance[valid] <= 2 * noise * (1 + 1e-6))
+
+
+@pytest.mark.parametrize('name', ['CWC', 'CCC'])
+def test_variance_tends_to_the_prior_far_from_training_inputs(vals, name):
+    c = _coefficients(vals, gp_local.MODEL_SUFFIXES[name])
+    far = (c['mx'] + 50 * c['sx'])[None]
+    _, variance = gp_local.predict(name, far, return_variance=True)
+    model = gp_local._MODELS[name]
+    np.testing.assert_allclose(variance, model['hyp_sig'] + model['noise'], rtol=1e-9)
@@ -0,0 +1,20 @@
+# Offline checks that the indices.py functions and the formula registry agree.
+import inspect
+import pytest
+import index_engine, indices
+
+FUNCTIONS = {name: f for name, f in inspect.getmembers(indices, inspect.isfunction) if f.__module__ == 'indices'}
+
+
+def test_every_function_is_a_registered_index():
+    assert FUNCTIONS
+    assert not set(FUNCTIONS) - set(indices.INDEX_EXPRESSIONS)
+
+
+@pytest.mark.parametrize('name', sorted(FUNCTIONS))
+def test_function_band_is_named_after_its_registry_key(monkeypatch, name):
+    # evaluate_ee names each output band after the index it evaluates
+    calls = []
+    monkeypatch.setattr(index_engine, 'evaluate_ee', lambda image, names, params=None: calls.append(names) or names)
+    assert FUNCTIONS[name](object()) == [name]
+    assert calls == [[name]]
@@ -0,0 +1,27 @@
+# Offline checks of the job store: a job blocked in one long call must not be claimed twice.
+import threading, time
+import jobs
+
+
+def test_long_running_job_is_not_claimed_twice(tmp_path):
+    runs = []
+    release = threading.Event()
+
+    @jobs.handler('test_long_call')
+    def long_call(params, ctx):
+        runs.append(time.time())
+        release.wait(5)
+        return {'ok': True}
+
+    manager = jobs.JobManager(str(tmp_path / 'jobs.sqlite'), workers=2, stale_after=0.3)
+    job = manager.submit('test_long_call', {})
+    # Well past stale_after without any progress update from the handler
+    time.sleep(1.0)
+    assert manager.resume() == 0
+    time.sleep(0.2)
+    release.set()
+    deadline = time.time() + 5
+    while manager.get(job['id'])['status'] != jobs.SUCCEEDED and time.time() < deadline:
+        time.sleep(0.05)
+    assert manager.get(job['id'])['status'] == jobs.SUCCEEDED
+    assert len(runs) == 1
@@ -0,0 +1,38 @@
+# Offline checks of worker start-up when Earth Engine is not (yet) initialised.
+import threading
+import pytest
+import ee_client, lifecycle, models
+
+
+@pytest.fixture
+def state(monkeypatch):
+    fresh = dict(lifecycle._state, model_version=None, model_values=None, models_built=False, ee_ready=False,
+                 ee_error=None)
+    monkeypatch.setattr(lifecycle, '_state', fresh)
+    return fresh
+
+
+def test_startup_without_earth_engine_does_not_build_models(monkeypatch, state):
+    def init():
+        raise RuntimeError('Please authorize access to your Earth Engine account')
+    retrying = threading.Event()
+    ready = []
+    monkeypatch.setattr(ee_client, 'init', init)
+    monkeypatch.setattr(lifecycle, '_retry_ee', lambda on_ready: retrying.set())
+    # The real ee library: building the model objects here would raise "not initialized"
+    lifecycle.startup(on_ready=lambda: ready.append(True))
+    status = lifecycle.status()
+    assert status['models']['loaded'] and not status['models']['built']
+    assert not status['ready'] and 'authorize' in status['earth_engine']['error']
+    assert not ready
+    assert retrying.wait(5)
+
+
+def test_models_are_built_once_earth_engine_is_ready(monkeypatch, state):
+    built = []
+    monkeypatch.setattr(ee_client, 'init', lambda: None)
+    monkeypatch.setattr(models, 'init_from_values', built.append)
+    ready = []
+    lifecycle.startup(on_ready=lambda: ready.append(lifecycle.status()['ready']))
+    lifecycle.build_models()
+    assert len(built) == 1 and ready == [True]
@@ -0,0 +1,12 @@
+# Offline checks of the precompiled coefficient bundle.
+import os, stat
+import model_bundle
+
+
+def test_bundle_is_readable_by_other_users(tmp_path):
+    js = tmp_path / 'model.js'
+    js.write_text('var a = [1, 2];\n')
+    path = model_bundle.compile_bundle(str(js), str(tmp_path / 'bundle.npz'), vals={'a': [1.0, 2.0]})
+    assert stat.S_IMODE(os.stat(path).st_mode) & 0o044 == 0o044
+    meta, vals = model_bundle.read_bundle(path)
+    assert vals == {'a': [1.0, 2.0]} and meta['version'] == model_bundle.BUNDLE_VERSION
@@ -0,0 +1,37 @@
+# Offline checks of the JS coefficient parser.
+import numpy as np
+import pytest
+import models
+
+
+@pytest.fixture(scope='module')
+def parsed():
+    return models.parse_js_variables(models._JS_FILE_PATH)
+
+
+@pytest.mark.parametrize('suffix', ['Cw', 'CCC', 'GREEN'])
+def test_xdx_pre_calc_is_the_diagonal_of_x_d_xt(parsed, suffix):
+    X = np.asarray(parsed['X_train_' + suffix], dtype=np.float64)
+    hyp_ell = np.ravel(parsed['hyp_ell_' + suffix])
+    expected = np.einsum('ij,j,ij->i', X, hyp_ell, X)
+    np.testing.assert_allclose(np.ravel(parsed['XDX_pre_calc_' + suffix]), expected, rtol=1e-9)
+
+
+def test_every_target_variable_is_parsed(parsed):
+    assert sorted(parsed) == sorted(models._TARGET_VARS)
+    assert not [k for k, v in parsed.items() if isinstance(v, dict)]
+
+
+def test_line_comments_are_ignored(tmp_path):
+    js = tmp_path / 'model.js'
+    js.write_text(
+        'var a = ee.Array([1, 2])//.multiply(1.0e+1)\n'
+        '// var b = 5;\n'
+        'var b = [3.5e+00, -4] ;\n'
+        'var c = ee.Array([2]).multiply(1.0e+2);\n'
+        'var d = 7\n'
+        'var e = 8;\n',
+        encoding='utf-8',
+    )
+    vals = models.parse_js_variables(str(js), targets=['a', 'b', 'c', 'd', 'e'])
+    assert vals == {'a': [1, 2], 'b': [3.5, -4], 'c': [200.0], 'd': 7, 'e': 8}
@@ -0,0 +1,29 @@
+# Offline checks of the SQLite result cache: expired and surplus rows do not accumulate.
+import time
+import result_cache
+
+
+def test_expired_row_is_deleted_on_read(tmp_path):
+    backend = result_cache.SQLiteBackend(str(tmp_path / 'cache.sqlite'), purge_interval=3600)
+    backend.set('old', {'mean': 1.0}, expires=time.time() - 1)
+    assert len(backend) == 1
+    assert backend.get('old') is None
+    assert len(backend) == 0
+
+
+def test_purge_drops_expired_and_oldest_rows(tmp_path):
+    backend = result_cache.SQLiteBackend(str(tmp_path / 'cache.sqlite'), maxrows=3, purge_interval=3600)
+    backend.set('expired', 1, expires=time.time() - 1)
+    for i in range(5):
+        backend.set('k%d' % i, i)
+    backend.set('k0', 0)
+    assert backend.purge() == 3
+    assert len(backend) == 3
+    assert [k for k in ('k0', 'k1', 'k2', 'k3', 'k4') if backend.get(k) is not None] == ['k0', 'k3', 'k4']
+
+
+def test_set_purges_periodically(tmp_path):
+    backend = result_cache.SQLiteBackend(str(tmp_path / 'cache.sqlite'), maxrows=2, purge_interval=0)
+    for i in range(5):
+        backend.set('k%d' % i, i)
+    assert len(backend) == 2
@@ -0,0 +1,35 @@
+# Offline checks of the tile cache accounting and the layer display ranges.
+import os
+import models, tiles, zonal_stats
+
+
+def _disk_bytes(root):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+
+
+def test_overwriting_a_tile_counts_its_size_once(tmp_path):
+    cache = tiles.TileCache(str(tmp_path), max_bytes=10000)
+    for size in (100, 300, 200):
+        cache.put('layer', 3, 1, 2, b'x' * size)
+    assert cache.stats()['bytes'] == 200 == _disk_bytes(str(tmp_path))
+    assert cache.stats()['evictions'] == 0
+
+
+def test_eviction_removes_least_recently_used_tiles(tmp_path):
+    cache = tiles.TileCache(str(tmp_path), max_bytes=1000)
+    for y in range(10):
+        cache.put('layer', 3, 1, y, b'x' * 100)
+        os.utime(cache._path('layer', 3, 1, y), (y, y))
+    cache.put('layer', 3, 1, 10, b'x' * 100)
+    assert cache.stats()['evictions'] == 2
+    assert cache.get('layer', 3, 1, 0) is None and cache.get('layer', 3, 1, 1) is None
+    assert cache.get('layer', 3, 1, 10) is not None
+    assert cache.stats()['bytes'] == 900 == _disk_bytes(str(tmp_path))
+
+
+def test_model_layers_use_the_shared_display_ranges():
+    assert set(models.DISPLAY_RANGES) == set(models.MODEL_FUNCTIONS)
+    for name, (lo, hi) in models.DISPLAY_RANGES.items():
+        vis = tiles.layer_vis(name)
+        assert (vis['min'], vis['max']) == (lo, hi)
+        assert zonal_stats.HISTOGRAM_RANGES[name] == (lo, hi)
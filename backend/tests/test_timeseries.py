@@ -0,0 +1,23 @@
+# Offline checks of the client-side half of timeseries.extract_fields.
+import timeseries
+
+
+def test_pivot_keeps_rows_with_a_masked_band():
+    columns = {
+        'field_id': ['a', 'a', 'a', 'b'],
+        'date': ['2024-07-01', '2024-07-01', '2024-07-01', '2024-07-01'],
+        'image': ['T43RFM', 'T43RFM', 'T43RGM', 'T43RFM'],
+        'band': ['Ccc', 'Lai', 'Ccc', 'Ccc'],
+        'value': [40.0, 1.5, 42.0, 38.0],
+    }
+    assert timeseries.pivot_field_rows(columns, ['Ccc', 'Lai']) == {
+        'field_id': ['a', 'a', 'b'],
+        'date': ['2024-07-01', '2024-07-01', '2024-07-01'],
+        'Ccc': [40.0, 42.0, 38.0],
+        'Lai': [1.5, None, None],
+    }
+
+
+def test_pivot_of_no_rows():
+    empty = {n: [] for n in ('field_id', 'date', 'image', 'band', 'value')}
+    assert timeseries.pivot_field_rows(empty, ['Cw']) == {'field_id': [], 'date': [], 'Cw': []}
@@ -0,0 +1,28 @@
+# Offline checks of how reducer output is turned back into statistics.
+import pytest
+import zonal_stats
+
+
+@pytest.mark.parametrize('bins', [1, 2, 5])
+def test_fixed_histogram_edges_come_from_the_range(bins):
+    spec = zonal_stats.spec(['histogram'], bins=bins)
+    width = 7 / bins
+    rows = [[i * width, i + 1] for i in range(bins)]
+    out = zonal_stats.unpack({'Lai_histogram': rows, 'Lai_count': 10}, 'Lai', spec, ['Lai'])
+    assert out['histogram']['edges'] == pytest.approx([i * width for i in range(bins + 1)])
+    assert out['histogram']['counts'] == list(range(1, bins + 1))
+
+
+def test_data_driven_histogram_edges():
+    spec = zonal_stats.spec(['histogram'], bins=2)
+    props = {'NDBI_histogram': {'bucketMin': -0.5, 'bucketWidth': 0.25, 'histogram': [3, 4]}}
+    # Lai and NDBI share one reducer and have no common fixed range, so the buckets follow the data
+    out = zonal_stats.unpack(props, 'NDBI', spec, ['Lai', 'NDBI'])
+    assert out['histogram'] == {'edges': [-0.5, -0.25, 0.0], 'counts': [3, 4]}
+
+
+def test_percentiles_and_count():
+    spec = zonal_stats.spec(['mean', 'percentiles'], percentiles=[12.5, 90])
+    props = {'Cw_mean': 0.02, 'Cw_p12_5': 0.01, 'Cw_p90': 0.03, 'Cw_count': 40}
+    assert zonal_stats.unpack(props, 'Cw', spec) == {
+        'mean': 0.02, 'percentiles': {'p12_5': 0.01, 'p90': 0.03}, 'count': 40}
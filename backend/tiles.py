@@ -0,0 +1,202 @@
+# tiles.py
+# Rendered, disk-cached XYZ map tiles for index and biophysical layers.
+#
+# Pointing a map straight at live Earth Engine tile URLs (as ui_streamlit.py does with getMapId) recomputes
+# every tile on every pan and zoom. TileRenderer asks EE for a map id once per layer + date window and fetches
+# tiles through it; TileCache keeps the PNGs on disk with least-recently-used eviction, so repeated views and
+# pre-seeded farm areas are served without touching EE.
+#
+# Configuration (environment):
+#   TILE_CACHE_DIR      tile directory (default: tile_cache next to this file)
+#   TILE_CACHE_MAX_MB   size limit before the least recently used tiles are evicted (default 1024)
+import hashlib, json, math, os, threading, time
+from functools import lru_cache
+import ee_client, models
+
+TILE_SIZE = 256
+
+# Palette the JS app uses for index layers
+INDEX_PALETTE = ['ce7e45', 'fcd163', '99b718', '66a000', '004c00']
+
+
+@lru_cache(maxsize=None)
+def lai_palette():
+    """LAIG_palette from the JS source (parsed once)."""
+    palette = models.parse_js_variables(models._JS_FILE_PATH, targets=['LAIG_palette']).get('LAIG_palette')
+    if not isinstance(palette, list):
+        return INDEX_PALETTE
+    return [c.lstrip('#') for c in palette]
+
+
+def layer_vis(layer):
+    """Visualisation parameters of a layer; the model ranges are the *_min_th / *_max_th values of the JS app."""
+    if layer in models.DISPLAY_RANGES:
+        lo, hi = models.DISPLAY_RANGES[layer]
+        return {'min': lo, 'max': hi, 'palette': lai_palette() if layer == 'Lai' else INDEX_PALETTE}
+    return {'min': 0, 'max': 1, 'palette': INDEX_PALETTE}
+
+
+def layer_key(layer, **params):
+    """Stable directory name for a layer rendered with `params` (dates, cloud cover, vis, model version)."""
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:20]
+    return '%s-%s' % (layer, digest)
+
+
+def tile_bounds(z, x, y):
+    """(west, south, east, north) in degrees of a Web Mercator XYZ tile."""
+    n = 2 ** z
+
+    def lat(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+
+def tiles_for_bounds(bounds, z):
+    """All (x, y) tiles at zoom `z` covering (west, south, east, north)."""
+    west, south, east, north = bounds
+    n = 2 ** z
+
+    def tx(lon):
+        return min(n - 1, max(0, int((lon + 180.0) / 360.0 * n)))
+
+    def ty(lat):
+        lat = max(-85.0511, min(85.0511, lat))
+        r = math.radians(lat)
+        return min(n - 1, max(0, int((1 - math.log(math.tan(r) + 1 / math.cos(r)) / math.pi) / 2 * n)))
+    for x in range(tx(west), tx(east) + 1):
+        for y in range(ty(north), ty(south) + 1):
+            yield x, y
+
+
+class TileCache:
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # Held by the one thread evicting; tile requests only take _lock, briefly
+        self._evict_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._size = sum(os.path.getsize(p) for p, _ in self._files())
+
+    def _files(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith('.png'):
+                    path = os.path.join(dirpath, name)
+                    try:
+                        yield path, os.stat(path).st_mtime
+                    except OSError:
+                        pass
+
+    def _path(self, key, z, x, y):
+        return os.path.join(self.root, key, str(z), str(x), '%d.png' % y)
+
+    def get(self, key, z, x, y):
+        path = self._path(key, z, x, y)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        # mtime records last use for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def contains(self, key, z, x, y):
+        return os.path.exists(self._path(key, z, x, y))
+
+    def put(self, key, z, x, y, data):
+        path = self._path(key, z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(tmp, path)
+        with self._lock:
+            self._size += len(data) - replaced
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used tiles until the cache is at 90% of its limit.
+
+        The cache tree is walked without holding _lock, so tiles keep being served meanwhile. A thread that
+        finds another one evicting returns at once."""
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            with self._lock:
+                counted = self._size
+            files = []
+            for path, mtime in self._files():
+                try:
+                    files.append((mtime, os.path.getsize(path), path))
+                except OSError:
+                    pass
+            files.sort()
+            size = sum(file_size for _, file_size, _ in files)
+            target = self.max_bytes * 0.9
+            evicted = 0
+            for _, file_size, path in files:
+                if size <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                size -= file_size
+                evicted += 1
+            with self._lock:
+                # Tiles written while walking were counted in _size already; keep them on top of the new total
+                self._size = size + (self._size - counted)
+                self.evictions += evicted
+        finally:
+            self._evict_lock.release()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'bytes': self._size, 'max_bytes': self.max_bytes}
+
+
+class TileRenderer:
+    """Renders tiles through an EE map id, requested once per layer key and reused until it expires."""
+
+    def __init__(self, mapid_ttl=3600):
+        self.mapid_ttl = mapid_ttl
+        self._mapids = {}
+        self._lock = threading.Lock()
+
+    def _tile_fetcher(self, key, image_fn, vis):
+        now = time.time()
+        with self._lock:
+            entry = self._mapids.get(key)
+        if entry is None or entry[0] < now:
+            mapid = ee_client.call('getMapId', image_fn().getMapId, vis)
+            entry = (now + self.mapid_ttl, mapid['tile_fetcher'])
+            with self._lock:
+                self._mapids[key] = entry
+        return entry[1]
+
+    def render(self, key, image_fn, vis, z, x, y):
+        """PNG bytes of tile z/x/y. `image_fn()` builds the ee.Image of the layer (only called on a map id miss)."""
+        return ee_client.call('fetch_tile', self._tile_fetcher(key, image_fn, vis).fetch_tile, x=x, y=y, z=z)
+
+
+def cache_from_env():
+    root = os.environ.get('TILE_CACHE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tile_cache')
+    return TileCache(root, int(float(os.environ.get('TILE_CACHE_MAX_MB', '1024')) * 1024 * 1024))
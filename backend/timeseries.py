@@ -0,0 +1,143 @@
+# timeseries.py
+# Server-side time-series extraction over an AOI.
+#
+# Every image (or temporal bin) of a filtered ImageCollection is turned into a parameter image, reduced over
+# the AOI on the Earth Engine side and stored as a feature property. The whole series then comes back in one
+# getInfo() as columns, instead of one request per date. extract_fields() does the same for many fields at once,
+# one row per field and image (used by result_store updates).
+#
+# Usage:
+#   import timeseries
+#   series = timeseries.extract(collection, aoi, lambda img: indices.OSAVI(img), 'OSAVI',
+#                               start_date='2024-01-01', end_date='2024-06-01', binning='month')
+#   # {'date': ['2024-01-01', ...], 'value': [0.41, ...], 'images': [6, ...]}
+import datetime
+import ee
+import ee_client
+
+BINNINGS = (None, 'day', 'week', 'month')
+
+
+def _parse_date(value):
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+def bin_edges(start_date, end_date, binning):
+    """Client-side list of (start, end) ISO date pairs covering [start_date, end_date)."""
+    start, end = _parse_date(start_date), _parse_date(end_date)
+    edges = []
+    current = start
+    while current < end:
+        if binning == 'day':
+            nxt = current + datetime.timedelta(days=1)
+        elif binning == 'week':
+            nxt = current + datetime.timedelta(days=7)
+        elif binning == 'month':
+            nxt = (current.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+        else:
+            raise ValueError('Unknown binning: %s' % binning)
+        edges.append((current.isoformat(), min(nxt, end).isoformat()))
+        current = nxt
+    return edges
+
+
+def _mean(image, aoi, band, scale):
+    return image.reduceRegion(
+        ee.Reducer.mean(), geometry=aoi, scale=scale, maxPixels=1e13, tileScale=2
+    ).get(band)
+
+
+def series_collection(collection, aoi, image_fn, band, scale=10, binning=None, start_date=None, end_date=None):
+    """FeatureCollection with one property-only feature per image (or bin): `date`, `value` and `images`
+    (number of images reduced). `image_fn` maps an image to a single-band image named `band`."""
+    if binning is None:
+        def per_image(img):
+            img = ee.Image(img)
+            return ee.Feature(None, {
+                'date': img.date().format('YYYY-MM-dd'),
+                'value': _mean(image_fn(img), aoi, band, scale),
+                'images': 1,
+            })
+        return ee.FeatureCollection(collection.map(per_image))
+
+    features = []
+    for bin_start, bin_end in bin_edges(start_date, end_date, binning):
+        subset = collection.filterDate(bin_start, bin_end)
+        size = subset.size()
+        # The median of an empty bin has no bands and image_fn would fail on them, so an empty bin is given a
+        # null value (dropped in extract) on the server, without an extra size() round trip. If only evaluates
+        # the branch it takes.
+        features.append(ee.Feature(None, {
+            'date': bin_start,
+            'value': ee.Algorithms.If(size.gt(0), _mean(image_fn(subset.median()), aoi, band, scale), None),
+            'images': size,
+        }))
+    return ee.FeatureCollection(features)
+
+
+def extract(collection, aoi, image_fn, band, scale=10, binning=None, start_date=None, end_date=None):
+    """Return the series as columns {'date': [...], 'value': [...], 'images': [...]}, sorted by date.
+    Dates with no valid pixels are dropped. Costs a single getInfo() call."""
+    if binning not in BINNINGS:
+        raise ValueError('binning must be one of %s' % (BINNINGS,))
+    fc = series_collection(collection, aoi, image_fn, band, scale, binning, start_date, end_date)
+    # Drop nulls before aggregating so the columns stay aligned
+    fc = fc.filter(ee.Filter.notNull(['value'])).sort('date')
+    columns = ee_client.call('timeseries', ee.Dictionary({
+        'date': fc.aggregate_array('date'),
+        'value': fc.aggregate_array('value'),
+        'images': fc.aggregate_array('images'),
+    }).getInfo)
+    return {k: columns.get(k, []) for k in ('date', 'value', 'images')}
+
+
+def _field_rows(band, date, image_id):
+    def row(f):
+        return ee.Feature(None, {'field_id': f.get('field_id'), 'date': date, 'image': image_id,
+                                 'band': band, 'value': f.get(band)})
+    return row
+
+
+def pivot_field_rows(columns, bands):
+    """Turn the long columns of extract_fields ({'field_id', 'date', 'image', 'band', 'value'}, one entry per
+    field, image and band with a value) back into one row per field and image with a column per band, None
+    where the band had no valid pixel."""
+    rows = {}
+    for fid, date, image_id, band, value in zip(
+            columns['field_id'], columns['date'], columns['image'], columns['band'], columns['value']):
+        rows.setdefault((fid, date, image_id), {})[band] = value
+    out = {n: [] for n in ['field_id', 'date'] + list(bands)}
+    for (fid, date, _), values in sorted(rows.items(), key=lambda item: (str(item[0][0]), item[0][1], item[0][2])):
+        out['field_id'].append(fid)
+        out['date'].append(date)
+        for band in bands:
+            out[band].append(values.get(band))
+    return out
+
+
+def extract_fields(collection, fields, image_fn, bands, scale=10):
+    """Mean of every band of `bands` per field and image, for many fields at once. `fields` is a
+    FeatureCollection with a `field_id` property; `image_fn` maps an image to an image with `bands`.
+    Returns columns {'field_id': [...], 'date': [...], <band>: [...]}, one row per field and image with at
+    least one valid band; a band with no valid pixels over a field is None in that row. Costs a single getInfo()
+    call."""
+    bands = list(bands)
+    # A single-band reduction would otherwise be named 'mean' instead of after the band
+    reducer = ee.Reducer.mean().setOutputs(bands) if len(bands) == 1 else ee.Reducer.mean()
+
+    def per_image(img):
+        img = ee.Image(img)
+        date = img.date().format('YYYY-MM-dd')
+        image_id = img.get('system:index')
+        reduced = image_fn(img).reduceRegions(collection=fields, reducer=reducer, scale=scale, tileScale=2)
+        # One row per field and band with a value, so a band masked over a field (LAI <= 0, say) drops only
+        # that value and not the field's other bands. aggregate_array skips nulls, so a wide row with a null
+        # would misalign the columns.
+        return ee.FeatureCollection([
+            reduced.filter(ee.Filter.notNull([band])).map(_field_rows(band, date, image_id)) for band in bands
+        ]).flatten()
+
+    fc = ee.FeatureCollection(collection.map(per_image)).flatten()
+    names = ['field_id', 'date', 'image', 'band', 'value']
+    columns = ee_client.call('field_series', ee.Dictionary({n: fc.aggregate_array(n) for n in names}).getInfo)
+    return pivot_field_rows({n: columns.get(n, []) for n in names}, bands)
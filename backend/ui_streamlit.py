@@ -1,18 +1,47 @@
 # ui_streamlit.py
 # Streamlit app that mimics the original EE JS UI for selecting indices and running calculations.
+#
+# Streamlit reruns this script on every interaction. Earth Engine, the model coefficients and the sample image
+# are set up once per server process with st.cache_resource and shared by all sessions; folium is only imported
+# when a preview is first rendered.
 import streamlit as st
 import ee
 from ee_helpers import init, get_sample_image
 import indices as idx
+import lifecycle, models, tiles
 
 st.set_page_config(page_title="PUSA eEMS - Streamlit Port", layout="wide")
 
 st.title("PUSA eEMS — Streamlit port of Earth Engine JS UI")
 st.markdown("This app initializes Earth Engine and exposes several spectral indices translated from the original JS code.")
 
+
+@st.cache_resource(show_spinner="Initializing Earth Engine...")
+def earth_engine():
+    # A failure raises and is not cached, so the next rerun tries again
+    init(ask_auth=False)
+    return True
+
+
+@st.cache_resource(show_spinner="Loading model coefficients...")
+def model_functions():
+    lifecycle.build_models()
+    return models.MODEL_FUNCTIONS
+
+
+@st.cache_resource
+def sample_image():
+    return get_sample_image()
+
+
+@st.cache_data
+def sample_centroid():
+    return sample_image().geometry().centroid().getInfo()['coordinates'][::-1]  # lat, lon
+
+
 # Initialize EE
 try:
-    init(ask_auth=False)
+    earth_engine()
     st.success("Initialized Earth Engine")
 except Exception as e:
     st.error(f"Could not initialize Earth Engine: {e}. If running locally, authenticate by running `earthengine authenticate`.")
@@ -42,26 +71,38 @@ index_options = {
     'NormG': idx.NormG,
 }
 
+# Biophysical models of the original app, on the same sample image
+try:
+    index_options.update(model_functions())
+except Exception as e:
+    # A missing model file says which setting to change; Earth Engine errors are shown as they are
+    st.warning(f"Biophysical models not available: {type(e).__name__}: {e}")
+
 selected_index = st.selectbox("Choose index", list(index_options.keys()))
 
 st.sidebar.header("Map / Image selection")
 use_sample = st.sidebar.checkbox("Use sample Sentinel-2 image", value=True)
 
 if use_sample:
-    image = get_sample_image()
+    image = sample_image()
     st.sidebar.write("Using a sample S2 image (2020, low cloud)")
 else:
     st.sidebar.text("Custom image filters not implemented in this scaffold.")
 
 if st.button("Run index on sample image"):
     func = index_options[selected_index]
-    result = func(image)
+    # The models take the Sentinel-2 bands they were trained on; display ranges are those of the map tiles
+    if selected_index in models.MODEL_FUNCTIONS:
+        result = func(image.select(models.MODEL_BANDS))
+    else:
+        result = func(image)
+    vis = tiles.layer_vis(selected_index)
+    vmin, vmax = vis['min'], vis['max']
     # Create a small map preview using folium
     import folium
     from streamlit_folium import st_folium
-    centroid = image.geometry().centroid().getInfo()['coordinates'][::-1]  # lat, lon
-    m = folium.Map(location=centroid, zoom_start=8)
-    viz_params = {'min': 0, 'max': 1, 'palette': ['blue','white','green']}
+    m = folium.Map(location=sample_centroid(), zoom_start=8)
+    viz_params = {'min': vmin, 'max': vmax, 'palette': ['blue','white','green']}
     try:
         vis = result.getMapId(viz_params)
         folium.TileLayer(
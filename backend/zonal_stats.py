@@ -0,0 +1,132 @@
+# zonal_stats.py
+# Distribution statistics of parameter images over a region, computed in a single reducer pass.
+#
+# Every requested statistic (mean, standard deviation, percentiles, histogram, pixel count, ...) is a reducer;
+# they are joined with ee.Reducer.combine(sharedInputs=True) and repeated per parameter band with forEach, so one
+# reduceRegion (or reduceRegions for many fields) returns the whole distribution. The composite is built and
+# read once, where separate requests per statistic would each rebuild it.
+#
+# Output properties are named <parameter>_<output> (e.g. Lai_mean, Lai_p90, Lai_histogram) for a single band
+# and for a FeatureCollection alike; unpack() turns them back into one dict per parameter.
+#
+# Usage:
+#   spec = zonal_stats.spec(['mean', 'percentiles', 'histogram'], percentiles=[10, 50, 90])
+#   props = image.reduceRegion(zonal_stats.reducer(spec, ['Lai']), geometry=aoi, scale=10).getInfo()
+#   zonal_stats.unpack(props, 'Lai', spec, ['Lai'])
+#   # {'mean': 2.1, 'percentiles': {'p10': 0.9, ...}, 'histogram': {'edges': [...], 'counts': [...]}, 'count': 812}
+import ee
+import models
+
+STATISTICS = ('mean', 'std', 'min', 'max', 'sum', 'median', 'mode', 'percentiles', 'histogram', 'count')
+DEFAULT_STATISTICS = ('mean', 'std', 'percentiles', 'histogram', 'count')
+DEFAULT_PERCENTILES = (10, 25, 50, 75, 90)
+DEFAULT_BINS = 20
+MAX_BINS = 1000
+
+# Fixed histogram ranges of the models: the display thresholds of the JS app. Other parameters get
+# data-driven buckets unless a range is given.
+HISTOGRAM_RANGES = models.DISPLAY_RANGES
+
+# Reducer output names of each statistic (percentiles and histogram are handled separately)
+_OUTPUTS = {'mean': 'mean', 'std': 'stdDev', 'min': 'min', 'max': 'max', 'sum': 'sum', 'median': 'median',
+            'mode': 'mode', 'count': 'count'}
+
+
+def spec(statistics=DEFAULT_STATISTICS, percentiles=DEFAULT_PERCENTILES, bins=DEFAULT_BINS, hist_range=None):
+    """Validated description of the statistics to compute. Raises ValueError for unknown statistics, or
+    percentiles / bins / range out of bounds."""
+    statistics = list(dict.fromkeys(statistics))
+    unknown = [s for s in statistics if s not in STATISTICS]
+    if unknown or not statistics:
+        raise ValueError('statistics must be a list of %s' % ', '.join(STATISTICS))
+    percentiles = sorted({float(p) for p in percentiles}) if 'percentiles' in statistics else []
+    if 'percentiles' in statistics and (not percentiles or percentiles[0] < 0 or percentiles[-1] > 100):
+        raise ValueError('percentiles must be between 0 and 100')
+    if not 1 <= int(bins) <= MAX_BINS:
+        raise ValueError('bins must be between 1 and %d' % MAX_BINS)
+    if hist_range is not None and not hist_range[0] < hist_range[1]:
+        raise ValueError('histogram range must have min < max')
+    return {'statistics': statistics, 'percentiles': percentiles, 'bins': int(bins), 'hist_range': hist_range}
+
+
+def histogram_range(spec, parameters):
+    """Fixed (min, max) of the histogram, or None for data-driven buckets."""
+    if spec['hist_range'] is not None:
+        return spec['hist_range']
+    ranges = {HISTOGRAM_RANGES.get(p) for p in parameters}
+    # One reducer is repeated for every band, so a fixed range only applies when all parameters share it
+    return ranges.pop() if len(ranges) == 1 else None
+
+
+def _percentile_name(p):
+    return ('p%g' % p).replace('.', '_')
+
+
+def reducer(spec, parameters):
+    """One reducer computing every statistic of `spec` for each band of a `parameters` image."""
+    # count is always computed: it is cheap, tells an empty region from a zero value, and keeps the reducer
+    # multi-output so forEach names every output <parameter>_<output>
+    names = [s for s in spec['statistics'] if s in _OUTPUTS and s not in ('min', 'max')] + ['count']
+    parts = []
+    for s in dict.fromkeys(names):
+        parts.append({'mean': ee.Reducer.mean, 'std': ee.Reducer.stdDev, 'sum': ee.Reducer.sum,
+                      'median': ee.Reducer.median, 'mode': ee.Reducer.mode, 'count': ee.Reducer.count}[s]())
+    if 'min' in spec['statistics'] or 'max' in spec['statistics']:
+        parts.append(ee.Reducer.minMax())
+    if spec['percentiles']:
+        parts.append(ee.Reducer.percentile(spec['percentiles'], [_percentile_name(p) for p in spec['percentiles']]))
+    if 'histogram' in spec['statistics']:
+        fixed = histogram_range(spec, parameters)
+        if fixed is not None:
+            parts.append(ee.Reducer.fixedHistogram(fixed[0], fixed[1], spec['bins']))
+        else:
+            parts.append(ee.Reducer.histogram(maxBuckets=spec['bins']))
+    combined = parts[0]
+    for part in parts[1:]:
+        combined = combined.combine(part, sharedInputs=True)
+    return combined.forEach(list(parameters))
+
+
+def output_names(spec, parameters):
+    """Property names reducer() produces, e.g. to select them from a reduceRegions result."""
+    outputs = ['count'] + [_OUTPUTS[s] for s in spec['statistics'] if s in _OUTPUTS]
+    outputs += [_percentile_name(p) for p in spec['percentiles']]
+    if 'histogram' in spec['statistics']:
+        outputs.append('histogram')
+    return ['%s_%s' % (p, o) for p in parameters for o in dict.fromkeys(outputs)]
+
+
+def _histogram(value, fixed=None, bins=None):
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        # ee.Reducer.histogram: {'bucketMin', 'bucketWidth', 'histogram': counts, ...}
+        counts = value.get('histogram') or []
+        lo, width = value.get('bucketMin'), value.get('bucketWidth')
+        if lo is None or width is None:
+            return {'edges': [], 'counts': []}
+        return {'edges': [lo + i * width for i in range(len(counts) + 1)], 'counts': counts}
+    # ee.Reducer.fixedHistogram: [[bucket_min, count], ...], `bins` equal-width buckets over the `fixed` range.
+    # The edges come from the range, since a single bucket has no neighbour to take the width from.
+    rows = list(value)
+    if not rows:
+        return {'edges': [], 'counts': []}
+    lo, hi = fixed
+    return {'edges': [lo + i * (hi - lo) / bins for i in range(bins + 1)], 'counts': [r[1] for r in rows]}
+
+
+def unpack(props, parameter, spec, parameters=None):
+    """Statistics of one parameter from reduceRegion output or feature properties `props`. `parameters` are
+    all the parameters the reducer was built for (default: just this one), which decide the histogram range."""
+    out = {}
+    for s in spec['statistics']:
+        if s == 'percentiles':
+            out[s] = {_percentile_name(p): props.get('%s_%s' % (parameter, _percentile_name(p)))
+                      for p in spec['percentiles']}
+        elif s == 'histogram':
+            out[s] = _histogram(props.get(parameter + '_histogram'),
+                                histogram_range(spec, parameters or [parameter]), spec['bins'])
+        else:
+            out[s] = props.get('%s_%s' % (parameter, _OUTPUTS[s]))
+    out['count'] = props.get(parameter + '_count')
+    return out